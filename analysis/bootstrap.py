@@ -0,0 +1,125 @@
+# ==============================================================
+# ブートストラップ / モンテカルロによるフィット誤差の評価
+# --------------------------------------------------------------
+# 【概要】
+#   フィットスクリプトの誤差 sqrt(diag(pcov)) は、カウントの少ないピークや
+#   DoubleGauss.py のようにパラメータ同士の相関が強いときに当てにならない。
+#   ここではスペクトルのポアソンレプリカを作って1つずつフィットし直し、
+#   パラメータの分布から誤差（パーセンタイル区間）と相関係数を求める。
+#
+#   mode = "bootstrap" : 測定データの各チャンネルを平均としてレプリカを作る
+#   mode = "mc"        : 名目のフィット曲線を平均としてレプリカを作る
+#
+#   ・レプリカは replicas × チャンネル の配列を rng.poisson 1回で作る
+#   ・再フィットは名目のフィット結果を初期値にして（ウォームスタート）、
+#     プロセスプールでコアごとに分けて並列に行う
+#
+# 【使い方】
+#   import spefit, bootstrap
+#   spec = spefit.read_spe('Data.spe')
+#   res  = spefit.fit(spec.counts, 'gauss_pol1', [940, 1060], p0=..., bounds=...)
+#   bs   = bootstrap.run(spec.counts, res, n=1000, bounds=..., seed=1)
+#   bootstrap.print_summary(bs)
+#
+#   名目のフィットとレプリカの再フィットは同じ bounds を使うこと。
+# ==============================================================
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import spefit
+
+N_REPLICAS = 1000
+INTERVAL   = 68.27   # パーセンタイル区間の幅 [%]（±1σ 相当）
+
+
+def poisson_replicas(mean, n, rng):
+    """mean (チャンネル) を平均とするポアソン乱数 n 組。形は (n, チャンネル数)"""
+    mean = np.clip(np.asarray(mean, dtype=float), 0, None)
+    return rng.poisson(mean, size=(n, len(mean))).astype(float)
+
+
+def _fit_chunk(model, x_fit, ys, p0, bounds, maxfev):
+    """ys の各行をフィットする（プロセスプールの中で動く）。失敗した行は nan"""
+    from scipy.optimize import curve_fit
+
+    func = spefit.model_func(model)
+    out = np.full((len(ys), len(p0)), np.nan)
+    for i, y_fit in enumerate(ys):
+        y_fit_safe = np.where(y_fit <= 0, 1e-4, y_fit)
+        try:
+            out[i], _ = curve_fit(
+                func, x_fit, y_fit_safe,
+                sigma=np.sqrt(y_fit_safe), absolute_sigma=True,
+                p0=p0, bounds=bounds, maxfev=maxfev
+            )
+        except (RuntimeError, ValueError):
+            pass
+    return out
+
+
+class BootstrapResult:
+    def __init__(self, nominal, samples, mode, interval):
+        ok = np.all(np.isfinite(samples), axis=1)
+        self.nominal = nominal
+        self.samples = samples[ok]
+        self.failed = int(np.count_nonzero(~ok))
+        self.mode = mode
+        self.interval = interval
+        lo, hi = (100 - interval) / 2, (100 + interval) / 2
+        if len(self.samples) > 1:
+            self.median = np.median(self.samples, axis=0)
+            self.low, self.high = np.percentile(self.samples, [lo, hi], axis=0)
+            self.std = np.std(self.samples, axis=0, ddof=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                self.corr = np.corrcoef(self.samples, rowvar=False)
+        else:
+            nan = np.full(len(nominal.popt), np.nan)
+            self.median = self.low = self.high = self.std = nan
+            self.corr = np.full((len(nan), len(nan)), np.nan)
+
+
+def run(counts, nominal, n=N_REPLICAS, mode="bootstrap", bounds=(-np.inf, np.inf),
+        maxfev=20000, seed=None, workers=None, interval=INTERVAL):
+    """
+    nominal (spefit.fit の結果) のまわりで n 回フィットし直して BootstrapResult を返す。
+    workers は並列に使うプロセス数（None なら CPU 数、1 ならこのプロセスで順に）。
+    """
+    if mode not in ("bootstrap", "mc"):
+        raise ValueError(f"unknown mode: {mode}")
+    func = spefit.model_func(nominal.model)
+    x_fit, y_fit, _, _ = spefit.window(counts, nominal.fit_range)
+    mean = y_fit if mode == "bootstrap" else func(x_fit, *nominal.popt)
+
+    rng = np.random.default_rng(seed)
+    ys = poisson_replicas(mean, n, rng)
+
+    p0 = list(nominal.popt)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or n < 2 * workers:
+        samples = _fit_chunk(nominal.model, x_fit, ys, p0, bounds, maxfev)
+    else:
+        chunks = np.array_split(ys, workers * 4)
+        with ProcessPoolExecutor(workers) as pool:
+            parts = pool.map(_fit_chunk, *zip(*[(nominal.model, x_fit, c, p0, bounds, maxfev) for c in chunks]))
+            samples = np.vstack(list(parts))
+    return BootstrapResult(nominal, samples, mode, interval)
+
+
+def print_summary(bs):
+    res = bs.nominal
+    print(f"\n{bs.mode.capitalize()} Results ({len(bs.samples)} replicas, {bs.failed} failed)")
+    print(f"\n  Parameter        Value (fit)    ± (pcov)       Median       -{bs.interval/2:.1f}%      +{bs.interval/2:.1f}%      Std")
+    print("  " + "-" * 98)
+    for i, name in enumerate(res.names):
+        print(f"  {name:<16s} {res.popt[i]:>11.4e}  {res.perr[i]:>11.4e}  {bs.median[i]:>11.4e}  "
+              f"{bs.low[i] - bs.median[i]:>11.4e}  {bs.high[i] - bs.median[i]:>+11.4e}  {bs.std[i]:>11.4e}")
+    print("  " + "-" * 98)
+
+    print("\n  Correlation")
+    labels = [name.split()[0] for name in res.names]
+    print("        " + "".join(f"{s:>8s}" for s in labels))
+    for s, row in zip(labels, bs.corr):
+        print(f"  {s:>4s}  " + "".join(f"{v:>8.3f}" for v in row))
+    print()
@@ -0,0 +1,184 @@
+# ==============================================================
+# フィット結果のキャッシュ（内容で引く）
+# --------------------------------------------------------------
+# 【概要】
+#   スペクトルも設定も変わっていないフィットをやり直さないためのキャッシュ。
+#   キーは次のもののハッシュ (sha256):
+#     ・フィット範囲のカウント
+#     ・モデル（名前と関数のソース。関数を書き換えれば別のキーになる）
+#     ・fit_range, bounds, 初期値 p0, maxfev
+#   値は popt, pcov, chi2, dof と収束の情報（評価回数・メッセージ）。
+#   フィットに失敗したこともエラーとして覚える（同じ条件ならやはり失敗する）。
+#
+#   ・sqlite3 の1ファイルに保存する（複数のプロセスから同時に使ってよい）
+#   ・max_entries を超えたら最後に使ってから一番時間のたったものから消す (LRU)。
+#     件数を数えるのは EVICT_EVERY 回の書き込みごとなので、その分だけ超えることがある
+#
+# 【使い方】
+#   import spefit, fitcache
+#   cache = fitcache.FitCache('fits.sqlite')
+#   res = cache.fit(spec.counts, 'gauss_pol1', [900, 1100], p_init, p_bounds)   # spefit.fit と同じ
+#   res.cached                       # キャッシュから返したとき True
+#   cache.invalidate(model='gauss_pol1')   # そのモデルの結果を全部消す（引数なしなら全部）
+#   cache.stats()                    # {'hits': .., 'misses': .., 'entries': .., ...}
+# ==============================================================
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+import spefit
+
+CACHE_FILE  = os.path.expanduser("~/.spefit_cache.sqlite")
+MAX_ENTRIES = 100_000
+EVICT_EVERY = 256   # この回数 put するごとに件数を数えて古いものを消す（毎回だと全件を数える）
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fits (
+    key       TEXT PRIMARY KEY,
+    model     TEXT,
+    fit_range TEXT,
+    popt      BLOB,
+    pcov      BLOB,
+    chi2      REAL,
+    dof       INTEGER,
+    nfev      INTEGER,
+    message   TEXT,
+    error     TEXT,
+    created   REAL,
+    used      REAL
+);
+CREATE INDEX IF NOT EXISTS fits_used ON fits (used);
+CREATE INDEX IF NOT EXISTS fits_model ON fits (model);
+"""
+
+
+def model_name(model):
+    if isinstance(model, str):
+        return model
+    return getattr(model, "__qualname__", type(model).__qualname__)
+
+
+def _model_source(model):
+    func = spefit.model_func(model)
+    if hasattr(func, "cache_key"):
+        return func.cache_key()
+    try:
+        return inspect.getsource(func if inspect.isfunction(func) else type(func)).encode()
+    except (OSError, TypeError):
+        return model_name(model).encode()
+
+
+def _bounds_list(bounds, n):
+    lo, hi = bounds
+    return [np.broadcast_to(np.asarray(b, dtype=float), (n,)).tolist() for b in (lo, hi)]
+
+
+def fit_key(counts, model, fit_range, p0, bounds=(-np.inf, np.inf), maxfev=20000):
+    _, y_fit, _, _ = spefit.window(counts, fit_range)
+    h = hashlib.sha256()
+    h.update(y_fit.astype(np.float64).tobytes())
+    h.update(model_name(model).encode())
+    h.update(_model_source(model))
+    settings = {"fit_range": [int(v) for v in fit_range], "p0": [float(v) for v in p0],
+                "bounds": _bounds_list(bounds, len(p0)), "maxfev": int(maxfev)}
+    h.update(json.dumps(settings, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+class FitCache:
+    def __init__(self, path=CACHE_FILE, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._puts = 0
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.executescript(SCHEMA)
+
+    def get(self, key, model=None):
+        """キャッシュにあれば FitResult（失敗を覚えていれば RuntimeError）、なければ None"""
+        row = self.db.execute("SELECT model, fit_range, popt, pcov, chi2, dof, nfev, message, error "
+                              "FROM fits WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        with self.db:
+            self.db.execute("UPDATE fits SET used = ? WHERE key = ?", (time.time(), key))
+        name, fit_range, popt, pcov, chi2, dof, nfev, message, error = row
+        if error is not None:
+            raise RuntimeError(f"{error} (cached)")
+        popt = np.frombuffer(popt, dtype=np.float64).copy()
+        pcov = np.frombuffer(pcov, dtype=np.float64).reshape(len(popt), len(popt)).copy()
+        model = name if model is None else model
+        res = spefit.FitResult(model, json.loads(fit_range), popt, pcov, chi2, dof,
+                               spefit.param_names(model, len(popt)), nfev, message)
+        res.cached = True
+        return res
+
+    def put(self, key, model, fit_range, res=None, error=None):
+        now = time.time()
+        values = (key, model_name(model), json.dumps([int(v) for v in fit_range]),
+                  None if res is None else np.asarray(res.popt, dtype=np.float64).tobytes(),
+                  None if res is None else np.asarray(res.pcov, dtype=np.float64).tobytes(),
+                  None if res is None else float(res.chi2),
+                  None if res is None else int(res.dof),
+                  None if res is None else res.nfev,
+                  None if res is None else res.message,
+                  error, now, now)
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO fits VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", values)
+            if self._puts % EVICT_EVERY == 0:
+                self._evict()
+        self._puts += 1
+
+    def _evict(self):
+        n = self.db.execute("SELECT COUNT(*) FROM fits").fetchone()[0]
+        if n > self.max_entries:
+            cur = self.db.execute("DELETE FROM fits WHERE key IN "
+                                  "(SELECT key FROM fits ORDER BY used LIMIT ?)", (n - self.max_entries,))
+            self.evictions += cur.rowcount
+
+    def fit(self, counts, model, fit_range, p0, bounds=(-np.inf, np.inf), maxfev=20000):
+        """spefit.fit と同じ。キャッシュにあればフィットしない"""
+        key = fit_key(counts, model, fit_range, p0, bounds, maxfev)
+        res = self.get(key, model)   # 失敗を覚えていればここで RuntimeError
+        if res is not None:
+            self.hits += 1
+            return res
+        self.misses += 1
+        try:
+            res = spefit.fit(counts, model, fit_range, p0, bounds, maxfev)
+        except RuntimeError as e:
+            self.put(key, model, fit_range, error=str(e))
+            raise
+        self.put(key, model, fit_range, res)
+        res.cached = False
+        return res
+
+    def invalidate(self, key=None, model=None):
+        """key または model の結果を消す（どちらもなければ全部）。消した数を返す"""
+        with self.db:
+            if key is not None:
+                cur = self.db.execute("DELETE FROM fits WHERE key = ?", (key,))
+            elif model is not None:
+                cur = self.db.execute("DELETE FROM fits WHERE model = ?", (model_name(model),))
+            else:
+                cur = self.db.execute("DELETE FROM fits")
+        return cur.rowcount
+
+    def stats(self):
+        entries, failed = self.db.execute("SELECT COUNT(*), COUNT(error) FROM fits").fetchone()
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else None,
+                "evictions": self.evictions, "entries": entries, "failed_entries": failed,
+                "max_entries": self.max_entries,
+                "bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0}
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,173 @@
+# ==============================================================
+# 複数スペクトルの同時フィット（パラメータの共有）
+# --------------------------------------------------------------
+# 【概要】
+#   同じガンマ線を複数の測定・検出器で見たピークを、幅や中心のずれを共有して
+#   一度にフィットする。各ピーク（フィット範囲）は Fitting_GaussPol1.py と同じ
+#   「ガウス + 1次関数」で、パラメータは
+#     area, 切片, 傾き            : ピークごと
+#     sigma                       : share_sigma=True なら同じ line（ガンマ線）で共有
+#     mu                          : share_mu=True なら同じ line で共有。さらに shift=True なら
+#                                   スペクトルごとの中心のずれ shift を足す（最初のスペクトルは 0）。
+#                                   shift は share_mu=True のときだけ（mu が別々だと区別できない）
+#   全ピークの残差を1本の配列にまとめて一度に計算し、ヤコビアンは解析的に求めた
+#   ブロック疎行列 (scipy.sparse) で least_squares に渡す。各行が依存するのは
+#   そのピークのパラメータだけなので、スペクトルが何十本あっても密な行列は作らない。
+#
+# 【使い方】
+#   import spefit, globalfit
+#   peaks = [globalfit.Peak(spec.counts, [900, 1100], line='Cs662', spectrum=run, mu=1000, sigma=20)
+#            for run, spec in enumerate(spectra)]
+#   gf = globalfit.fit(peaks, share_sigma=True, share_mu=True, shift=True)
+#   globalfit.print_result(gf)
+#
+#   誤差は Fitting_GaussPol1.py と同じく √N の重み（0 カウントは 1e-4）で、
+#   共分散は (JᵀJ)⁻¹ から求める。
+# ==============================================================
+import numpy as np
+
+import spefit
+
+SLOTS = ("area", "mu", "sigma", "intercept", "slope")
+SQRT_2PI = np.sqrt(2 * np.pi)
+
+
+class Peak:
+    """同時フィットする1つのフィット範囲"""
+    def __init__(self, counts, fit_range, line, spectrum, mu, sigma):
+        self.x, _, self.y, self.yerr = spefit.window(counts, fit_range)
+        self.fit_range = list(fit_range)
+        self.line = line
+        self.spectrum = spectrum
+        self.mu = mu
+        self.sigma = sigma
+
+    def guess(self):
+        """端の数チャンネルの平均をバックグラウンドとした area の初期値"""
+        k = max(1, len(self.y) // 10)
+        bg = 0.5 * (self.y[:k].mean() + self.y[-k:].mean())
+        return [max(1.0, float(np.sum(self.y - bg))), self.mu, self.sigma, max(0.0, bg), 0.0]
+
+
+class _Layout:
+    """パラメータベクトルの並びと、各ピークの各スロットがどの要素を使うか"""
+    def __init__(self, peaks, share_sigma, share_mu, shift):
+        self.names, self.p0, self.lo, self.hi = [], [], [], []
+        self.index = np.zeros((len(peaks), len(SLOTS)), dtype=int)
+        self.shift = np.full(len(peaks), -1)
+        shared = {}
+
+        def param(name, value, lo, hi):
+            if name in shared:
+                return shared[name]
+            shared[name] = len(self.names)
+            self.names.append(name)
+            self.p0.append(value)
+            self.lo.append(lo)
+            self.hi.append(hi)
+            return shared[name]
+
+        spectra = list(dict.fromkeys(p.spectrum for p in peaks))
+        for j, p in enumerate(peaks):
+            area, mu, sigma, c0, c1 = p.guess()
+            xmin, xmax = p.fit_range
+            tag = f"{p.line}@{p.spectrum}"
+            self.index[j, 0] = param(f"area[{tag}]", area, 0.0, np.inf)
+            self.index[j, 1] = param(f"mu[{p.line}]" if share_mu else f"mu[{tag}]", mu, xmin, xmax)
+            self.index[j, 2] = param(f"sigma[{p.line}]" if share_sigma else f"sigma[{tag}]", sigma, 0.5, xmax - xmin)
+            self.index[j, 3] = param(f"intercept[{tag}]", c0, -np.inf, np.inf)
+            self.index[j, 4] = param(f"slope[{tag}]", c1, -np.inf, np.inf)
+            if shift and p.spectrum != spectra[0]:
+                self.shift[j] = param(f"shift[{p.spectrum}]", 0.0, -(xmax - xmin) / 2, (xmax - xmin) / 2)
+
+
+class GlobalFitResult:
+    def __init__(self, peaks, names, popt, pcov, chi2, dof, nfev, message, index, shift):
+        self.peaks = peaks
+        self.names = names
+        self.popt = popt
+        self.pcov = pcov
+        self.perr = np.sqrt(np.diag(pcov))
+        self.chi2 = chi2
+        self.dof = dof
+        self.rchi2 = chi2 / dof
+        self.nfev = nfev
+        self.message = message
+        self._index = index
+        self._shift = shift
+
+    def peak_params(self, j):
+        """j 番目のピークの (area, mu, sigma, intercept, slope)。mu には shift を足してある"""
+        p = self.popt[self._index[j]].copy()
+        if self._shift[j] >= 0:
+            p[1] += self.popt[self._shift[j]]
+        return p
+
+
+def fit(peaks, share_sigma=True, share_mu=False, shift=False, max_nfev=None):
+    from scipy.optimize import least_squares
+    from scipy.sparse import csr_matrix
+
+    if shift and not share_mu:
+        raise ValueError("shift=True needs share_mu=True (per-spectrum mu and shift are degenerate)")
+    lay = _Layout(peaks, share_sigma, share_mu, shift)
+    sizes = [len(p.x) for p in peaks]
+    w = np.repeat(np.arange(len(peaks)), sizes)   # 各点がどのピークのものか
+    x = np.concatenate([p.x for p in peaks]).astype(float)
+    y = np.concatenate([p.y for p in peaks])
+    e = np.concatenate([p.yerr for p in peaks])
+
+    idx = lay.index[w]                 # (点数, 5)
+    sh = lay.shift[w]
+    has_shift = sh >= 0
+    shift_col = np.where(has_shift, sh, 0)
+
+    # ヤコビアンの非零の位置は固定: 各行 5 列 + shift のある行は 1 列
+    rows = np.concatenate([np.repeat(np.arange(len(x)), 5), np.nonzero(has_shift)[0]])
+    cols = np.concatenate([idx.ravel(), sh[has_shift]])
+    shape = (len(x), len(lay.names))
+
+    def evaluate(P):
+        area, mu, sigma, c0, c1 = (P[idx[:, k]] for k in range(5))
+        mu = mu + np.where(has_shift, P[shift_col], 0.0)
+        d = x - mu
+        g = np.exp(-d**2 / (2 * sigma**2)) / (SQRT_2PI * sigma)
+        return area, d, sigma, g, area * g + c0 + c1 * x
+
+    def residuals(P):
+        return (y - evaluate(P)[4]) / e
+
+    def jacobian(P):
+        area, d, sigma, g, _ = evaluate(P)
+        dmu = area * g * d / sigma**2
+        parts = np.stack([g, dmu, area * g * (d**2 / sigma**3 - 1 / sigma), np.ones_like(x), x], axis=1)
+        data = np.concatenate([(-parts / e[:, None]).ravel(), -dmu[has_shift] / e[has_shift]])
+        return csr_matrix((data, (rows, cols)), shape=shape)
+
+    p0 = np.clip(lay.p0, lay.lo, lay.hi)
+    sol = least_squares(residuals, p0, jac=jacobian, bounds=(lay.lo, lay.hi), method="trf",
+                        tr_solver="lsmr", x_scale="jac", max_nfev=max_nfev)
+    J = sol.jac
+    pcov = np.linalg.pinv((J.T @ J).toarray())
+    chi2 = float(np.sum(sol.fun**2))
+    dof = max(1, len(x) - len(lay.names))
+    if not sol.success:
+        raise RuntimeError(f"global fit did not converge: {sol.message}")
+    return GlobalFitResult(peaks, lay.names, sol.x, pcov, chi2, dof, sol.nfev, sol.message, lay.index, lay.shift)
+
+
+def print_result(gf):
+    print(f"\nGlobal Fit Results ({len(gf.peaks)} peaks, {len(gf.names)} parameters)")
+    print(f"  DoF                 : {gf.dof:d}")
+    print(f"  Chi-squared         : {gf.chi2:.4e}")
+    print(f"  Reduced Chi-squared : {gf.rchi2:.4e}")
+
+    print("\n  Parameter                     Value (exp)        Uncertainty (exp)")
+    print("  ------------------------------------------------------------------")
+    for name, val, err in zip(gf.names, gf.popt, gf.perr):
+        if not name.startswith(("area", "intercept", "slope")):
+            print(f"  {name:<26s} {val:>14.4e}    ± {err:>14.4e}")
+    for name, val, err in zip(gf.names, gf.popt, gf.perr):
+        if name.startswith("area"):
+            print(f"  {name:<26s} {val:>14.4e}    ± {err:>14.4e}")
+    print("  ------------------------------------------------------------------\n")
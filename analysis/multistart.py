@@ -0,0 +1,141 @@
+# ==============================================================
+# 多重ピーク用のマルチスタートフィット
+# --------------------------------------------------------------
+# 【概要】
+#   DoubleGauss.py は mu1 / mu2 の手入力と ±2σ の狭い bounds に頼っていて、
+#   初期値がずれると局所解に落ちたり maxfev に達したりする。ここでは
+#     1. bounds の中にラテン超方格 (LHS) で n_starts 個の初期値を作り、
+#     2. 全部の初期値の χ² を1回の配列計算でまとめて求め、
+#     3. χ² の小さい refine 個を curve_fit で並列に詰め、
+#     4. 一番よい解を返す。
+#   詰めた解のうち χ² がほとんど同じ (Δχ² < DEGENERATE_DCHI2) なのにパラメータが
+#   誤差の何倍も違うものがあれば「縮退」として警告を付ける。ピークを入れ替えただけの解は
+#   同じ解なので、比べる前にピークを mu の順に並べ直す。
+#
+# 【使い方】
+#   import spefit, multistart
+#   bounds = ([0, 2780, 1, 0, 3160, 1, 0, -10], [1_000_000, 2880, 30, 1_000_000, 3260, 30, 10_000, 10])
+#   ms = multistart.fit(spec.counts, 'double_gauss_pol1', [2700, 3300], bounds, n_starts=2000, seed=1)
+#   spefit.print_result(ms.best)
+#   for w in ms.warnings: print(w)
+#
+#   bounds はすべて有限であること（初期値をその中から選ぶ）。
+# ==============================================================
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import spefit
+
+N_STARTS = 2000
+REFINE   = 8
+DEGENERATE_DCHI2 = 1.0   # これより χ² の差が小さい別解は縮退とみなす
+DEGENERATE_NSIGMA = 3.0  # パラメータがこれだけ（誤差の何倍）違えば別解
+
+# 多重ピークのモデルで、各ピークの (area, mu, sigma) が始まる位置
+PEAK_BLOCKS = {"double_gauss_pol1": (0, 3)}
+
+
+def latin_hypercube(n, lo, hi, rng):
+    """各軸を n 等分し、どの区間からも1点ずつ選ぶ。形は (n, 次元)"""
+    lo, hi = np.asarray(lo, dtype=float), np.asarray(hi, dtype=float)
+    d = len(lo)
+    u = (rng.permuted(np.tile(np.arange(n), (d, 1)), axis=1).T + rng.random((n, d))) / n
+    return lo + u * (hi - lo)
+
+
+def batch_chi2(model, x_fit, y_fit, yerr_fit, params):
+    """params (k, パラメータ数) の全部の χ² を1回で計算する"""
+    func = spefit.model_func(model)
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        y = func(x_fit[None, :], *params.T[:, :, None])
+        chi2 = np.sum(((y_fit[None, :] - y) / yerr_fit[None, :])**2, axis=1)
+    return np.where(np.isfinite(chi2), chi2, np.inf)
+
+
+def peak_order(model, popt):
+    """ピークを mu の小さい順に並べ直すパラメータの添字（単一ピークのモデルはそのまま）"""
+    idx = np.arange(len(popt))
+    starts = PEAK_BLOCKS.get(model, ()) if isinstance(model, str) else ()
+    for start, src in zip(starts, sorted(starts, key=lambda i: popt[i + 1])):
+        idx[start:start + 3] = np.arange(src, src + 3)
+    return idx
+
+
+def _refine(counts, model, fit_range, p0, bounds, maxfev):
+    try:
+        return spefit.fit(counts, model, fit_range, p0, bounds, maxfev)
+    except (RuntimeError, ValueError):
+        return None
+
+
+class MultiStartResult:
+    def __init__(self, best, solutions, starts, start_chi2, warnings):
+        self.best = best              # 一番よい spefit.FitResult
+        self.solutions = solutions    # 詰めた解（χ² の小さい順）
+        self.starts = starts          # LHS の初期値 (n_starts, パラメータ数)
+        self.start_chi2 = start_chi2  # 初期値の χ²
+        self.warnings = warnings
+
+    @property
+    def degenerate(self):
+        return any(w.startswith("degenerate") for w in self.warnings)
+
+
+def fit(counts, model, fit_range, bounds, n_starts=N_STARTS, refine=REFINE, maxfev=20000,
+        seed=None, workers=None):
+    counts = np.asarray(counts, dtype=float)
+    lo, hi = (np.asarray(b, dtype=float) for b in bounds)
+    if not (np.all(np.isfinite(lo)) and np.all(np.isfinite(hi))):
+        raise ValueError("multistart needs finite bounds")
+    x_fit, y_fit, _, yerr_fit = spefit.window(counts, fit_range)
+
+    rng = np.random.default_rng(seed)
+    starts = latin_hypercube(n_starts, lo, hi, rng)
+    chi2 = batch_chi2(model, x_fit, y_fit, yerr_fit, starts)
+    order = np.argsort(chi2)[:refine]
+
+    tasks = [(counts, model, fit_range, starts[i], (lo, hi), maxfev) for i in order]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        results = [_refine(*t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(min(workers, len(tasks))) as pool:
+            results = list(pool.map(_refine, *zip(*tasks)))
+    solutions = sorted((r for r in results if r is not None), key=lambda r: r.chi2)
+    if not solutions:
+        raise RuntimeError(f"multistart: none of the {len(tasks)} refined starts converged")
+
+    best = solutions[0]
+    warnings = []
+    order = peak_order(model, best.popt)
+    ref = best.popt[order]
+    err = np.where(best.perr > 0, best.perr, np.inf)[order]
+    alternatives = []   # 警告済みの別解（同じ別解に何度も詰まったものは1回だけ）
+    for other in solutions[1:]:
+        if other.chi2 - best.chi2 >= DEGENERATE_DCHI2:
+            break
+        alt = other.popt[peak_order(model, other.popt)]
+        differ = np.abs(alt - ref) > DEGENERATE_NSIGMA * err
+        if np.any(differ) and not any(np.all(np.abs(alt - a) <= DEGENERATE_NSIGMA * err)
+                                      for a in alternatives):
+            alternatives.append(alt)
+            names = ", ".join(best.names[i] for i in order[differ])
+            warnings.append(f"degenerate: another solution with dchi2 = {other.chi2 - best.chi2:.3f} "
+                            f"differs in {names}")
+    span = hi - lo
+    at_bound = (np.abs(best.popt - lo) < 1e-6 * span) | (np.abs(hi - best.popt) < 1e-6 * span)
+    if np.any(at_bound):
+        warnings.append("at bound: " + ", ".join(n for n, a in zip(best.names, at_bound) if a))
+    return MultiStartResult(best, solutions, starts, chi2, warnings)
+
+
+def print_solutions(ms):
+    print(f"\nMulti-start: {len(ms.starts)} starts, {len(ms.solutions)} refined solutions")
+    print("  rank     Chi2      dChi2   " + "".join(f"{n.split()[0]:>12s}" for n in ms.best.names))
+    for i, r in enumerate(ms.solutions):
+        print(f"  {i:>4d}  {r.chi2:>10.3f}  {r.chi2 - ms.best.chi2:>8.3f}   " + "".join(f"{v:>12.4g}" for v in r.popt))
+    for w in ms.warnings:
+        print("  WARNING: " + w)
+    print()
@@ -0,0 +1,99 @@
+# ==============================================================
+# 累積和による ROI の積分
+# --------------------------------------------------------------
+# 【概要】
+#   「3400〜3520 ch のカウントから両側のサイドバンドを引いたもの」のような
+#   簡単な確認を、フィットせずにすぐ出すためのもの。
+#   スペクトル（または何本ものスペクトルを並べたもの）ごとにチャンネル方向の累積和を
+#   一度だけ作っておくと、どの ROI の積分も累積和の差 (O(1)) で求まる。
+#   ROI を配列で渡せば、ROI 数 × スペクトル数 の全部を1回の配列計算で返す。
+#
+#   ROI は fit_range と同じく [lo, hi)（lo を含み hi を含まない）チャンネル。
+#   net はサイドバンド [lo - side, lo) と [hi, hi + side) の1チャンネルあたりの平均を
+#   直線でつないだバックグラウンドを引いたもの。
+#
+# 【使い方】
+#   import spefit, roi
+#   store = roi.RoiStore.from_spectra([spefit.read_spe(p) for p in paths])
+#   store.gross(3400, 3520)                      # (スペクトル数,)
+#   net, err = store.net([900, 3400], [1100, 3520], side=20)   # (スペクトル数, ROI 数)
+#   rate, rate_err = store.rate(net, err)        # live time で割る
+# ==============================================================
+import numpy as np
+
+import spefit
+
+
+class RoiStore:
+    """counts: (チャンネル数) または (スペクトル数, チャンネル数)"""
+    def __init__(self, counts, live_time=None, names=None):
+        counts = np.asarray(counts, dtype=float)
+        self.single = counts.ndim == 1
+        counts = np.atleast_2d(counts)
+        self.nchan = counts.shape[1]
+        # 先頭に 0 を置いた累積和: cum[:, i] = counts[:, :i].sum()
+        self.cum = np.zeros((counts.shape[0], self.nchan + 1))
+        np.cumsum(counts, axis=1, out=self.cum[:, 1:])
+        self.live_time = None if live_time is None else np.atleast_1d(np.asarray(live_time, dtype=float))
+        self.names = names
+
+    @classmethod
+    def from_spectra(cls, spectra):
+        counts, live, _ = spefit.stack(spectra)
+        return cls(counts, live, [s.path for s in spectra])
+
+    def __len__(self):
+        return self.cum.shape[0]
+
+    def _sum(self, lo, hi):
+        lo = np.clip(np.asarray(lo, dtype=int), 0, self.nchan)
+        hi = np.clip(np.asarray(hi, dtype=int), 0, self.nchan)
+        return self.cum[:, hi] - self.cum[:, lo]
+
+    def _shape(self, value):
+        return value[0] if self.single else value
+
+    def gross(self, lo, hi):
+        """[lo, hi) の合計。lo / hi が配列なら (スペクトル数, ROI 数)"""
+        return self._shape(self._sum(lo, hi))
+
+    def net(self, lo, hi, side=10):
+        """サイドバンドを引いた正味のカウントとその誤差"""
+        lo = np.asarray(lo, dtype=int)
+        hi = np.asarray(hi, dtype=int)
+        if np.any(lo - side < 0) or np.any(hi + side > self.nchan) or np.any(hi <= lo):
+            raise ValueError(f"ROIかサイドバンドがスペクトルの外です: lo={lo}, hi={hi}, side={side}")
+        gross = self._sum(lo, hi)
+        left  = self._sum(lo - side, lo)
+        right = self._sum(hi, hi + side)
+        width = hi - lo
+        bg = 0.5 * (left + right) * width / side
+        err = np.sqrt(np.clip(gross, 0, None) + (0.5 * width / side)**2 * (left + right))
+        return self._shape(gross - bg), self._shape(err)
+
+    def rate(self, value, err=None):
+        """live time で割った計数率 [cps]（value は gross / net の戻り値）"""
+        if self.live_time is None or np.isnan(self.live_time).any():
+            raise ValueError("live time がありません")
+        live = self._shape(self.live_time.reshape((-1,) + (1,) * (np.ndim(value) - (0 if self.single else 1))))
+        if err is None:
+            return value / live
+        return value / live, err / live
+
+
+def print_table(store, lo, hi, side=10):
+    """ROI ごとの net と誤差（live time があれば計数率も）をスペクトルごとに出す"""
+    lo, hi = np.atleast_1d(lo), np.atleast_1d(hi)
+    net, err = store.net(lo, hi, side)
+    net, err = np.atleast_2d(net), np.atleast_2d(err)
+    has_rate = store.live_time is not None and not np.isnan(store.live_time).any()
+    names = store.names or [str(i) for i in range(len(store))]
+    for i, name in enumerate(names):
+        print(f"\n  {name}")
+        for k in range(len(lo)):
+            line = f"    [{lo[k]:>5d}, {hi[k]:>5d})  gross {store.cum[i, hi[k]] - store.cum[i, lo[k]]:>11.0f}  " \
+                   f"net {net[i, k]:>12.1f} ± {err[i, k]:>8.1f}"
+            if has_rate:
+                line += f"  rate {net[i, k] / store.live_time[i]:>10.4f} ± {err[i, k] / store.live_time[i]:.4f} cps"
+            print(line)
+    print()
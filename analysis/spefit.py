@@ -0,0 +1,246 @@
+# ==============================================================
+# KSpect .spe スペクトルの読み込みとピークフィットの共通部品
+# --------------------------------------------------------------
+# Fitting_GaussPol1.py / Fitting_GaussPol2.py / DoubleGauss.py と同じ
+# 読み込み・フィット関数・フィット手順（√N の重み、absolute_sigma、bounds）を
+# 関数として使えるようにしたもの。ブートストラップなどの解析ツールはこれを使う。
+#
+#   import spefit
+#   spec = spefit.read_spe('Data.spe')
+#   res  = spefit.fit(spec.counts, 'gauss_pol1', [1550, 1650],
+#                     p0=[1000, 1595, 4, 10, 0.0],
+#                     bounds=([0, 1587, 1, 0, -10], [1_000_000, 1603, 50, 10_000, 10]))
+#   spefit.print_result(res, spec.live_time, spec.real_time)   # 面積を計数率 [cps] でも出す
+#
+# read_spe は $MEAS_TIM（live time / real time）と $DATE_MEA も読む。計数率は live time で割るので
+# 不感時間の補正込み。複数の測定は stack / normalize / sum_spectra でまとめて扱う。
+#
+# フィット関数はパラメータに配列（形 (k, 1)）を渡すと k 組を一度に計算できる。
+# ==============================================================
+import os
+
+import numpy as np
+
+
+# -------- フィット関数 --------
+def gauss(x, area, mu, sigma):
+    return (area / (np.sqrt(2*np.pi) * sigma)) * np.exp(-(x - mu)**2 / (2 * sigma**2))
+
+def gauss_pol1(x, p0, p1, p2, p3, p4):
+    return gauss(x, p0, p1, p2) + p3 + p4 * x
+
+def gauss_pol2(x, p0, p1, p2, p3, p4, p5):
+    return gauss(x, p0, p1, p2) + p3 + p4 * x + p5 * x**2
+
+def double_gauss_pol1(x, p0, p1, p2, p3, p4, p5, p6, p7):
+    return gauss(x, p0, p1, p2) + gauss(x, p3, p4, p5) + p6 + p7 * x
+
+# 名前 → (関数, パラメータ名)
+MODELS = {
+    "gauss_pol1": (gauss_pol1, ["p0 (area)", "p1 (mu)", "p2 (sigma)", "p3 (intercept)", "p4 (slope)"]),
+    "gauss_pol2": (gauss_pol2, ["p0 (area)", "p1 (mu)", "p2 (sigma)", "p3 (intercept)", "p4 (x slope)", "p5 (x2 slope)"]),
+    "double_gauss_pol1": (double_gauss_pol1, ["p0 (area1)", "p1 (mu1)", "p2 (sigma1)", "p3 (area2)", "p4 (mu2)",
+                                              "p5 (sigma2)", "p6 (intercept)", "p7 (slope)"]),
+}
+
+def model_func(model):
+    """モデル名または関数 → 関数"""
+    return MODELS[model][0] if isinstance(model, str) else model
+
+def param_names(model, n=None):
+    if isinstance(model, str):
+        return MODELS[model][1]
+    if hasattr(model, "names"):
+        return model.names
+    return [f"p{i}" for i in range(n)]
+
+def initial_guess(model, mu, sigma, mu2=None, sigma2=None):
+    """各スクリプトの p_init / p_bounds と同じ初期値と探索範囲"""
+    if model == "gauss_pol1":
+        p_init   = [1000, mu, sigma, 10, 0.0]
+        p_bounds = ([0, mu - 2.0 * sigma, 1, 0, -10], [1_000_000, mu + 2.0 * sigma, 50, 10_000, 10])
+    elif model == "gauss_pol2":
+        p_init   = [1000, mu, sigma, 10, 0.0, 0.0]
+        p_bounds = ([0, mu - 2.0 * sigma, 1, 0, -10, -10], [1_000_000, mu + 2.0 * sigma, 50, 100_000, 10, 10])
+    elif model == "double_gauss_pol1":
+        p_init   = [1000, mu, sigma, 1000, mu2, sigma2, 10, 0.0]
+        p_bounds = ([0, mu - 2.0 * sigma, 1, 0, mu2 - 2.0 * sigma2, 1, 0, -10],
+                    [1_000_000, mu + 2.0 * sigma, 4 * sigma, 1_000_000, mu2 + 2.0 * sigma2, 4 * sigma2, 10_000, 10])
+    else:
+        raise ValueError(f"unknown model: {model}")
+    return p_init, p_bounds
+
+
+# -------- .spe 読み込み --------
+class Spectrum:
+    """
+    1つの .spe。counts はチャンネルごとのカウント (float64)。
+    live_time / real_time は $MEAS_TIM の値 [s]（ヘッダにないときは None）
+    """
+    def __init__(self, counts, path=None, live_time=None, real_time=None, date=None):
+        self.counts = np.asarray(counts, dtype=float)
+        self.path = path
+        self.live_time = live_time
+        self.real_time = real_time
+        self.date = date
+
+    @property
+    def channels(self):
+        return np.arange(len(self.counts))
+
+    @property
+    def dead_time(self):
+        """不感時間の割合 1 - live / real"""
+        if not self.live_time or not self.real_time:
+            return None
+        return 1.0 - self.live_time / self.real_time
+
+    def rates(self):
+        """チャンネルごとの計数率 [cps]（live time で割るので不感時間の補正込み）"""
+        if not self.live_time:
+            raise ValueError(f"live time がありません: {self.path}")
+        return self.counts / self.live_time
+
+    def __len__(self):
+        return len(self.counts)
+
+
+def _header(lines, key):
+    """$KEY: の次の行（なければ None）"""
+    for i, line in enumerate(lines[:-1]):
+        if line.strip() == key:
+            return lines[i + 1].strip()
+    return None
+
+
+def read_spe(file_path):
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"入力ファイルが見つかりません: {file_path}")
+
+    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+        lines = f.readlines()
+
+    start_index = next(i for i, line in enumerate(lines) if line.strip() == "0 4095") + 1
+    end_index   = next(i for i, line in enumerate(lines) if line.strip().startswith("$ENER_FIT:"))
+
+    # 行頭末の空白やコメントを無視しつつ整数だけ抽出
+    data = []
+    for s in (ln.strip() for ln in lines[start_index:end_index]):
+        if s and s.replace('-', '').isdigit():
+            data.append(int(s))
+
+    if not data:
+        raise RuntimeError("スペクトルデータが空です。")
+
+    # $MEAS_TIM: の次の行は「live time  real time」[s]
+    live_time = real_time = None
+    meas_tim = _header(lines[:start_index], "$MEAS_TIM:")
+    if meas_tim:
+        try:
+            live_time, real_time = (float(v) for v in meas_tim.split()[:2])
+        except ValueError:
+            pass
+    return Spectrum(data, file_path, live_time, real_time, _header(lines[:start_index], "$DATE_MEA:"))
+
+
+# -------- 複数スペクトル --------
+def stack(spectra):
+    """counts を (スペクトル数, チャンネル数) に並べ、live / real time の配列と一緒に返す"""
+    counts = np.vstack([s.counts for s in spectra])
+    live = np.array([s.live_time or np.nan for s in spectra], dtype=float)
+    real = np.array([s.real_time or np.nan for s in spectra], dtype=float)
+    return counts, live, real
+
+
+def normalize(counts, live):
+    """
+    計数率とその誤差 [cps]。counts (スペクトル数, チャンネル数)、live (スペクトル数) を
+    まとめて割る（1本なら counts (チャンネル数) と live (スカラー) でもよい）
+    """
+    counts = np.asarray(counts, dtype=float)
+    live = np.asarray(live, dtype=float)[..., None]
+    return counts / live, np.sqrt(np.clip(counts, 0, None)) / live
+
+
+def sum_spectra(spectra):
+    """
+    足し合わせたスペクトル。live / real time も足すので、rates() は全体の
+    平均の計数率（不感時間の違う測定を合わせても正しい）になる
+    """
+    counts, live, real = stack(spectra)
+    live_time = None if np.isnan(live).any() else float(live.sum())
+    real_time = None if np.isnan(real).any() else float(real.sum())
+    return Spectrum(counts.sum(axis=0), None, live_time, real_time)
+
+
+# -------- フィット --------
+def window(counts, fit_range):
+    """フィット範囲の x, y, 0 を避けた y, 誤差 (√N)"""
+    xmin, xmax = fit_range
+    if xmin < 0 or xmax > len(counts) or xmin >= xmax:
+        raise ValueError(f"fit_rangeが不正です: {fit_range} / N={len(counts)}")
+    x_fit      = np.arange(xmin, xmax)
+    y_fit      = np.asarray(counts[xmin:xmax], dtype=float)
+    y_fit_safe = np.where(y_fit <= 0, 1e-4, y_fit)
+    yerr_fit   = np.sqrt(y_fit_safe)
+    return x_fit, y_fit, y_fit_safe, yerr_fit
+
+
+class FitResult:
+    def __init__(self, model, fit_range, popt, pcov, chi2, dof, names, nfev=None, message=None):
+        self.model = model
+        self.fit_range = list(fit_range)
+        self.popt = popt
+        self.pcov = pcov
+        self.perr = np.sqrt(np.diag(pcov))
+        self.chi2 = chi2
+        self.dof = dof
+        self.rchi2 = chi2 / dof
+        self.names = names
+        self.nfev = nfev          # 関数の評価回数
+        self.message = message    # 収束の理由（curve_fit の mesg）
+
+
+def fit(counts, model, fit_range, p0, bounds=(-np.inf, np.inf), maxfev=20000):
+    """スクリプトと同じ手順のフィット。失敗すると curve_fit の例外 (RuntimeError など)"""
+    from scipy.optimize import curve_fit
+
+    func = model_func(model)
+    x_fit, y_fit, y_fit_safe, yerr_fit = window(counts, fit_range)
+    popt, pcov, info, mesg, _ = curve_fit(
+        func, x_fit, y_fit_safe,
+        sigma=yerr_fit, absolute_sigma=True,
+        p0=p0, bounds=bounds, maxfev=maxfev, full_output=True
+    )
+    chi2 = np.sum(((y_fit - func(x_fit, *popt)) / yerr_fit)**2)
+    dof  = max(1, len(x_fit) - len(popt))
+    return FitResult(model, fit_range, popt, pcov, chi2, dof, param_names(model, len(popt)),
+                     info.get("nfev"), mesg)
+
+
+def area_rates(res, live_time):
+    """面積パラメータ (名前に area を含むもの) を計数率 [cps] にしたもの: [(名前, 値, 誤差)]"""
+    return [(name, val / live_time, err / live_time)
+            for name, val, err in zip(res.names, res.popt, res.perr) if "area" in name]
+
+
+def print_result(res, live_time=None, real_time=None):
+    print("\nFitted Results")
+    print(f"  DoF                 : {res.dof:d}")
+    print(f"  Chi-squared         : {res.chi2:.4e}")
+    print(f"  Reduced Chi-squared : {res.rchi2:.4e}")
+
+    print("\n  Parameter           Value (exp)        Uncertainty (exp)")
+    print("  --------------------------------------------------------")
+    for name, val, err in zip(res.names, res.popt, res.perr):
+        print(f"  {name:<16s} {val:>14.4e}    ± {err:>14.4e}")
+    print("  --------------------------------------------------------\n")
+
+    if live_time:
+        line = f"  Live time {live_time:g} s"
+        if real_time:
+            line += f", real time {real_time:g} s, dead time {100 * (1 - live_time / real_time):.2f} %"
+        print(line)
+        for name, val, err in area_rates(res, live_time):
+            print(f"  {name + ' rate':<16s} {val:>14.4e}    ± {err:>14.4e}  cps")
+        print()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# coding: utf-8
+# ==============================================================
+# .spe 解析ツールのコマンドライン版
+# --------------------------------------------------------------
+# 【概要】
+#   Colab のセル (Fitting_GaussPol1.py など) と同じフィットを、シェルやスクリプトから使う。
+#     fit    : 1ファイルの1ピークをフィットして結果を表示（--plot で図も）
+#     batch  : 複数ファイル × peaks.json のピークをフィットして CSV に書く
+#     roi    : ROI の gross / net / 計数率（フィットしない）
+#     report : batch と同じフィットをキャッシュ経由で行い、表のレポートを書く
+#              （変わったスペクトル・ピークだけフィットし直す）
+#
+#   numpy 以外の重いもの (scipy, matplotlib, plotly) はそのサブコマンドが使うときだけ読み込む。
+#   roi や、キャッシュに全部あるときの report はすぐ終わる。
+#
+# 【使い方】
+#   python3 spetool.py fit Data.spe --mu 1000 --sigma 20 --range 900:1100
+#   python3 spetool.py fit Data.spe --model double_gauss_pol1 --mu 2829 --sigma 4 --mu2 3211 --sigma2 4 \
+#                      --range 2700:3300 --plot fit.html
+#   python3 spetool.py batch runs/*.spe --peaks peaks.json --out fits.csv
+#   python3 spetool.py roi runs/*.spe --roi 900:1100 --roi 3400:3520 --side 20
+#   python3 spetool.py report runs/*.spe --peaks peaks.json --out report.txt
+#
+#   peaks.json の書式は watchfit.py と同じ。
+# ==============================================================
+import argparse
+import os
+import sys
+
+
+def parse_range(text):
+    """'900:1100' -> [900, 1100]"""
+    try:
+        lo, hi = (int(v) for v in text.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"range must be LO:HI, got {text!r}")
+    return [lo, hi]
+
+
+# ============ fit ==============
+def plot_fit(spec, res, path):
+    """スペクトルとフィット曲線。.html なら plotly（ノートブックと同じ見た目）、それ以外は matplotlib"""
+    import numpy as np
+    import spefit
+
+    func = spefit.model_func(res.model)
+    xmin, xmax = res.fit_range
+    x_smooth = np.linspace(xmin, xmax, 1000)
+    title = os.path.basename(spec.path)
+
+    if path.endswith(".html"):
+        import plotly.graph_objects as go
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(
+            x=spec.channels, y=spec.counts, mode='markers',
+            marker=dict(size=4, color='black', symbol='circle', opacity=0.9),
+            error_y=dict(type='data', array=np.sqrt(np.clip(spec.counts, 0, None)), color='black', thickness=1.2),
+            hovertemplate="Channel=%{x}<br>Counts=%{y}<extra></extra>"
+        ))
+        fig.add_trace(go.Scatter(x=x_smooth, y=func(x_smooth, *res.popt), mode='lines',
+                                 line=dict(width=2, color='red'), hovertemplate="Fit y=%{y:.3f}<extra></extra>"))
+        fig.update_layout(template="simple_white", title=title, xaxis_title="Channel", yaxis_title="Counts",
+                          showlegend=False, width=900, height=600)
+        fig.write_html(path)
+        return
+
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=(9, 6))
+    ax.errorbar(spec.channels, spec.counts, yerr=np.sqrt(np.clip(spec.counts, 0, None)),
+                fmt='o', ms=2, color='black', elinewidth=0.8)
+    ax.plot(x_smooth, func(x_smooth, *res.popt), color='red', lw=2)
+    ax.set_xlim(0, len(spec))
+    ax.set_title(title)
+    ax.set_xlabel("Channel")
+    ax.set_ylabel("Counts")
+    fig.tight_layout()
+    fig.savefig(path, dpi=120)
+
+
+def cmd_fit(args):
+    import spefit
+
+    spec = spefit.read_spe(args.file)
+    p_init, p_bounds = spefit.initial_guess(args.model, args.mu, args.sigma, args.mu2, args.sigma2)
+    if args.cache:
+        import fitcache
+        res = fitcache.FitCache(args.cache).fit(spec.counts, args.model, args.range, p_init, p_bounds)
+    else:
+        res = spefit.fit(spec.counts, args.model, args.range, p_init, p_bounds)
+    spefit.print_result(res, spec.live_time, spec.real_time)
+
+    if args.bootstrap:
+        import bootstrap
+        bs = bootstrap.run(spec.counts, res, n=args.bootstrap, bounds=p_bounds, seed=args.seed)
+        bootstrap.print_summary(bs)
+    if args.plot:
+        plot_fit(spec, res, args.plot)
+
+
+# ============ batch / report ==============
+def fit_files(files, peaks, cache_path=None, workers=None):
+    """watchfit.fit_file を全ファイルに（workers > 1 ならプロセスプールで）。行のリストを返す"""
+    import watchfit
+
+    tasks = [(path, watchfit.file_hash(path), peaks, cache_path) for path in files]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(tasks) == 1:
+        results = [watchfit.fit_file(*t) for t in tasks]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(min(workers, len(tasks))) as pool:
+            results = list(pool.map(watchfit.fit_file, *zip(*tasks)))
+    return [row for rows in results for row in rows]
+
+
+def write_rows(rows, path):
+    import csv
+    import watchfit
+
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=watchfit.FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def cmd_batch(args):
+    import watchfit
+
+    peaks = watchfit.load_peaks(args.peaks)
+    rows = fit_files(args.files, peaks, args.cache, args.workers)
+    if args.out:
+        write_rows(rows, args.out)
+        failed = sum(1 for r in rows if not r["ok"])
+        print(f"{len(rows)} fits ({failed} failed) from {len(args.files)} files -> {args.out}")
+    else:
+        print("\n".join(watchfit.report_lines(rows, "batch")))
+
+
+def cmd_report(args):
+    import fitcache
+    import watchfit
+
+    peaks = watchfit.load_peaks(args.peaks)
+    cache_path = args.cache or fitcache.CACHE_FILE
+    cache = fitcache.FitCache(cache_path)
+    before = cache.stats()["entries"]
+    rows = fit_files(args.files, peaks, cache_path, args.workers)
+    text = "\n".join(watchfit.report_lines(rows, f"report ({len(args.files)} files, {len(peaks)} peaks)")) + "\n"
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+    refitted = cache.stats()["entries"] - before
+    print(f"{len(rows)} fits, {refitted} new (cache {cache_path})", file=sys.stderr)
+
+
+# ============ roi ==============
+def cmd_roi(args):
+    import numpy as np
+    import roi
+    import spefit
+
+    store = roi.RoiStore.from_spectra([spefit.read_spe(path) for path in args.files])
+    lo = np.array([r[0] for r in args.roi])
+    hi = np.array([r[1] for r in args.roi])
+    if not args.csv:
+        roi.print_table(store, lo, hi, args.side)
+        return
+
+    import csv
+    net, err = store.net(lo, hi, args.side)
+    gross = store.gross(lo, hi)
+    with open(args.csv, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["file", "lo", "hi", "gross", "net", "net_err", "live_time"])
+        for i, path in enumerate(args.files):
+            for k in range(len(lo)):
+                writer.writerow([os.path.basename(path), lo[k], hi[k], gross[i, k], net[i, k], err[i, k],
+                                 store.live_time[i]])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KSpect .spe analysis tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("fit", help="fit one peak in one spectrum")
+    p.add_argument("file")
+    p.add_argument("--model", default="gauss_pol1", choices=["gauss_pol1", "gauss_pol2", "double_gauss_pol1"])
+    p.add_argument("--mu", type=float, required=True, help="peak centre [ch]")
+    p.add_argument("--sigma", type=float, required=True, help="peak width [ch]")
+    p.add_argument("--mu2", type=float, default=None, help="second peak centre (double_gauss_pol1)")
+    p.add_argument("--sigma2", type=float, default=None, help="second peak width (double_gauss_pol1)")
+    p.add_argument("--range", type=parse_range, required=True, help="fit range LO:HI [ch]")
+    p.add_argument("--cache", default=None, help="fit cache file")
+    p.add_argument("--bootstrap", type=int, default=0, help="number of Poisson replicas for bootstrap errors")
+    p.add_argument("--seed", type=int, default=None)
+    p.add_argument("--plot", default=None, help="write the plot to this file (.html: plotly, else matplotlib)")
+    p.set_defaults(func=cmd_fit)
+
+    for name, func, help in (("batch", cmd_batch, "fit the peaks of peaks.json in many spectra"),
+                             ("report", cmd_report, "batch fit through the cache and write a report")):
+        p = sub.add_parser(name, help=help)
+        p.add_argument("files", nargs="+")
+        p.add_argument("--peaks", required=True, help="JSON list of peaks (same as watchfit.py)")
+        p.add_argument("--out", default=None, help="output file (batch: CSV, report: text)")
+        p.add_argument("--workers", type=int, default=None, help="fit processes (default: CPU count)")
+        p.add_argument("--cache", default=None,
+                       help="fit cache file (report: default ~/.spefit_cache.sqlite)")
+        p.set_defaults(func=func)
+
+    p = sub.add_parser("roi", help="gross / net counts in ROIs without fitting")
+    p.add_argument("files", nargs="+")
+    p.add_argument("--roi", type=parse_range, action="append", required=True, help="LO:HI [ch], repeatable")
+    p.add_argument("--side", type=int, default=10, help="sideband width on each side [ch]")
+    p.add_argument("--csv", default=None, help="write a CSV instead of the table")
+    p.set_defaults(func=cmd_roi)
+
+    args = parser.parse_args()
+    try:
+        args.func(args)
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
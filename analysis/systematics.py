@@ -0,0 +1,172 @@
+# ==============================================================
+# フィット範囲・バックグラウンド関数の系統誤差スキャン
+# --------------------------------------------------------------
+# 【概要】
+#   ピーク面積が fit_range の取り方や、バックグラウンドを1次 (Fitting_GaussPol1.py)
+#   にするか2次 (Fitting_GaussPol2.py) にするかでどれだけ変わるかを調べる。
+#   左端 × 右端 × モデル の格子の全点でフィットし、表と図にまとめる。
+#
+#   ・左端とモデルが同じ点を1列として、右端を順に広げながらフィットする。
+#     初期値は隣の格子点（1つ前の右端）の結果を使う（ウォームスタート）
+#   ・列ごとにプロセスプールで並列に処理する
+#
+# 【使い方】
+#   import spefit, systematics
+#   spec = spefit.read_spe('Data.spe')
+#   rows = systematics.scan(spec.counts, mu=1000, sigma=20,
+#                           lows=range(880, 961, 10), highs=range(1040, 1121, 10))
+#   systematics.print_table(rows, reference=(920, 1080, 'gauss_pol1'))
+#   systematics.write_csv(rows, 'syst.csv')
+#   systematics.plot(rows, 'syst.png')
+# ==============================================================
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import spefit
+
+MODELS = ("gauss_pol1", "gauss_pol2")
+
+
+def _scan_column(counts, model, xmin, highs, p_init, p_bounds, maxfev):
+    """左端 xmin を固定して右端を順に変えながらフィットする（プロセスプールの中で動く）"""
+    rows = []
+    p0 = p_init
+    for xmax in highs:
+        row = {"model": model, "xmin": xmin, "xmax": xmax, "ok": False}
+        try:
+            res = spefit.fit(counts, model, [xmin, xmax], p0, p_bounds, maxfev)
+        except (RuntimeError, ValueError) as e:
+            row["error"] = str(e)
+            rows.append(row)
+            continue
+        row.update({
+            "ok": True,
+            "area": res.popt[0], "area_err": res.perr[0],
+            "mu": res.popt[1], "mu_err": res.perr[1],
+            "sigma": res.popt[2], "sigma_err": res.perr[2],
+            "chi2": res.chi2, "dof": res.dof, "rchi2": res.rchi2,
+        })
+        rows.append(row)
+        p0 = res.popt   # 次の右端はこの結果から始める
+    return rows
+
+
+def scan(counts, mu, sigma, lows, highs, models=MODELS, guesses=None, maxfev=20000, workers=None):
+    """
+    格子の全点でフィットして、1点1行 (dict) のリストを返す。
+    guesses: {モデル名: (p_init, p_bounds)}。省略したモデルは spefit.initial_guess(mu, sigma)。
+    """
+    counts = np.asarray(counts, dtype=float)
+    lows, highs = list(lows), list(highs)
+    guesses = dict(guesses or {})
+    tasks = []
+    for model in models:
+        p_init, p_bounds = guesses.get(model) or spefit.initial_guess(model, mu, sigma)
+        for xmin in lows:
+            tasks.append((counts, model, xmin, highs, p_init, p_bounds, maxfev))
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        columns = [_scan_column(*t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            columns = list(pool.map(_scan_column, *zip(*tasks)))
+    return [row for column in columns for row in column]
+
+
+def stability(rows, reference=None):
+    """
+    モデルごとの面積のばらつき。reference = (xmin, xmax, model) を与えると
+    その点に対するずれも返す。
+    """
+    ref = None
+    if reference is not None:
+        xmin, xmax, model = reference
+        ref = next((r for r in rows if r["ok"] and (r["xmin"], r["xmax"], r["model"]) == (xmin, xmax, model)), None)
+        if ref is None:
+            raise ValueError(f"reference point not in scan or failed: {reference}")
+
+    summary = {}
+    for model in dict.fromkeys(r["model"] for r in rows):
+        ok = [r for r in rows if r["model"] == model and r["ok"]]
+        area = np.array([r["area"] for r in ok])
+        s = {"points": len(ok), "failed": sum(1 for r in rows if r["model"] == model and not r["ok"])}
+        if len(area):
+            s.update({
+                "area_mean": area.mean(), "area_std": area.std(ddof=1) if len(area) > 1 else 0.0,
+                "area_min": area.min(), "area_max": area.max(),
+                "stat_err": np.median([r["area_err"] for r in ok]),
+                "rchi2_max": max(r["rchi2"] for r in ok),
+            })
+            if ref is not None:
+                s["max_dev"] = np.max(np.abs(area - ref["area"]))
+        summary[model] = s
+    return ref, summary
+
+
+def print_table(rows, reference=None):
+    print("\n  Model              xmin   xmax        Area      ± (stat)       mu      sigma    Red.Chi2")
+    print("  " + "-" * 88)
+    for r in rows:
+        if r["ok"]:
+            print(f"  {r['model']:<18s} {r['xmin']:>5d}  {r['xmax']:>5d}  {r['area']:>11.4e}  {r['area_err']:>11.4e}  "
+                  f"{r['mu']:>8.2f}  {r['sigma']:>7.3f}  {r['rchi2']:>9.3f}")
+        else:
+            print(f"  {r['model']:<18s} {r['xmin']:>5d}  {r['xmax']:>5d}  fit failed: {r.get('error', '')}")
+    print("  " + "-" * 88)
+
+    ref, summary = stability(rows, reference)
+    print("\n  Stability of area")
+    if ref is not None:
+        print(f"  reference: {ref['model']} [{ref['xmin']}, {ref['xmax']}]  area {ref['area']:.4e} ± {ref['area_err']:.4e}")
+    for model, s in summary.items():
+        if not s["points"]:
+            print(f"  {model:<18s} all {s['failed']} fits failed")
+            continue
+        line = (f"  {model:<18s} n={s['points']:<4d} failed={s['failed']:<3d} mean {s['area_mean']:.4e}  "
+                f"spread (std) {s['area_std']:.3e}  range [{s['area_min']:.4e}, {s['area_max']:.4e}]  "
+                f"stat {s['stat_err']:.3e}")
+        if "max_dev" in s:
+            line += f"  max dev {s['max_dev']:.3e}"
+        print(line)
+    print()
+
+
+def write_csv(rows, path):
+    fields = ["model", "xmin", "xmax", "ok", "area", "area_err", "mu", "mu_err", "sigma", "sigma_err",
+              "chi2", "dof", "rchi2", "error"]
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for r in rows:
+            writer.writerow(r)
+
+
+def plot(rows, path=None):
+    """左端ごとに 面積 vs 右端 をモデル別のパネルに描く。path があれば保存"""
+    import matplotlib
+    if path:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    models = list(dict.fromkeys(r["model"] for r in rows))
+    fig, axes = plt.subplots(1, len(models), figsize=(6 * len(models), 4.5), sharey=True, squeeze=False)
+    for ax, model in zip(axes[0], models):
+        for xmin in dict.fromkeys(r["xmin"] for r in rows if r["model"] == model):
+            pts = [r for r in rows if r["model"] == model and r["xmin"] == xmin and r["ok"]]
+            if pts:
+                ax.errorbar([r["xmax"] for r in pts], [r["area"] for r in pts], yerr=[r["area_err"] for r in pts],
+                            marker="o", ms=3, capsize=2, label=f"xmin={xmin}")
+        ax.set_title(model)
+        ax.set_xlabel("xmax [ch]")
+    axes[0][0].set_ylabel("Area")
+    axes[0][-1].legend(fontsize=8)
+    fig.tight_layout()
+    if path:
+        fig.savefig(path, dpi=120)
+    else:
+        plt.show()
+    return fig
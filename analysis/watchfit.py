@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# coding: utf-8
+# ==============================================================
+# 監視フォルダの .spe を書かれたそばからフィットするデーモン
+# --------------------------------------------------------------
+# 【概要】
+#   KSpect が測定中に保存する .spe を監視し、新しいファイル・更新されたファイルを
+#   設定したピークの組でフィットして、結果を表 (CSV) に追記し、レポートを書き直す。
+#
+#   ・監視は inotify（Linux）。使えないとき（Windows の共有フォルダなど）や --poll のときは
+#     interval 秒ごとにディレクトリを見てサイズ・更新時刻の変化を調べる
+#   ・書き込み途中のファイルを読まないように、最後の変化から settle 秒たっていて、
+#     $ENER_FIT: まで書かれているファイルだけを処理する
+#   ・フィットはプロセスプールで並列に行う
+#   ・内容のハッシュ (sha256) が表にすでにあるファイルは処理しない
+#     （同じ内容で保存し直しただけのもの、デーモンを再起動したときの既存ファイル）
+#
+# 【使い方】
+#   python3 watchfit.py /data/spe --peaks peaks.json --table fits.csv --report fits.txt
+#   python3 watchfit.py /data/spe --peaks peaks.json --once      # 今あるファイルだけ処理して終わる
+#                                                                # （書き込み途中のものは settle 後に飛ばす）
+#
+#   peaks.json はピークのリスト（mu, sigma から各スクリプトと同じ p_init / p_bounds を作る。
+#   p_init / p_bounds を書けばそちらを使う）:
+#   [
+#     {"name": "Cs137_662", "model": "gauss_pol1", "mu": 1000, "sigma": 20, "fit_range": [900, 1100]},
+#     {"name": "doublet", "model": "double_gauss_pol1", "mu": 2829, "sigma": 4,
+#      "mu2": 3211, "sigma2": 4, "fit_range": [2700, 3300]}
+#   ]
+# ==============================================================
+import argparse
+import csv
+import ctypes
+import ctypes.util
+import datetime
+import hashlib
+import json
+import os
+import select
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import spefit
+
+INTERVAL = 1.0   # ポーリングの間隔 [s]
+SETTLE   = 1.0   # 最後の変化からこれだけたったら書き終わったとみなす [s]
+REPORT_ROWS = 50
+
+FIELDS = ["file", "sha256", "date", "live_time", "real_time", "peak", "model", "xmin", "xmax", "ok",
+          "area", "area_err", "rate", "rate_err", "mu", "mu_err", "sigma", "sigma_err", "rchi2", "error", "fitted"]
+
+
+# ============ inotify ==============
+class Inotify:
+    """libc の inotify を ctypes で使う（Linux のみ。使えなければ OSError）"""
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO    = 0x00000080
+    IN_CREATE      = 0x00000100
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self, path):
+        name = ctypes.util.find_library("c")
+        if name is None:
+            raise OSError("libc not found")
+        libc = ctypes.CDLL(name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, f"inotify_add_watch failed: {path}")
+        self.path = path
+
+    def read(self, timeout):
+        """timeout 秒まで待って、変化のあったファイル名のリストを返す"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            buf = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        names = []
+        pos = 0
+        while pos + self.EVENT.size <= len(buf):
+            _, _, _, length = self.EVENT.unpack_from(buf, pos)
+            pos += self.EVENT.size
+            names.append(os.fsdecode(buf[pos:pos + length].rstrip(b"\0")))
+            pos += length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Poller:
+    """inotify の代わりにディレクトリを定期的に見る"""
+    def __init__(self, path):
+        self.path = path
+        self.seen = {}   # ファイル名 -> (サイズ, 更新時刻)
+
+    def read(self, timeout):
+        time.sleep(timeout)
+        names = []
+        try:
+            entries = list(os.scandir(self.path))
+        except OSError:
+            return []
+        for e in entries:
+            if not e.name.lower().endswith(".spe"):
+                continue
+            try:
+                st = e.stat()
+            except OSError:
+                continue
+            key = (st.st_size, st.st_mtime_ns)
+            if self.seen.get(e.name) != key:
+                self.seen[e.name] = key
+                names.append(e.name)
+        return names
+
+    def close(self):
+        pass
+
+
+# ============ fit ==============
+def load_peaks(path):
+    with open(path) as f:
+        peaks = json.load(f)
+    for i, peak in enumerate(peaks):
+        peak.setdefault("name", f"peak{i}")
+        peak.setdefault("model", "gauss_pol1")
+        if "p_init" not in peak:
+            peak["p_init"], peak["p_bounds"] = spefit.initial_guess(
+                peak["model"], peak["mu"], peak["sigma"], peak.get("mu2"), peak.get("sigma2"))
+    return peaks
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def is_complete(path):
+    """データの後ろの $ENER_FIT: まで書かれているか"""
+    try:
+        with open(path, "rb") as f:
+            return b"$ENER_FIT:" in f.read()
+    except OSError:
+        return False
+
+
+_caches = {}   # cache_path -> FitCache。ワーカープロセスごとに1つだけ開いて使い回す
+
+
+def _cache(cache_path):
+    if cache_path not in _caches:
+        import fitcache
+        _caches[cache_path] = fitcache.FitCache(cache_path)
+    return _caches[cache_path]
+
+
+def fit_file(path, digest, peaks, cache_path=None):
+    """
+    1ファイルの全ピークをフィットして表の行のリストを返す（プロセスプールの中で動く）。
+    cache_path を与えると fitcache を通す（同じスペクトル・設定のフィットはやり直さない）
+    """
+    fitted = datetime.datetime.now().isoformat(timespec="seconds")
+    base = {"file": os.path.basename(path), "sha256": digest, "fitted": fitted}
+    try:
+        spec = spefit.read_spe(path)
+    except (OSError, RuntimeError, StopIteration) as e:
+        return [dict(base, ok=False, error=f"read failed: {e!r}")]
+    base.update(date=spec.date, live_time=spec.live_time, real_time=spec.real_time)
+
+    fitter = _cache(cache_path).fit if cache_path else spefit.fit
+
+    rows = []
+    for peak in peaks:
+        row = dict(base, peak=peak["name"], model=peak["model"],
+                   xmin=peak["fit_range"][0], xmax=peak["fit_range"][1], ok=False)
+        try:
+            res = fitter(spec.counts, peak["model"], peak["fit_range"], peak["p_init"], peak["p_bounds"])
+        except (RuntimeError, ValueError) as e:
+            row["error"] = str(e)
+            rows.append(row)
+            continue
+        row.update(ok=True, area=res.popt[0], area_err=res.perr[0], mu=res.popt[1], mu_err=res.perr[1],
+                   sigma=res.popt[2], sigma_err=res.perr[2], rchi2=res.rchi2)
+        if spec.live_time:
+            row.update(rate=res.popt[0] / spec.live_time, rate_err=res.perr[0] / spec.live_time)
+        rows.append(row)
+    return rows
+
+
+# ============ table / report ==============
+class Table:
+    """結果の CSV。起動時に読み込んで処理済みのハッシュを覚える"""
+    def __init__(self, path):
+        self.path = path
+        self.rows = []
+        if os.path.exists(path):
+            with open(path, newline="") as f:
+                self.rows = list(csv.DictReader(f))
+        self.hashes = {row["sha256"] for row in self.rows}
+
+    def append(self, rows):
+        new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            if new:
+                writer.writeheader()
+            writer.writerows(rows)
+        self.rows += rows
+        self.hashes.update(row["sha256"] for row in rows)
+
+
+def _fmt(value, fmt):
+    if value in (None, ""):
+        return "-"
+    return format(float(value), fmt)
+
+
+def report_lines(rows, title):
+    """結果の行を表のテキストにする"""
+    lines = [f"# {title}  {datetime.datetime.now().isoformat(timespec='seconds')}", "",
+             f"{'file':<28s} {'peak':<12s} {'area':>11s} {'± area':>10s} {'rate [cps]':>11s} "
+             f"{'± rate':>10s} {'mu':>9s} {'sigma':>7s} {'rchi2':>7s}"]
+    for row in rows:
+        if str(row.get("ok")) != "True":
+            lines.append(f"{row['file']:<28s} {row.get('peak') or '-':<12s} failed: {row.get('error')}")
+            continue
+        lines.append(f"{row['file']:<28s} {row['peak']:<12s} {_fmt(row['area'], '11.4e')} {_fmt(row['area_err'], '10.3e')} "
+                     f"{_fmt(row.get('rate'), '11.4e'):>11s} {_fmt(row.get('rate_err'), '10.3e'):>10s} "
+                     f"{_fmt(row['mu'], '9.2f')} {_fmt(row['sigma'], '7.3f')} {_fmt(row['rchi2'], '7.3f')}")
+    return lines
+
+
+def write_report(path, table, n=REPORT_ROWS):
+    """最新 n 行の表を書き直す（途中の状態を読まれないように置き換えで）"""
+    lines = report_lines(table.rows[-n:], f"watchfit report ({len(table.hashes)} files, {len(table.rows)} fits)")
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp, path)
+
+
+# ============ daemon ==============
+def watch(directory, peaks, table, report=None, interval=INTERVAL, settle=SETTLE,
+          workers=None, poll=False, once=False, cache_path=None):
+    watcher = None
+    if not poll and not once:
+        try:
+            watcher = Inotify(directory)
+        except OSError as e:
+            print(f"inotify unavailable ({e}), polling every {interval} s")
+    if watcher is None:
+        watcher = Poller(directory)
+
+    # 起動時に今あるファイルも対象にする
+    pending = {e.name: 0.0 for e in os.scandir(directory) if e.name.lower().endswith(".spe")}
+    running = {}   # future -> (ファイル名, ハッシュ)
+    incomplete = set()   # --once で、settle 待ってもまだ書き込み中だったファイル
+    with ProcessPoolExecutor(workers or os.cpu_count() or 1) as pool:
+        try:
+            while True:
+                now = time.monotonic()
+                for name, t in list(pending.items()):
+                    if now - t < settle:
+                        continue
+                    path = os.path.join(directory, name)
+                    if not os.path.exists(path):
+                        del pending[name]
+                        continue
+                    if not is_complete(path):
+                        if once and name in incomplete:
+                            # --once では待ち続けない（次に起動したときに拾う）
+                            print(f"{name}: skipped, incomplete (no $ENER_FIT:)")
+                            del pending[name]
+                        else:
+                            incomplete.add(name)
+                            pending[name] = now   # 書き込み中。次の変化を待つ
+                        continue
+                    try:
+                        digest = file_hash(path)
+                    except OSError:
+                        pending[name] = now   # 読む直前に消えた・置き換え中。次の回に見直す
+                        continue
+                    del pending[name]
+                    if digest in table.hashes or digest in (d for _, d in running.values()):
+                        continue
+                    running[pool.submit(fit_file, path, digest, peaks, cache_path)] = (name, digest)
+
+                for future in [f for f in running if f.done()]:
+                    name, digest = running.pop(future)
+                    try:
+                        rows = future.result()
+                    except Exception as e:
+                        # ワーカーの中の想定外の例外（キャッシュの sqlite エラー、peaks の書き間違いなど）も
+                        # そのファイルの失敗として記録し、デーモンは止めない
+                        fitted = datetime.datetime.now().isoformat(timespec="seconds")
+                        rows = [{"file": name, "sha256": digest, "fitted": fitted, "ok": False,
+                                 "error": f"fit failed: {e!r}"}]
+                    table.append(rows)
+                    for row in rows:
+                        status = (f"area {float(row['area']):.4e} ± {float(row['area_err']):.3e}"
+                                  if row["ok"] else f"failed: {row.get('error')}")
+                        print(f"{row['file']} {row.get('peak') or ''}: {status}")
+                    if report:
+                        write_report(report, table)
+
+                if once and not pending and not running:
+                    return
+                # 処理待ちがあるときは settle に合わせて早めに戻る
+                timeout = min(interval, settle) if (pending or running) else interval
+                for name in watcher.read(timeout):
+                    if name.lower().endswith(".spe"):
+                        pending[name] = time.monotonic()
+        finally:
+            watcher.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fit .spe files as they appear in a directory")
+    parser.add_argument("directory")
+    parser.add_argument("--peaks", required=True, help="JSON list of peaks to fit")
+    parser.add_argument("--table", default="watchfit.csv", help="CSV the results are appended to")
+    parser.add_argument("--report", default=None, help="text report rewritten after every file")
+    parser.add_argument("--interval", type=float, default=INTERVAL, help="polling interval [s]")
+    parser.add_argument("--settle", type=float, default=SETTLE, help="quiet time before a file is read [s]")
+    parser.add_argument("--workers", type=int, default=None, help="fit processes (default: CPU count)")
+    parser.add_argument("--poll", action="store_true", help="do not use inotify")
+    parser.add_argument("--once", action="store_true", help="process the files present now and exit")
+    parser.add_argument("--cache", default=None, help="fit cache file (fitcache.py)")
+    args = parser.parse_args()
+
+    peaks = load_peaks(args.peaks)
+    table = Table(args.table)
+    print(f"Watching {args.directory} ({len(peaks)} peaks, {len(table.hashes)} files already fitted)")
+    try:
+        watch(args.directory, peaks, table, args.report, args.interval, args.settle,
+              args.workers, args.poll, args.once, args.cache)
+    except KeyboardInterrupt:
+        print("\nStopped.")
+        sys.exit(0)
+
+if __name__ == "__main__":
+    main()
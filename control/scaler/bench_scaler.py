@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# coding: utf-8
+#
+# スケーラーのベンチマーク（mockgpio 上で実際の scalercore / scalergate を動かす）
+#   - 入力レートごとのスループット・取りこぼし・エッジ→コールバック遅延
+#   - 複数チャンネル同時入力
+#   - プリセット停止の遅延（最後に数えたエッジ → gStop 立ち上がり）とオーバーシュート
+#   - ゲート出力の同時操作時の応答時間
+#
+#   python3 bench_scaler.py                    # 表を表示
+#   python3 bench_scaler.py --json out.json    # 結果をJSONでも保存
+#   python3 bench_scaler.py --max-loss 0.01    # 取りこぼし率が超えたら終了コード1（CI用）
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+os.environ["SCALER_GPIO"] = "mock"
+os.environ.pop("SCALER_MOCK_SOURCES", None)
+
+import mockgpio
+import scalergate
+from scalercore import Scaler
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_counting(channels, sources, duration):
+    """channels: 名前→ピン, sources: ピン→パルス列。戻り値はチャンネルごとの結果"""
+    scaler = Scaler({"channels": channels, "charge": next(iter(channels)), "ratios": {}}, fire_gate=False)
+    scaler.setup()
+    scaler.start()
+    t0 = time.perf_counter()
+    for pin, src in sources.items():
+        mockgpio.set_source(pin, src)
+    time.sleep(duration)
+    for pin in sources:
+        mockgpio.clear_source(pin)
+    time.sleep(0.05)  # 配り終わるのを待つ
+    scaler.stop()
+    elapsed = time.perf_counter() - t0
+    results = {}
+    for name, pin in channels.items():
+        st = mockgpio.stats[pin]
+        counted = scaler.channels[name].count
+        results[name] = {
+            "pin": pin,
+            "generated": st["generated"],
+            "counted": counted,
+            "lost": st["generated"] - counted,
+            "loss": (st["generated"] - counted) / st["generated"] if st["generated"] else 0.0,
+            "throughput": counted / elapsed,
+            "latency_p50": percentile(st["latency"], 0.50),
+            "latency_p99": percentile(st["latency"], 0.99),
+            "latency_max": max(st["latency"]) if st["latency"] else float("nan"),
+        }
+    scaler.cleanup()
+    return results
+
+
+def run_preset(rate, counts, repeat):
+    scaler = Scaler(fire_gate=True)
+    scaler.setup()
+    pin = scaler.charge.pin
+    latencies, measured, overshoots = [], [], []
+    for _ in range(repeat):
+        scaler.reset()
+        scaler.set_preset(counts=counts)
+        mockgpio.reset_stats()
+        scaler.start()
+        mockgpio.set_source(pin, mockgpio.poisson(rate))
+        deadline = time.time() + 10 * counts / rate + 1.0
+        # gStop パルスはゲート用スレッドから出るので、停止が確定する (stop_reason) まで待つ
+        while scaler.stop_reason is None and time.time() < deadline:
+            time.sleep(0.001)
+        mockgpio.clear_source(pin)
+        snap = scaler.snapshot()
+        rises = mockgpio.rising_edges(scalergate.gStop)
+        if snap["stop_reason"] == "charge" and snap["stop_latency"] is not None and rises:
+            latencies.append(snap["stop_latency"])
+            measured.append(rises[0] - scaler.charge.last_edge)
+            overshoots.append(snap["overshoot"])
+        if snap["count"] != counts:
+            print(f"WARNING: preset {counts} but counted {snap['count']}", file=sys.stderr)
+    scaler.cleanup()
+    return {
+        "rate": rate, "counts": counts, "runs": len(latencies),
+        "latency_p50": percentile(latencies, 0.50),
+        "latency_max": max(latencies) if latencies else float("nan"),
+        "gate_edge_p50": percentile(measured, 0.50),
+        "overshoot_max": max(overshoots) if overshoots else 0,
+    }
+
+
+def run_gate(clients, presses):
+    scalergate.setup()
+    times = []
+    busy = [0]
+    lock = threading.Lock()
+
+    def client():
+        for _ in range(presses):
+            t = time.perf_counter()
+            try:
+                scalergate.pulse("start")
+            except scalergate.GateBusy:
+                with lock:
+                    busy[0] += 1
+                continue
+            with lock:
+                times.append(time.perf_counter() - t)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    return {"clients": clients, "pulses": len(times), "busy": busy[0],
+            "latency_p50": percentile(times, 0.50), "latency_max": max(times) if times else float("nan")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="scaler benchmark on the mock GPIO backend")
+    parser.add_argument("--duration", type=float, default=2.0, help="seconds per counting run")
+    parser.add_argument("--rates", default="1000,5000,20000", help="input rates [Hz] for the single-channel runs")
+    parser.add_argument("--json", default=None, help="write results to this file")
+    parser.add_argument("--max-loss", type=float, default=None, help="exit 1 if any loss fraction exceeds this")
+    args = parser.parse_args()
+
+    results = {"single": [], "multi": None, "preset": [], "gate": []}
+
+    print("== single channel (Poisson) ==")
+    print(f"{'rate[Hz]':>9s} {'generated':>10s} {'counted':>9s} {'loss':>8s} {'thru[/s]':>10s} {'lat50[us]':>10s} {'lat99[us]':>10s}")
+    for rate in [float(r) for r in args.rates.split(",")]:
+        r = run_counting({"integrator": 5}, {5: mockgpio.poisson(rate, seed=1)}, args.duration)["integrator"]
+        r["rate"] = rate
+        results["single"].append(r)
+        print(f"{rate:9.0f} {r['generated']:10d} {r['counted']:9d} {r['loss']:8.2%} {r['throughput']:10.0f} "
+              f"{r['latency_p50'] * 1e6:10.1f} {r['latency_p99'] * 1e6:10.1f}")
+
+    print("\n== 4 channels (integrator Poisson, trigger bursty, live/clock periodic) ==")
+    channels = {"integrator": 5, "trigger": 6, "live": 13, "clock": 19}
+    sources = {5: mockgpio.poisson(2000, seed=2), 6: mockgpio.bursty(1000, seed=3),
+               13: mockgpio.periodic(900), 19: mockgpio.periodic(1000)}
+    multi = run_counting(channels, sources, args.duration)
+    results["multi"] = multi
+    for name, r in multi.items():
+        print(f"{name:>10s} {r['generated']:10d} {r['counted']:9d} {r['loss']:8.2%} {r['throughput']:10.0f} "
+              f"{r['latency_p50'] * 1e6:10.1f} {r['latency_p99'] * 1e6:10.1f}")
+
+    print("\n== preset-charge stop ==")
+    for rate, counts in [(1000, 200), (10000, 2000)]:
+        r = run_preset(rate, counts, repeat=5)
+        results["preset"].append(r)
+        print(f"rate {rate:6d} Hz, preset {counts:5d}: stop latency p50 {r['latency_p50'] * 1e6:.1f} us, "
+              f"max {r['latency_max'] * 1e6:.1f} us, overshoot max {r['overshoot_max']}")
+
+    print("\n== gate pulses from concurrent clients ==")
+    for clients in (1, 4):
+        r = run_gate(clients, presses=10)
+        results["gate"].append(r)
+        print(f"{clients} client(s): {r['pulses']} pulses, busy {r['busy']}, "
+              f"latency p50 {r['latency_p50'] * 1e3:.1f} ms, max {r['latency_max'] * 1e3:.1f} ms")
+
+    mockgpio.cleanup()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.max_loss is not None:
+        worst = max([r["loss"] for r in results["single"]] + [r["loss"] for r in multi.values()])
+        if worst > args.max_loss:
+            print(f"\nFAIL: loss {worst:.2%} exceeds {args.max_loss:.2%}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,17 @@
-import RPi.GPIO as GPIO
 import tkinter as tk
 from tkinter import font
-import time
 
-# GPIOピンの設定
-input_pin = 5  # GPIOピン5
+import scalerclient
 
-# GPIOのセットアップ
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(input_pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+# scalerd.py の購読（GPIOはデーモン側が持つ）
+subscriber = scalerclient.Subscriber()
+subscriber.start()
 
 # GUIのセットアップ
 root = tk.Tk()
 root.title("GPIO Signal Counter")
 root.configure(bg='white')  # 背景色を白に設定
-root.geometry("400x500")  # ウィンドウの初期サイズを幅500ピクセル、高さ300ピクセルに設定
+root.geometry("400x640")  # ウィンドウの初期サイズを幅500ピクセル、高さ300ピクセルに設定
 root.resizable(False, False)  # ウィンドウのサイズ変更を無効にする
 
 # フォントの設定
@@ -32,40 +29,38 @@ timer_label.pack(pady=20, fill=tk.X, padx=20)
 frequency_label = tk.Label(root, text="Current: 0.000 nQ/s", font=app_font, bg='white', anchor='w')
 frequency_label.pack(pady=20, fill=tk.X, padx=20)
 
-# グローバル変数
-counter = 0
-monitoring = False  # 監視状態
-start_time = None  # スタート時間
-stop_time = None  # ストップ時間
-elapsed_time = 0  # 経過時間
-
-# コールバック関数
-def callback(pin):
-    if monitoring:
-        global counter
-        counter += 1
-
-# タイマー更新関数
+# プリセット入力（空欄なら無効）
+small_font = font.Font(family='Arial', size=14)
+preset_frame = tk.Frame(root, bg='white')
+preset_frame.pack(pady=5, fill=tk.X, padx=20)
+tk.Label(preset_frame, text="Preset", font=small_font, bg='white').pack(side=tk.LEFT)
+preset_count_entry = tk.Entry(preset_frame, width=8, font=small_font)
+preset_count_entry.pack(side=tk.LEFT, padx=5)
+tk.Label(preset_frame, text="x0.1nQ", font=small_font, bg='white').pack(side=tk.LEFT)
+preset_time_entry = tk.Entry(preset_frame, width=6, font=small_font)
+preset_time_entry.pack(side=tk.LEFT, padx=5)
+tk.Label(preset_frame, text="s", font=small_font, bg='white').pack(side=tk.LEFT)
+
+# プリセット停止の報告・接続状態ラベル
+stop_label = tk.Label(root, text="", font=small_font, bg='white', anchor='w')
+stop_label.pack(fill=tk.X, padx=20)
+
+# 表示更新関数（最新のスナップショットを描くだけ）
 def update_timer():
-    global elapsed_time
-    if monitoring:
-        current_time = time.time()
-        elapsed_time = current_time - start_time
-        formatted_time = f"{elapsed_time:.3f} sec"
-        timer_label.config(text=f"Time: {formatted_time}")
-        update_counter()
-        update_frequency()
-        root.after(280, update_timer)
-
-# フリクエンシー更新関数
-def update_frequency():
-    if elapsed_time > 0:
-        frequency = counter / elapsed_time / 10
-        frequency_label.config(text=f"Current: {frequency:.3f} nQ/s")
-
-def update_counter():
-    if elapsed_time > 0:
-        label.config(text=f"Count: {counter} / 0.1nQ")
+    snap = subscriber.latest
+    if not subscriber.connected:
+        stop_label.config(text="scalerd not connected")
+        set_button_state(False, False, False)
+    elif snap is not None:
+        timer_label.config(text=f"Time: {snap['time']:.3f} sec")
+        label.config(text=f"Count: {snap['count']} / 0.1nQ")
+        frequency_label.config(text=f"Current: {snap['current']:.3f} nQ/s")
+        stop_label.config(text=scalerclient.format_stop(snap))
+        if snap["running"]:
+            set_button_state(False, True, False)
+        else:
+            set_button_state(True, False, snap["count"] > 0 or snap["time"] > 0)
+    root.after(280, update_timer)
 
 # ボタンの状態設定関数
 def set_button_state(start_enabled, stop_enabled, reset_enabled):
@@ -73,39 +68,26 @@ def set_button_state(start_enabled, stop_enabled, reset_enabled):
     stop_button['state'] = 'normal' if stop_enabled else 'disabled'
     reset_button['state'] = 'normal' if reset_enabled else 'disabled'
 
-# イベント検出の設定（デフォルトでは無効）
+def read_preset(entry, conv):
+    text = entry.get().strip()
+    try:
+        return conv(text) if text else None
+    except ValueError:
+        entry.delete(0, tk.END)
+        return None
+
+# 計数の開始・停止（デーモンに送る）
 def start_monitoring():
-    global monitoring, start_time, elapsed_time
-    monitoring = True
-    start_time = time.time() - elapsed_time
-    update_timer()
-    set_button_state(False, True, False)
+    scalerclient.command("preset",
+                         counts=read_preset(preset_count_entry, int),
+                         seconds=read_preset(preset_time_entry, float))
+    scalerclient.command("start")
 
 def stop_monitoring():
-    global monitoring, stop_time, elapsed_time
-    stop_time = time.time()
-    monitoring = False
-    elapsed_time = stop_time - start_time  # 更新停止時の経過時間を固定
-    formatted_time = f"{elapsed_time:.3f} sec"
-    timer_label.config(text=f"Time: {formatted_time}")
-    update_counter()
-    update_frequency()
-    set_button_state(True, False, True)
+    scalerclient.command("stop")
 
 def reset_counters():
-    global counter, start_time, stop_time, elapsed_time
-    counter = 0
-    start_time = None
-    stop_time = None
-    elapsed_time = 0
-    label.config(text="Count: 0 / 0.1nQ")
-    timer_label.config(text="Time: 0.000 s")
-    frequency_label.config(text="Current: 0.000 nQ/s")
-    set_button_state(True, False, False)
-
-# GPIOイベント検出の設定
-GPIO.remove_event_detect(input_pin)
-GPIO.add_event_detect(input_pin, GPIO.RISING, callback=callback)
+    scalerclient.command("reset")
 
 # ボタンの追加、色とサイズの設定
 button_width = 10  # ボタンの横幅を統一
@@ -120,13 +102,13 @@ reset_button.pack(pady=10)
 
 # 初期状態の設定
 set_button_state(True, False, False)  # Start enabled, Stop and Reset disabled
+update_timer()
 
-# GPIOのクリーンアップ処理を行う関数
+# 終了処理を行う関数
 def on_closing():
-    GPIO.cleanup()
+    subscriber.close()
     root.destroy()
 
 # ウィンドウを閉じるイベントハンドラの設定
 root.protocol("WM_DELETE_WINDOW", on_closing)
 root.mainloop()
-
@@ -1,65 +1,56 @@
-import RPi.GPIO as GPIO
+import argparse
 import time
-from threading import Thread, Event
 import sys
 
-# GPIOピンの設定
-input_pin = 5  # GPIOピン5
-
-# GPIOのセットアップ
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(input_pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-GPIO.add_event_detect(input_pin, GPIO.RISING)  # イベント検出を追加
-
-# グローバル変数
-counter = 0
-start_time = None
-stop_event = Event()
-
-# エッジ検出を行うスレッド関数
-def edge_detection():
-    global counter, start_time
-    while not stop_event.is_set():
-        if GPIO.event_detected(input_pin):
-            if not stop_event.is_set():
-                counter += 1
-        time.sleep(0.001)  # ショートスリープでCPU使用率を下げる
-
-# ディスプレイ更新関数
-def update_display():
-    while not stop_event.is_set():
-        if start_time is not None:
-            elapsed_time = time.time() - start_time
-            frequency = counter / elapsed_time / 10 if elapsed_time > 0 else 0
-            sys.stdout.write(f"\rCount: {counter} /0.1nQ, Time: {elapsed_time:.3f} s, Current: {frequency:.3f} nQ/s  ")
-            sys.stdout.flush()
-        time.sleep(0.2)  # 0.2秒ごとに更新
+import scalerclient
+
+# ディスプレイ更新（scalerd のストリームを購読して表示するだけ）
+def show(snap):
+    line = f"\rCount: {snap['count']} /0.1nQ, Time: {snap['time']:.3f} s, Current: {snap['current']:.3f} nQ/s"
+    # 電荷以外のチャンネルと比（デッドタイムなど）
+    for name, ch in snap.get("channels", {}).items():
+        if name != snap.get("charge_channel"):
+            line += f", {name}: {ch['count']}"
+    for name, value in snap.get("ratios", {}).items():
+        if value is not None:
+            line += f", {name}: {value:.4f}"
+    sys.stdout.write(line + "  ")
+    sys.stdout.flush()
 
 # メイン関数
 def main():
-    global start_time
-    start_time = time.time()
-    print("Monitoring started... Press Ctrl+C to stop.")
-
-    # エッジ検出とディスプレイ更新のスレッドを開始
-    detection_thread = Thread(target=edge_detection)
-    display_thread = Thread(target=update_display)
-
-    detection_thread.start()
-    display_thread.start()
+    parser = argparse.ArgumentParser(description="GPIO scaler (terminal client of scalerd.py)")
+    parser.add_argument("--url", default=scalerclient.SCALERD_URL, help="scalerd URL")
+    parser.add_argument("--charge", type=int, default=None, help="preset charge: stop after N counts (x0.1 nQ)")
+    parser.add_argument("--time", type=float, default=None, help="preset time: stop after T seconds")
+    parser.add_argument("--watch", action="store_true", help="only display, do not start/stop the run")
+    args = parser.parse_args()
+
+    if not args.watch:
+        scalerclient.command("preset", url=args.url, counts=args.charge, seconds=args.time)
+        scalerclient.command("start", url=args.url)
+        print("Monitoring started... Press Ctrl+C to stop.")
+    else:
+        print("Watching... Press Ctrl+C to quit.")
 
     try:
-        # Ctrl+Cが押されるまでメインスレッドはここで待機
         while True:
-            time.sleep(1)
+            try:
+                for snap in scalerclient.stream(args.url):
+                    show(snap)
+                    if not args.watch and not snap["running"] and snap["stop_reason"] is not None:
+                        print("\n" + scalerclient.format_stop(snap))
+                        return
+            except OSError as e:
+                sys.stdout.write(f"\rscalerd not reachable ({e}), retrying...  ")
+                sys.stdout.flush()
+                time.sleep(1)
     except KeyboardInterrupt:
-        # ストップイベントをセットしてスレッドを終了
-        stop_event.set()
-        detection_thread.join()
-        display_thread.join()
-        print("\nMonitoring stopped.")
-        GPIO.cleanup()
+        if not args.watch:
+            scalerclient.command("stop", url=args.url)
+            print("\nMonitoring stopped.")
+        else:
+            print()
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# coding: utf-8
+#
+# RPi.GPIO の代替（シミュレーション用）
+# Raspberry Pi 以外の Linux / Mac で scaler のコードを動かすためのもの。
+#   - 入力ピンには合成パルス列（Poisson / 周期 / バースト / ファイル再生）を流す
+#   - 出力ピン (gStart / gStop / gReset) への書き込みは時刻付きで記録する
+#
+# 使い方:
+#   SCALER_GPIO=mock python3 scalerd.py
+#   SCALER_GPIO=mock SCALER_MOCK_SOURCES="5=poisson:1000,13=periodic:100" python3 scalerd.py
+#
+# RPi.GPIO と同じく、コールバックはすべて1本のスレッドから順に呼ばれる。
+# ピンごとにラッチは1段だけで、コールバックが前のエッジを処理し終わる前に
+# 同じピンへ2つ以上エッジが来ると、その分は失われる（lost として数える）。
+
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+# ---- RPi.GPIO 互換の定数 ----
+BCM = 11
+BOARD = 10
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+RISING = 31
+FALLING = 32
+BOTH = 33
+
+RPI_INFO = {"TYPE": "mock"}
+
+SPIN_TIME = 200e-6  # 予定時刻の直前はスピンして待つ [s]
+
+
+# ============ パルス列 ==============
+# いずれも開始からの時刻 [s] を順に返すイテレータ
+def periodic(rate, phase=0.0):
+    period = 1.0 / rate
+    for i in itertools.count():
+        yield phase + i * period
+
+def poisson(rate, seed=None):
+    rng = random.Random(seed)
+    t = 0.0
+    while True:
+        t += rng.expovariate(rate)
+        yield t
+
+def bursty(rate, burst_len=100, burst_rate=None, seed=None):
+    """
+    平均レート rate で、burst_len 個ずつ burst_rate [Hz] の周期で固まって来るパルス列。
+    バースト同士の間隔は Poisson（平均レートが rate になるように調整）。
+    """
+    rng = random.Random(seed)
+    burst_rate = burst_rate or rate * 20
+    in_burst = burst_len / burst_rate
+    gap_mean = max(0.0, burst_len / rate - in_burst)
+    t = 0.0
+    while True:
+        t += rng.expovariate(1.0 / gap_mean) if gap_mean > 0 else 0.0
+        for _ in range(burst_len):
+            t += 1.0 / burst_rate
+            yield t
+
+def replay(times, loop=False):
+    """時刻のリスト、または1行1時刻 [s] のファイルを再生する"""
+    if isinstance(times, str):
+        with open(times) as f:
+            times = [float(s) for s in (ln.strip() for ln in f) if s and not s.startswith("#")]
+    times = sorted(times)
+    if not times:
+        return
+    offset = 0.0
+    span = times[-1] - times[0] + (times[-1] - times[0]) / max(1, len(times) - 1)
+    while True:
+        for t in times:
+            yield offset + t - times[0]
+        if not loop:
+            return
+        offset += span
+
+
+def parse_source(spec):
+    """'poisson:1000' / 'periodic:100' / 'bursty:1000:50' / 'replay:file.txt' """
+    kind, _, args = spec.partition(":")
+    args = [a for a in args.split(":") if a]
+    if kind == "poisson":
+        return poisson(float(args[0]))
+    if kind == "periodic":
+        return periodic(float(args[0]))
+    if kind == "bursty":
+        return bursty(float(args[0]), *[int(a) for a in args[1:2]])
+    if kind == "replay":
+        return replay(args[0], loop=len(args) > 1 and args[1] == "loop")
+    raise ValueError(f"unknown pulse source: {spec}")
+
+
+# ============ 内部状態 ==============
+_lock = threading.Condition()
+_mode = None
+_pins = {}          # pin -> {"dir", "value"}
+_detect = {}        # pin -> {"edge", "callbacks", "flag"}
+_sources = {}       # pin -> iterator
+_heap = []          # (t_due, seq, pin)
+_origins = {}       # pin -> パルス列の開始時刻
+_seq = itertools.count()
+_thread = None
+_running = False
+
+outputs = []        # (time.perf_counter(), pin, value)
+stats = {}          # pin -> {"generated", "delivered", "lost", "latency": [...]}
+
+
+def _new_stats():
+    return {"generated": 0, "delivered": 0, "lost": 0, "latency": []}
+
+
+def _push_next(pin, origin):
+    it = _sources.get(pin)
+    if it is None:
+        return
+    try:
+        t = next(it)
+    except StopIteration:
+        _sources.pop(pin, None)
+        return
+    heapq.heappush(_heap, (origin + t, next(_seq), pin))
+
+
+def _feeder():
+    """全入力ピンのエッジを時刻順に配るスレッド（RPi.GPIO のコールバックスレッド相当）"""
+    consumed = {}   # pin -> そのピンのラッチを最後に読んだ時刻
+    while True:
+        with _lock:
+            while _running and not _heap:
+                _lock.wait()
+            if not _running:
+                return
+            t_due, _, pin = _heap[0]
+            now = time.perf_counter()
+            if t_due - now > SPIN_TIME:
+                _lock.wait(t_due - now - SPIN_TIME)
+                continue
+            heapq.heappop(_heap)
+            _push_next(pin, _origins.get(pin, 0.0))
+            st = stats.setdefault(pin, _new_stats())
+            st["generated"] += 1
+            det = _detect.get(pin)
+            callbacks = list(det["callbacks"]) if det else []
+        while time.perf_counter() < t_due:
+            pass
+        t_start = time.perf_counter()
+        if t_due < consumed.get(pin, -1.0):
+            # 前のエッジのラッチが読まれる前に来た → 潰れて失われる
+            st["lost"] += 1
+            continue
+        consumed[pin] = t_start
+        st["delivered"] += 1
+        st["latency"].append(t_start - t_due)
+        _pins.setdefault(pin, {"dir": IN, "value": LOW})["value"] = HIGH
+        if det is not None:
+            det["flag"] = True
+            with _lock:
+                _lock.notify_all()
+            for cb in callbacks:
+                cb(pin)
+
+
+def _ensure_thread():
+    global _thread, _running
+    if _thread is None or not _thread.is_alive():
+        _running = True
+        _thread = threading.Thread(target=_feeder, daemon=True, name="mockgpio")
+        _thread.start()
+
+
+def set_source(pin, source):
+    """入力ピンにパルス列を付ける（source はイテレータ or 'poisson:1000' 形式の文字列）"""
+    if isinstance(source, str):
+        source = parse_source(source)
+    with _lock:
+        _sources[pin] = iter(source)
+        stats[pin] = _new_stats()
+        _heap[:] = [e for e in _heap if e[2] != pin]
+        heapq.heapify(_heap)
+        _origins[pin] = time.perf_counter()
+        _push_next(pin, _origins[pin])
+        _lock.notify_all()
+    _ensure_thread()
+
+
+def clear_source(pin):
+    with _lock:
+        _sources.pop(pin, None)
+        _heap[:] = [e for e in _heap if e[2] != pin]
+        heapq.heapify(_heap)
+
+
+def configure_from_env():
+    spec = os.environ.get("SCALER_MOCK_SOURCES", "")
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        pin, _, src = item.partition("=")
+        set_source(int(pin), src)
+
+
+# ============ RPi.GPIO 互換API ==============
+def setmode(mode):
+    global _mode
+    _mode = mode
+
+def getmode():
+    return _mode
+
+def setwarnings(flag):
+    pass
+
+def setup(channel, direction, pull_up_down=PUD_OFF, initial=None):
+    for pin in (channel if isinstance(channel, (list, tuple)) else [channel]):
+        _pins[pin] = {"dir": direction, "value": LOW if initial is None else initial}
+        if direction == OUT and initial is not None:
+            outputs.append((time.perf_counter(), pin, initial))
+
+def output(channel, value):
+    t = time.perf_counter()
+    for pin in (channel if isinstance(channel, (list, tuple)) else [channel]):
+        _pins.setdefault(pin, {"dir": OUT, "value": LOW})["value"] = int(bool(value))
+        outputs.append((t, pin, int(bool(value))))
+
+def input(channel):
+    return _pins.get(channel, {"value": LOW})["value"]
+
+def add_event_detect(channel, edge, callback=None, bouncetime=None):
+    with _lock:
+        if channel in _detect:
+            raise RuntimeError("Conflicting edge detection already enabled for this GPIO channel")
+        _detect[channel] = {"edge": edge, "callbacks": [callback] if callback else [], "flag": False}
+    _ensure_thread()
+
+def add_event_callback(channel, callback):
+    with _lock:
+        _detect[channel]["callbacks"].append(callback)
+
+def remove_event_detect(channel):
+    with _lock:
+        _detect.pop(channel, None)
+
+def event_detected(channel):
+    det = _detect.get(channel)
+    if det is None or not det["flag"]:
+        return False
+    det["flag"] = False
+    return True
+
+def wait_for_edge(channel, edge, bouncetime=None, timeout=None):
+    with _lock:
+        det = _detect.setdefault(channel, {"edge": edge, "callbacks": [], "flag": False})
+        det["flag"] = False
+        ok = _lock.wait_for(lambda: det["flag"], None if timeout is None else timeout / 1000.0)
+        det["flag"] = False
+    return channel if ok else None
+
+def cleanup(channel=None):
+    global _running
+    with _lock:
+        pins = [channel] if channel is not None else list(_pins)
+        for pin in pins:
+            _pins.pop(pin, None)
+            _detect.pop(pin, None)
+        if channel is None:
+            _running = False
+            _lock.notify_all()
+
+
+# ============ 記録の参照 ==============
+def rising_edges(pin, since=0.0):
+    """出力ピンの立ち上がり時刻 (perf_counter) のリスト"""
+    edges = []
+    prev = LOW
+    for t, p, v in outputs:
+        if p != pin:
+            continue
+        if v == HIGH and prev == LOW and t >= since:
+            edges.append(t)
+        prev = v
+    return edges
+
+def reset_stats():
+    with _lock:
+        for pin in stats:
+            stats[pin] = _new_stats()
+        del outputs[:]
+
+
+configure_from_env()
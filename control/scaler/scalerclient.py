@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# coding: utf-8
+#
+# scalerd.py の購読・操作クライアント
+# GPIOには触らないので、何個同時に起動してもよい。
+
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+SCALERD_URL = os.environ.get("SCALERD_URL", "http://localhost:8081")
+
+
+def status(url=SCALERD_URL, timeout=2.0):
+    with urllib.request.urlopen(url + "/api/status", timeout=timeout) as f:
+        return json.load(f)
+
+
+def command(action, url=SCALERD_URL, timeout=2.0, **body):
+    """start / stop / reset / preset を送る。戻り値はデーモンの応答 (dict)"""
+    req = urllib.request.Request(
+        url + "/api/" + action,
+        data=json.dumps(body).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as f:
+            return json.load(f)
+    except urllib.error.HTTPError as e:
+        return json.load(e)
+    except OSError as e:
+        return {"ok": False, "error": str(e)}
+
+
+def stream(url=SCALERD_URL, timeout=30.0):
+    """/api/stream のスナップショットを順に返すジェネレータ"""
+    with urllib.request.urlopen(url + "/api/stream", timeout=timeout) as f:
+        for raw in f:
+            line = raw.decode().rstrip("\r\n")
+            if line.startswith("data: "):
+                yield json.loads(line[6:])
+
+
+def format_stop(snap):
+    """プリセット停止の報告文字列（手動停止・未停止なら空文字）"""
+    if snap["stop_reason"] not in ("charge", "time"):
+        return ""
+    if snap["stop_latency"] is None:
+        return f"Preset stop ({snap['stop_reason']}): gStop pulse failed: {snap.get('stop_error')}"
+    return (f"Preset stop ({snap['stop_reason']}): latency {snap['stop_latency'] * 1e3:.3f} ms, "
+            f"overshoot {snap['overshoot']} count")
+
+
+class Subscriber(threading.Thread):
+    """
+    バックグラウンドでストリームを読み、最新のスナップショットを latest に置く。
+    on_update があれば受信のたびに（購読スレッドから）呼ぶ。
+    切断されたら retry 秒後に再接続する。
+    """
+    def __init__(self, url=SCALERD_URL, on_update=None, retry=1.0):
+        super().__init__(daemon=True)
+        self.url = url
+        self.on_update = on_update
+        self.retry = retry
+        self.latest = None
+        self.connected = False
+        self.error = None
+        self._closing = threading.Event()
+
+    def run(self):
+        while not self._closing.is_set():
+            try:
+                for snap in stream(self.url):
+                    self.connected = True
+                    self.error = None
+                    self.latest = snap
+                    if self.on_update is not None:
+                        self.on_update(snap)
+                    if self._closing.is_set():
+                        return
+            except (OSError, ValueError) as e:
+                self.error = str(e)
+            self.connected = False
+            self._closing.wait(self.retry)
+
+    def close(self):
+        self._closing.set()
@@ -2,49 +2,67 @@
 # coding: utf-8
 #
 
-import RPi.GPIO as GPIO
 import datetime
-import time
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer
 
 from bottle import route, run
-from bottle import get, post, request
+from bottle import get, post, request, response
 from bottle import template
 
+import scalerclient
+
+# ゲートのピン (gStart/gStop/gReset) は scalerd.py だけが持つ。
+# ここは scalerd の操作画面で、パルスは scalerd の API に頼む（GPIO には触らない）。
+
+
+# リクエストごとにスレッドを立てるサーバ
+# （パルス出力中でも status の問い合わせを待たせない）
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+def gate_status():
+    """scalerd から見たゲートの状態。つながらなければ (None, エラー文字列)"""
+    try:
+        return scalerclient.status()["gate"], None
+    except (OSError, ValueError, KeyError) as e:
+        return None, str(e)
 
-#gStart = 2
-#gStop  = 22
-#gReset = 5
-gStart = 3
-gStop  = 23
-gReset = 6
-GPIO.setmode(GPIO.BCM)
-GPIO.setwarnings(False)
-GPIO.setup(gStart, GPIO.OUT, initial=GPIO.LOW)
-GPIO.setup(gStop,  GPIO.OUT, initial=GPIO.LOW)
-GPIO.setup(gReset, GPIO.OUT, initial=GPIO.LOW)
 
 @route('/')
 def index():
 
     act = request.query.action
-    
-    if act=="start":
-        GPIO.output(gStart, 1)
-        time.sleep(0.01)
-        GPIO.output(gStart, 0)
-
-    if act=="stop":
-        GPIO.output(gStop, 1)
-        time.sleep(0.01)
-        GPIO.output(gStop, 0)
-
-    if act=="reset":
-        GPIO.output(gReset, 1)
-        time.sleep(0.01)
-        GPIO.output(gReset,0)
-        
+
+    error = None
+    if act in ("start", "stop", "reset"):
+        res = scalerclient.command(act)
+        if not res.get("ok"):
+            error = res.get("error")
+
+    gate, status_error = gate_status()
     now = str(datetime.datetime.today())[:19]
-    return template('index',now=now)
+    return template('index', now=now, gate=gate, error=error or status_error)
+
+# ============ JSON API ==============
+# curl -X POST http://<host>:8080/api/start
+# curl http://<host>:8080/api/status
+@post('/api/<action:re:start|stop|reset>')
+def api_action(action):
+    res = scalerclient.command(action)
+    if not res.get("ok"):
+        response.status = 503
+        return {"ok": False, "error": res.get("error")}
+    return {"ok": True, "action": action, "status": res["status"]["gate"]}
+
+@get('/api/status')
+def api_status():
+    gate, error = gate_status()
+    if gate is None:
+        response.status = 503
+        return {"ok": False, "error": error}
+    return gate
 
-run(host='0.0.0.0', port=8080, debug=True)
 
+run(host='0.0.0.0', port=8080, server='wsgiref', server_class=ThreadingWSGIServer, quiet=True)
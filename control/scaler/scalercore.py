@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# coding: utf-8
+#
+# スケーラーの計数部
+# 複数のGPIO入力の立ち上がりエッジを共通の時間軸で数え、
+# プリセット（電荷 or 時間）に達したら計数側で停止を判断して gStop パルスを出す。
+# （パルスは専用のスレッドから出すので、パルス中もエッジのコールバックは止まらない）
+#
+# チャンネル設定 (scaler_channels.json):
+#   {
+#     "channels": {"integrator": 5, "trigger": 6, "live": 13, "clock": 19},
+#     "charge": "integrator",
+#     "ratios": {"livetime": ["live", "clock"]}
+#   }
+#   channels : 名前 → GPIOピン (BCM)
+#   charge   : 電荷プリセットと電流表示に使うチャンネル
+#   ratios   : 名前 → [分子, 分母]（例: ライブタイム比、1 - ratio がデッドタイム）
+
+import collections
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from scalergpio import GPIO
+
+import scalergate
+
+# GPIOピンの設定
+input_pin = 5  # GPIOピン5
+
+CHARGE_PER_COUNT = 0.1  # 1カウントあたりの電荷 [nQ]
+RATE_WINDOW      = 2.0  # 瞬時レートの平均時間 [s]
+
+DEFAULT_CONFIG = {
+    "channels": {"integrator": input_pin},
+    "charge": "integrator",
+    "ratios": {},
+}
+
+
+def load_config(path):
+    with open(path, "r") as f:
+        config = dict(DEFAULT_CONFIG, **json.load(f))
+    if config["charge"] not in config["channels"]:
+        raise ValueError(f"charge channel '{config['charge']}' is not in channels")
+    for name, (num, den) in config["ratios"].items():
+        if num not in config["channels"] or den not in config["channels"]:
+            raise ValueError(f"ratio '{name}' refers to an unknown channel")
+    return config
+
+
+class Channel:
+    """1入力分のカウンタとレート窓"""
+    def __init__(self, name, pin, window=RATE_WINDOW):
+        self.name = name
+        self.pin = pin
+        self.window = window
+        self.count = 0
+        self.last_edge = None
+        self._history = collections.deque()
+
+    def clear(self):
+        self.count = 0
+        self.last_edge = None
+        self._history.clear()
+
+    def rate(self, t):
+        """直近 window 秒のカウント増加から瞬時レート [count/s] を出す（配信側から呼ぶ）"""
+        hist = self._history
+        count = self.count
+        hist.append((t, count))
+        while len(hist) > 2 and t - hist[0][0] > self.window:
+            hist.popleft()
+        t0, c0 = hist[0]
+        if t - t0 <= 0:
+            return 0.0
+        return (count - c0) / (t - t0)
+
+
+class Scaler:
+    def __init__(self, config=None, fire_gate=True):
+        config = config or DEFAULT_CONFIG
+        self.channels = {name: Channel(name, pin) for name, pin in config["channels"].items()}
+        self.charge = self.channels[config["charge"]]
+        self.ratios = dict(config.get("ratios", {}))
+        self._by_pin = {ch.pin: ch for ch in self.channels.values()}
+        self.fire_gate = fire_gate   # プリセット停止時に gStop を出すか
+        self.preset_counts = None    # N カウント (x0.1nQ) で停止
+        self.preset_time = None      # T 秒で停止
+        self._lock = threading.Lock()
+        self._sample_lock = threading.Lock()
+        self._timer = None
+        # gStop のパルスはこのスレッドで出す（GPIO のコールバックスレッドを 10 ms 止めないため）
+        self._gate = ThreadPoolExecutor(max_workers=1, thread_name_prefix="scaler-gate")
+        self.reset()
+
+    # GPIOのセットアップ
+    # コールバックは RPi.GPIO の1本のスレッドで順に呼ばれるので、
+    # チャンネルを増やしてもスレッドは増えない。
+    def setup(self):
+        GPIO.setmode(GPIO.BCM)
+        for ch in self.channels.values():
+            GPIO.setup(ch.pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+            GPIO.remove_event_detect(ch.pin)
+            GPIO.add_event_detect(ch.pin, GPIO.RISING, callback=self._edge)
+        if self.fire_gate:
+            scalergate.setup()
+
+    def set_preset(self, counts=None, seconds=None):
+        self.preset_counts = int(counts) if counts else None
+        self.preset_time = float(seconds) if seconds else None
+
+    @property
+    def counter(self):
+        return self.charge.count
+
+    # ----- counting path -----
+    def _edge(self, pin):
+        t = time.perf_counter()
+        ch = self._by_pin[pin]
+        if not self.running:
+            if self.stopping and ch is self.charge:
+                self._late_edges.append(t)  # 停止判断後の電荷チャンネルのエッジ（_fire_stop で数える）
+            return
+        ch.count += 1
+        ch.last_edge = t
+        if ch is self.charge and self.preset_counts is not None and ch.count >= self.preset_counts:
+            self._auto_stop("charge", t)
+
+    def _time_up(self):
+        if self.running:
+            self._auto_stop("time", self._t0 + self.preset_time)
+
+    def _auto_stop(self, reason, t_trigger):
+        """
+        プリセット到達時の停止。まず計数を止め、gStop パルスはゲート用のスレッドに任せる
+        （コールバックスレッドはすぐ戻り、パルス中のエッジも数えられる）。
+        """
+        with self._lock:
+            if not self.running:
+                return
+            self.running = False
+            self.stopping = True
+            self._freeze()
+        if self._timer is not None and reason != "time":
+            self._timer.cancel()
+        if self.fire_gate:
+            self._gate.submit(self._fire_stop, reason, t_trigger)
+        else:
+            self._fire_stop(reason, t_trigger)
+
+    def _fire_stop(self, reason, t_trigger):
+        """
+        gStop パルスを出して停止を確定する。t_trigger（最後に数えたエッジ or 設定時間）から
+        パルスの立ち上がりまでを stop_latency、その間に来た電荷チャンネルのエッジ数を
+        overshoot とする（パルス幅の間に来たものは数えない）。パルスを出せなかったときは
+        stop_latency = None、理由を stop_error に残す。
+        """
+        latency, error = None, None
+        t_edge = time.perf_counter()
+        if self.fire_gate:
+            try:
+                t_edge = scalergate.pulse("stop")
+                latency = t_edge - t_trigger
+            except scalergate.GateBusy as e:
+                error = str(e)
+                t_edge = time.perf_counter()
+        else:
+            latency = t_edge - t_trigger
+        self.stopping = False
+        self.overshoot = sum(1 for t in self._late_edges if t < t_edge)
+        self.stop_latency = latency
+        self.stop_error = error
+        self.stop_reason = reason
+
+    # ----- run control -----
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self._t0 = time.perf_counter() - self.elapsed
+            self.stop_reason = None
+            self.stop_latency = None
+            self.stop_error = None
+            self.overshoot = 0
+            self._late_edges = []
+            with self._sample_lock:
+                for ch in self.channels.values():
+                    ch._history.clear()  # 停止中の区間をレート窓に入れない
+            self.running = True
+        if self.preset_counts is not None and self.counter >= self.preset_counts:
+            self._auto_stop("charge", time.perf_counter())
+        if self.preset_time is not None:
+            self._timer = threading.Timer(max(0.0, self.preset_time - self.elapsed), self._time_up)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def stop(self):
+        with self._lock:
+            if not self.running:
+                return
+            self.running = False
+            self._freeze()
+        if self._timer is not None:
+            self._timer.cancel()
+        self.stop_reason = "manual"
+
+    def reset(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        with self._sample_lock:
+            for ch in self.channels.values():
+                ch.clear()
+        self.running = False
+        self.stopping = False
+        self.elapsed = 0.0
+        self.stop_reason = None
+        self.stop_latency = None
+        self.stop_error = None
+        self.overshoot = 0
+        self._late_edges = []
+        self._t0 = None
+
+    def _freeze(self):
+        self.elapsed = time.perf_counter() - self._t0  # 停止時の経過時間を固定
+
+    def elapsed_time(self):
+        if self.running:
+            return time.perf_counter() - self._t0
+        return self.elapsed
+
+    def ratio(self, num, den):
+        d = self.channels[den].count
+        return self.channels[num].count / d if d > 0 else None
+
+    def snapshot(self, with_rates=False):
+        """
+        全チャンネルの状態。with_rates=True のときはレート窓も進める
+        （配信スレッドから一定間隔で呼ぶこと）。
+        """
+        elapsed = self.elapsed_time()
+        counter = self.counter
+        snap = {
+            "count": counter,
+            "time": elapsed,
+            "current": counter * CHARGE_PER_COUNT / elapsed if elapsed > 0 else 0.0,  # nQ/s
+            "running": self.running,
+            "preset_counts": self.preset_counts,
+            "preset_time": self.preset_time,
+            "stop_reason": self.stop_reason,
+            "stop_latency": self.stop_latency,
+            "stop_error": self.stop_error,
+            "overshoot": self.overshoot,
+            "charge_channel": self.charge.name,
+            "channels": {},
+            "ratios": {name: self.ratio(num, den) for name, (num, den) in self.ratios.items()},
+        }
+        t = time.perf_counter()
+        with self._sample_lock:
+            for name, ch in self.channels.items():
+                entry = {"pin": ch.pin, "count": ch.count,
+                         "average": ch.count / elapsed if elapsed > 0 else 0.0}
+                if with_rates:
+                    entry["rate"] = ch.rate(t) if self.running else 0.0
+                snap["channels"][name] = entry
+        if with_rates:
+            snap["rate"] = snap["channels"][self.charge.name]["rate"] * CHARGE_PER_COUNT  # nQ/s
+        return snap
+
+    def cleanup(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._gate.shutdown(wait=True)
+        for ch in self.channels.values():
+            GPIO.remove_event_detect(ch.pin)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# coding: utf-8
+#
+# スケーラーデーモン
+# GPIO入力（scaler_channels.json、既定はピン5のみ）とゲート出力をこのプロセスだけが持ち、
+# カウント・レート・ラン状態を HTTP (JSON / Server-Sent Events) で配信する。
+# counter.py / waitedge.py / cui.py / scalercom.py（ブラウザ用の操作画面）はこのデーモンのクライアント。
+#
+#   python3 scalerd.py [--port 8081]
+#   curl http://<host>:8081/api/status
+#   curl -N http://<host>:8081/api/stream
+#   curl -X POST -H 'Content-Type: application/json' -d '{"counts": 1000}' http://<host>:8081/api/preset
+#   curl -X POST http://<host>:8081/api/start
+
+import argparse
+import json
+import os
+import threading
+import time
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer
+
+from scalergpio import GPIO
+from bottle import get, post, request, response, run
+
+import scalergate
+from scalercore import Scaler, DEFAULT_CONFIG, load_config
+
+PUBLISH_INTERVAL = 0.2  # 配信間隔 [s]
+STREAM_KEEPALIVE = 10.0 # 更新がなくても送るコメント行の間隔 [s]
+CONFIG_FILE      = "scaler_channels.json"
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class Publisher:
+    """
+    一定間隔で Scaler のスナップショットを取り、購読者に配る。
+    購読者の数によらずエッジ処理側の負荷は変わらない。
+    """
+    def __init__(self, scaler, interval=PUBLISH_INTERVAL):
+        self.scaler = scaler
+        self.interval = interval
+        self.seq = 0
+        self.latest = None
+        self._cond = threading.Condition()
+        self._running = True
+
+    def publish(self):
+        with self._cond:
+            snap = self.scaler.snapshot(with_rates=True)
+            snap["gate"] = scalergate.status()
+            snap["stamp"] = time.time()
+            self.seq += 1
+            snap["seq"] = self.seq
+            self.latest = snap
+            self._cond.notify_all()
+
+    def loop(self):
+        while self._running:
+            self.publish()
+            time.sleep(self.interval)
+
+    def wait(self, seq, timeout):
+        """seq より新しいスナップショットを待つ（タイムアウトなら None）"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.seq > seq, timeout=timeout)
+            if self.seq > seq:
+                return self.latest
+            return None
+
+    def stop(self):
+        self._running = False
+
+
+scaler = None
+publisher = None
+
+# ============ API ==============
+@get('/api/status')
+def api_status():
+    return publisher.latest
+
+@get('/api/stream')
+def api_stream():
+    response.content_type = 'text/event-stream'
+    response.set_header('Cache-Control', 'no-cache')
+
+    def stream():
+        seq = 0
+        while True:
+            snap = publisher.wait(seq, STREAM_KEEPALIVE)
+            if snap is None:
+                yield ": keepalive\n\n"
+                continue
+            seq = snap["seq"]
+            yield "data: " + json.dumps(snap) + "\n\n"
+    return stream()
+
+@post('/api/preset')
+def api_preset():
+    body = request.json or {}
+    try:
+        scaler.set_preset(counts=body.get("counts"), seconds=body.get("seconds"))
+    except (TypeError, ValueError) as e:
+        response.status = 400
+        return {"ok": False, "error": str(e)}
+    publisher.publish()
+    return {"ok": True, "status": publisher.latest}
+
+@post('/api/<action:re:start|stop|reset>')
+def api_action(action):
+    # ゲートパルスと計数を揃えて操作する
+    try:
+        scalergate.pulse(action)
+    except scalergate.GateBusy as e:
+        response.status = 503
+        return {"ok": False, "error": str(e)}
+    getattr(scaler, action)()
+    publisher.publish()
+    return {"ok": True, "action": action, "status": publisher.latest}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GPIO scaler daemon")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--config", default=CONFIG_FILE, help="channel configuration (JSON)")
+    args = parser.parse_args()
+
+    global scaler, publisher
+    config = load_config(args.config) if os.path.exists(args.config) else DEFAULT_CONFIG
+    scaler = Scaler(config)
+    publisher = Publisher(scaler)
+    print("Channels: " + ", ".join(f"{name}=GPIO{pin}" for name, pin in config["channels"].items()))
+
+    scaler.setup()
+    publisher.publish()
+    threading.Thread(target=publisher.loop, daemon=True).start()
+    try:
+        run(host=args.host, port=args.port, server='wsgiref', server_class=ThreadingWSGIServer, quiet=True)
+    finally:
+        publisher.stop()
+        scaler.cleanup()
+        GPIO.cleanup()
+
+if __name__ == "__main__":
+    main()
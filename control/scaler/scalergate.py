@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# coding: utf-8
+#
+# スケーラーのゲート出力 (Start / Stop / Reset)
+# GPIO出力パルスはロックで直列化し、同時に複数のクライアントから
+# 操作されてもパルスが重ならないようにする。
+
+import datetime
+import threading
+import time
+
+from scalergpio import GPIO
+
+#gStart = 2
+#gStop  = 22
+#gReset = 5
+gStart = 3
+gStop  = 23
+gReset = 6
+
+PULSE_WIDTH  = 0.01  # パルス幅 [s]
+LOCK_TIMEOUT = 0.5   # ロック待ちの上限 [s]（これを超えたら busy として返す）
+
+PINS = {"start": gStart, "stop": gStop, "reset": gReset}
+
+_pulse_lock = threading.Lock()   # GPIO出力用
+_state_lock = threading.Lock()   # 状態参照用（パルス中でも待たない）
+
+_state = {
+    "running": False,
+    "last_action": None,
+    "last_time": None,
+    "pulses": {name: 0 for name in PINS},
+}
+
+
+class GateBusy(Exception):
+    pass
+
+
+def setup():
+    GPIO.setmode(GPIO.BCM)
+    GPIO.setwarnings(False)
+    for pin in PINS.values():
+        GPIO.setup(pin, GPIO.OUT, initial=GPIO.LOW)
+
+
+def pulse(action, timeout=LOCK_TIMEOUT):
+    """
+    action ("start" / "stop" / "reset") に対応するピンにパルスを出す。
+    他のパルス出力中はロックを待ち、timeout 秒を超えたら GateBusy。
+    戻り値はパルスの立ち上がり時刻 (time.perf_counter())。
+    """
+    pin = PINS[action]
+    if not _pulse_lock.acquire(timeout=timeout):
+        raise GateBusy(f"gate is busy ({action})")
+    try:
+        GPIO.output(pin, 1)
+        t_edge = time.perf_counter()
+        t_wall = time.time()
+        time.sleep(PULSE_WIDTH)
+        GPIO.output(pin, 0)
+    finally:
+        _pulse_lock.release()
+
+    with _state_lock:
+        if action == "start":
+            _state["running"] = True
+        elif action == "stop":
+            _state["running"] = False
+        _state["last_action"] = action
+        _state["last_time"] = t_wall
+        _state["pulses"][action] += 1
+    return t_edge
+
+
+def status():
+    with _state_lock:
+        st = dict(_state)
+        st["pulses"] = dict(_state["pulses"])
+    if st["last_time"] is not None:
+        st["last_time"] = str(datetime.datetime.fromtimestamp(st["last_time"]))[:23]
+    st["busy"] = _pulse_lock.locked()
+    return st
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+# coding: utf-8
+#
+# GPIOバックエンドの選択
+#   通常は RPi.GPIO、環境変数 SCALER_GPIO=mock のときは mockgpio（シミュレーション）
+#
+#   from scalergpio import GPIO
+
+import os
+
+if os.environ.get("SCALER_GPIO", "").lower() == "mock":
+    import mockgpio as GPIO
+else:
+    import RPi.GPIO as GPIO
@@ -1,17 +1,32 @@
 import serial
-import time
-import re
 import os
+import argparse
 import atexit
 import datetime
+import sys
 
 try:
     import readline
 except Exception:
     readline = None
 
+import pulsemotor
+
 HISTORY_FILE = os.path.expanduser("~/.Ge_tcon.history")
 LOG_FILE     = os.path.expanduser("~/.Ge_tcon.log")
+TIMING_FILE  = os.path.expanduser("~/.Ge_tcon.timing.json")
+
+# 速度 (v1) [step/s]、移動完了待ちの予測に使う
+SPEED = pulsemotor.SPEED
+
+# ターゲット位置 [step]
+PRESETS = {"goEmpty": 0, "goScreen": 690, "goSm": 1010, "goW": 1340, "goAl": 1100}
+
+parser = argparse.ArgumentParser(description="Ge target controller")
+parser.add_argument("--macro", default=None,
+                    help="run commands from this file ('-' for stdin) after checking all of them")
+parser.add_argument("--check", action="store_true", help="with --macro: only check the commands, do not move")
+args = parser.parse_args()
 
 def setup_history():
     if readline is None:
@@ -36,141 +51,184 @@ def setup_history():
 
     atexit.register(save_history)
 
-def log_command(cmd: str):
+_journal = None
+
+def log_command(cmd: str, flush: bool = True):
+    """
+    コマンドの記録。ファイルは最初の1回だけ開いて開いたままにする。
+    flush=False（マクロ実行中）はバッファに溜め、終了時にまとめて書き出す。
+    """
+    global _journal
     ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     try:
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(f"{ts}\t{cmd}\n")
+        if _journal is None:
+            _journal = open(LOG_FILE, "a", encoding="utf-8")
+            atexit.register(_journal.close)
+        _journal.write(f"{ts}\t{cmd}\n")
+        if flush:
+            _journal.flush()
     except Exception:
         pass
 
 setup_history()
 
-def ReadPosition(ser):
-    while True:
-        status = 1
-        position = -99999
-        ser.write(b'r1\r\n')
-        time.sleep(0.02)
-        while True:
-            response = ser.readline().decode().rstrip("\r\n")
-            match_moving   = re.search(r'Move = (\d)', response)
-            match_position = re.search(r'PC  = (-?\d+)', response)
-            if response == '':
-                print("Position Readout Success")
-                break
-            if "Syntax error" in response:
-                print("Syntax Error")
-                break
-            if match_moving:
-                status = int(match_moving.group(1))
-                if status == 1:
-                    print("Moving", end=', ')
-                elif status == 0:
-                    pass
-            if match_position:
-                position = int(match_position.group(1))
-                print("Position = {} step, {:.1f} mm".format(position, float(position) / 10))
-        if status == 0:
-            break
-        elif status == 1:
-            time.sleep(1)
+def report_timing():
+    # 終了時にシリアルの往復時間のまとめを表示し、ヒストグラムをファイルに残す
+    if not pulsemotor.timing.stats:
+        return
+    print("\n--- serial timing ---")
+    print(pulsemotor.timing.summary())
+    try:
+        pulsemotor.timing.dump(TIMING_FILE)
+    except OSError:
+        pass
+
+atexit.register(report_timing)
+
+def ReadPosition(ax, target=None):
+    """
+    停止するまで待つ。移動先 target が分かっていれば到着時刻を予測してポーリングする。
+    """
+    def on_poll(status, position):
+        if status == 1 and not moving[0]:
+            print("Moving", end=', ', flush=True)
+            moving[0] = True
+
+    moving = [False]
+    position = ax.wait(target, on_poll=on_poll)
+    print("Position = {} step, {:.1f} mm".format(position, ax.to_unit(position)))
+    print("Position Readout Success")
     return position
 
-def GoPosition(ser, num):
-    command = "d1 {}\r\n".format(num)
-    ser.write(command.encode())
-    ReadLine(ser)
-    ser.write(b'abs1\r\n')
-    ReadLine(ser)
-    position = ReadPosition(ser)
-
-def ResetPos(ser):
-    command = "rtncr1\r\n"
-    ser.write(command.encode())
-    ReadLine(ser)
-    position = ReadPosition(ser)
-
-def ReadLine(ser):
-    time.sleep(0.02)
-    while True:
-        response = ser.readline().decode().rstrip("\r\n")
-        if response == '':
-            break
-        if "Syntax error" in response:
-            print("Syntax Error")
-            break
-
-def ReadOutput(ser):
-    time.sleep(0.02)
-    while True:
-        response = ser.readline().decode().rstrip("\r\n")
-        if response == '':
-            break
-        print(response)
+def GoPosition(ax, num):
+    ax.start_move(num)
+    position = ReadPosition(ax, target=num)
+
+def ResetPos(ax):
+    ax.home(wait=False)
+    position = ReadPosition(ax)
+
+def parse_command(command):
+    """1行を (op, 引数のタプル) にする。goXxx のターゲットは goPos に直す。書式の誤りは ValueError"""
+    parts = command.split()
+    if not parts:
+        raise ValueError("empty command")
+    op = parts[0]
+    if op in PRESETS and len(parts) == 1:
+        return "goPos", (PRESETS[op],)
+    if op in ("exit", "pos", "resetPos", "help") and len(parts) == 1:
+        return op, ()
+    if op == "goPos":
+        if len(parts) != 2:
+            raise ValueError("Invalid command format. Use 'goPos <number>'.")
+        try:
+            return op, (int(parts[1]),)
+        except ValueError:
+            raise ValueError("arg[1] must be an integer value.")
+    raise ValueError("unknown command, see help")
+
+def run_command(op, values, ax):
+    """1コマンドを実行する。exit なら False"""
+    if op == 'exit':
+        return False
+    elif op == 'pos':
+        ReadPosition(ax)
+    elif op == 'goPos':
+        GoPosition(ax, values[0])
+    elif op == 'resetPos':
+        ResetPos(ax)
+    elif op == 'help':
+        print("pos       :  Read current position")
+        print("goEmpty   :  Go to an empty target")
+        print("goScreen  :  Go to the BaS screen target")
+        print("goSm      :  Go to the Samarium target")
+        print("goW       :  Go to the Tungsten target")
+        print("goAl      :  Go to the Aluminum target")
+        print("goPos num :  Go to a certain position")
+        print("resetPos  :  Reset position to 0")
+        print("help      :  This help")
+        print("exit      :  Exit this script")
+    return True
+
+def read_macro(path):
+    """マクロを読む。空行と # 以降は無視。戻り値は (行番号, 元の行, op, 引数 or エラー文) のリスト"""
+    f = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        lines = f.read().splitlines()
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    commands = []
+    for lineno, line in enumerate(lines, 1):
+        command = line.split("#", 1)[0].strip()
+        if not command:
+            continue
+        try:
+            op, values = parse_command(command)
+        except ValueError as e:
+            op, values = None, str(e)
+        commands.append((lineno, command, op, values))
+    return commands
 
 try:
-    ser = serial.Serial('/dev/ttyUSB1', 9600, timeout=0.02)
-    ser.flushInput()
+    # PM_DEV_GE でポートを差し替えられる（pmsim.py のシミュレータなど）
+    ser = pulsemotor.open_serial(os.environ.get("PM_DEV_GE", '/dev/ttyUSB1'), 9600, timeout=0.02)
+    ctrl = pulsemotor.Controller(ser, name="Ge")
+    # 1軸機なので応答の位置は "PC  ="
+    ax = ctrl.axis("1", 0.1, "mm", pc="", name="Ge")
     print("************************************")
     print("* Welcome to target controller for *")
     print("* ---------  Ge  Ge  Ge  --------- *")
     print("************************************")
-    ser.write(b'v1 100\r\n')
-    ReadLine(ser)
-    ser.write(b'vs1 100\r\n')
-    ReadLine(ser)
-    position = ReadPosition(ser)
-
-    while True:
-        command = input("Command (or type help): ")
-        log_command(command)
-
-        if command == 'exit':
+    ax.configure(speed=SPEED, start_speed=100)
+    position = ReadPosition(ax)
+
+    if args.macro:
+        commands = read_macro(args.macro)
+        errors = [f"line {lineno}: {command}: {values}" for lineno, command, op, values in commands if op is None]
+        if errors:
+            print("Macro rejected, nothing was moved:")
+            for err in errors:
+                print("  " + err)
             ser.close()
-            break
-        elif command == 'pos':
-            position = ReadPosition(ser)
-        elif command == 'goEmpty':
-            GoPosition(ser, 0)
-        elif command == 'goScreen':
-            GoPosition(ser, 690)
-        elif command == 'goSm':
-            GoPosition(ser, 1010)
-        elif command == 'goW':
-            GoPosition(ser, 1340)
-        elif command == 'goAl':
-            GoPosition(ser, 1100)
-        elif command.startswith('goPos'):
-            parts = command.split()
-            if len(parts) == 2:
-                try:
-                    position = int(parts[1])
-                    GoPosition(ser, position)
-                except ValueError:
-                    print("Error: arg[1] must be an integer value.")
-            else:
-                print("Error: Invalid command format. Use 'goPos <number>'.")
-        elif command == 'resetPos':
-            ResetPos(ser)
-        elif command == 'help':
-            print("pos       :  Read current position")
-            print("goEmpty   :  Go to an empty target")
-            print("goScreen  :  Go to the BaS screen target")
-            print("goSm      :  Go to the Samarium target")
-            print("goW       :  Go to the Tungsten target")
-            print("goAl      :  Go to the Aluminum target")
-            print("goPos num :  Go to a certain position")
-            print("resetPos  :  Reset position to 0")
-            print("help      :  This help")
-            print("exit      :  Exit this script")
-        else:
-            print("unknown command, see help")
+            sys.exit(1)
+        print(f"Macro OK: {len(commands)} commands.")
+        if not args.check:
+            for lineno, command, op, values in commands:
+                print(f"> {command}")
+                log_command(command, flush=False)
+                if not run_command(op, values, ax):
+                    break
+    else:
+        while True:
+            command = input("Command (or type help): ")
+            log_command(command)
+            try:
+                op, values = parse_command(command)
+            except ValueError as e:
+                print(f"Error: {e}")
+                continue
+            # コントローラのエラー・応答なしはそのコマンドだけの失敗として、プロンプトに戻る
+            try:
+                if not run_command(op, values, ax):
+                    break
+            except pulsemotor.CommandError as e:
+                print(f"Syntax Error: {e}")
+            except TimeoutError as e:
+                print(f"WARNING: {e}")
+            except pulsemotor.PulseMotorError as e:
+                print(f"ERROR: {e}")
+    ser.close()
 
 except serial.SerialException as e:
     print(f"Connection Error: {e}")
     exit()
 
+except (TimeoutError, pulsemotor.PulseMotorError) as e:
+    print(f"ERROR: {e}")
+    ser.close()
+    exit()
+
 except KeyboardInterrupt:
     print("\nKeyboard Interrupt detected. Closing serial connection.")
     ser.close()
@@ -1,21 +1,22 @@
 import serial
-import time
-import re
 import os
+import argparse
 import atexit
 import datetime
 
 import sys
 import fcntl
-import termios
 
 try:
     import readline
 except Exception:
     readline = None
 
+import pulsemotor
+
 HISTORY_FILE = os.path.expanduser("~/.Si_tcon.history")
 LOG_FILE     = os.path.expanduser("~/.Si_tcon.log")
+TIMING_FILE  = os.path.expanduser("~/.Si_tcon.timing.json")
 
 # ロックファイル（同一ユーザー運用）
 LOCK_FILE    = os.path.expanduser("~/Si_tcon.lock")
@@ -24,6 +25,18 @@ LOCK_FILE    = os.path.expanduser("~/Si_tcon.lock")
 POS_MIN, POS_MAX = 0, 1300
 ANG_MIN, ANG_MAX = -2000, 2000  # step
 
+# 速度 (v1 / v2) [step/s]、移動完了待ちの予測に使う
+SPEED = pulsemotor.SPEED
+
+# ターゲット位置 [step]
+PRESETS = {"goEmpty": 0, "goScreen": 520, "goAu1": 850, "goAu2": 1170}
+
+parser = argparse.ArgumentParser(description="Si target controller")
+parser.add_argument("--macro", default=None,
+                    help="run commands from this file ('-' for stdin) without prompts, after checking all of them")
+parser.add_argument("--check", action="store_true", help="with --macro: only check the commands, do not move")
+args = parser.parse_args()
+
 def setup_history():
     if readline is None:
         return
@@ -47,16 +60,40 @@ def setup_history():
 
     atexit.register(save_history)
 
-def log_command(cmd: str):
+_journal = None
+
+def log_command(cmd: str, flush: bool = True):
+    """
+    コマンドの記録。ファイルは最初の1回だけ開いて開いたままにする。
+    flush=False（マクロ実行中）はバッファに溜め、終了時にまとめて書き出す。
+    """
+    global _journal
     ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     try:
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(f"{ts}\t{cmd}\n")
+        if _journal is None:
+            _journal = open(LOG_FILE, "a", encoding="utf-8")
+            atexit.register(_journal.close)
+        _journal.write(f"{ts}\t{cmd}\n")
+        if flush:
+            _journal.flush()
     except Exception:
         pass
 
 setup_history()
 
+def report_timing():
+    # 終了時にシリアルの往復時間のまとめを表示し、ヒストグラムをファイルに残す
+    if not pulsemotor.timing.stats:
+        return
+    print("\n--- serial timing ---")
+    print(pulsemotor.timing.summary())
+    try:
+        pulsemotor.timing.dump(TIMING_FILE)
+    except OSError:
+        pass
+
+atexit.register(report_timing)
+
 # ----- single instance lock -----
 _lock_fp = None  # keep reference
 
@@ -97,290 +134,281 @@ def ask_yes_no(prompt: str) -> bool:
     ans = input(prompt).strip().lower()
     return ans == "y"
 
-def read_lines_until_blank(ser, overall_timeout_s: float = 2.0, max_empty_reads: int = 80):
-    """
-    デバイスからの応答を「空行で終端」と仮定して読み切る。
-    - 全体タイムアウト
-    - 連続空読み(b'')が続く場合も異常として扱う
-    """
-    t0 = time.time()
-    empty_reads = 0
-    lines = []
-    while True:
-        if time.time() - t0 > overall_timeout_s:
-            raise TimeoutError("Serial read timed out (no response termination).")
-
-        raw = ser.readline()  # bytes
-        if raw == b'':
-            empty_reads += 1
-            if empty_reads >= max_empty_reads:
-                raise TimeoutError("Serial read timed out (device not responding).")
-            continue
-
-        empty_reads = 0
-        s = raw.decode(errors="replace").rstrip("\r\n")
-        if s == "":
-            return lines
-        lines.append(s)
+def report_moving():
+    """wait の on_poll 用：移動中なら1回だけ "Moving" を表示する"""
+    shown = [False]
+    def on_poll(status, position):
+        if status == 1 and not shown[0]:
+            print("Moving", end=', ', flush=True)
+            shown[0] = True
+    return on_poll
 
-def ReadLine(ser):
-    time.sleep(0.02)
+def ReadPosition(ax, target=None):
     try:
-        lines = read_lines_until_blank(ser, overall_timeout_s=2.0)
+        position = ax.wait(target, on_poll=report_moving())
     except TimeoutError as e:
-        print(f"WARNING: {e}")
-        return
-    for response in lines:
-        if "Syntax error" in response:
-            print("Syntax Error")
-            break
-    time.sleep(0.01)
+        raise TimeoutError(f"ReadPosition failed: {e}")
+    print("Position = {} step, {:.1f} mm".format(position, ax.to_unit(position)))
+    print("Position Readout Success")
+    return position
 
-def ReadOutput(ser):
-    time.sleep(0.02)
+def ReadAngle(ax, target=None):
     try:
-        lines = read_lines_until_blank(ser, overall_timeout_s=2.0)
+        position = ax.wait(target, on_poll=report_moving())
     except TimeoutError as e:
-        print(f"WARNING: {e}")
-        return
-    for response in lines:
-        print(response)
-
-def ReadPosition(ser):
-    while True:
-        status = 1
-        position = -99999
-        ser.write(b'r2\r\n')
-        time.sleep(0.02)
-
-        try:
-            lines = read_lines_until_blank(ser, overall_timeout_s=3.0)
-        except TimeoutError as e:
-            raise TimeoutError(f"ReadPosition failed: {e}")
-
-        for response in lines:
-            match_moving   = re.search(r'Move = (\d)', response)
-            match_position = re.search(r'PC2 = (-?\d+)', response)
-
-            if "Syntax error" in response:
-                print("Syntax Error")
-                break
-
-            if match_moving:
-                status = int(match_moving.group(1))
-                if status == 1:
-                    print("Moving", end=', ')
-                elif status == 0:
-                    pass
-
-            if match_position:
-                position = int(match_position.group(1))
-                print("Position = {} step, {:.1f} mm".format(position, float(position) / 10))
-
-        print("Position Readout Success")
-
-        if status == 0:
-            break
-        elif status == 1:
-            time.sleep(1)
-
+        raise TimeoutError(f"ReadAngle failed: {e}")
+    print("Angle = {} step, {:.1f} deg".format(position, ax.to_unit(position)))
+    print("Angle Readout Success")
     return position
 
-def ReadAngle(ser):
-    while True:
-        status = 1
-        position = -99999
-        ser.write(b'r1\r\n')
-        time.sleep(0.02)
-
-        try:
-            lines = read_lines_until_blank(ser, overall_timeout_s=3.0)
-        except TimeoutError as e:
-            raise TimeoutError(f"ReadAngle failed: {e}")
-
-        for response in lines:
-            match_moving   = re.search(r'Move = (\d)', response)
-            match_position = re.search(r'PC1 = (-?\d+)', response)
-
-            if "Syntax error" in response:
-                print("Syntax Error")
-                break
-
-            if match_moving:
-                status = int(match_moving.group(1))
-                if status == 1:
-                    print("Moving", end=', ')
-                elif status == 0:
-                    pass
-
-            if match_position:
-                position = int(match_position.group(1))
-                print("Angle = {} step, {:.1f} deg".format(position, float(position) / 20))
-
-        print("Angle Readout Success")
-
-        if status == 0:
-            break
-        elif status == 1:
-            time.sleep(1)
-
-    return position
-
-def GoPosition(ser, num):
+def GoPosition(ax, num, confirm=ask_yes_no):
     # 3) ソフトリミット（警告→Y/N）
-    if not (POS_MIN <= num <= POS_MAX):
-        if not ask_yes_no(f"Warning: Position {num} is outside [{POS_MIN}, {POS_MAX}]. Continue? Y/n: "):
+    if not ax.within_limits(num):
+        if not confirm(f"Warning: Position {num} is outside [{POS_MIN}, {POS_MAX}]. Continue? Y/n: "):
             print("Operation cancelled.")
             return
 
-    command = "d2 {}\r\n".format(num)
-    ser.write(command.encode())
-    ReadLine(ser)
-    ser.write(b'abs2\r\n')
-    ReadLine(ser)
-    _ = ReadPosition(ser)
+    ax.start_move(num, force=True)
+    _ = ReadPosition(ax, target=num)
 
-def GoAngle(ser, num):
+def GoAngle(ax, num, confirm=ask_yes_no):
     # 3) ソフトリミット（警告→Y/N）
-    if not (ANG_MIN <= num <= ANG_MAX):
-        if not ask_yes_no(f"Warning: Angle(step) {num} is outside [{ANG_MIN}, {ANG_MAX}]. Continue? Y/n: "):
+    if not ax.within_limits(num):
+        if not confirm(f"Warning: Angle(step) {num} is outside [{ANG_MIN}, {ANG_MAX}]. Continue? Y/n: "):
+            print("Operation cancelled.")
+            return
+
+    # インターロック（符号の変わる移動、15 deg 未満）
+    current_angle = ReadAngle(ax)
+    for warning in ax.warnings(num, current_angle):
+        if not confirm(f"Warning: {warning} Continue? Y/n: "):
             print("Operation cancelled.")
             return
 
-    current_angle = ReadAngle(ser)
-    if (current_angle < 0 and num > 0) or (current_angle > 0 and num < 0):
-        if not ask_yes_no("Warning: You are attempting to move to an angle with a different sign. Continue? Y/n: "):
+    ax.start_move(num, force=True)
+    _ = ReadAngle(ax, target=num)
+
+def GoBoth(pos_ax, rot_ax, pos_num, ang_num, confirm=ask_yes_no):
+    """位置と角度を同時に動かす（時間は遅い方の軸の分だけ）"""
+    if not pos_ax.within_limits(pos_num):
+        if not confirm(f"Warning: Position {pos_num} is outside [{POS_MIN}, {POS_MAX}]. Continue? Y/n: "):
+            print("Operation cancelled.")
+            return
+    if not rot_ax.within_limits(ang_num):
+        if not confirm(f"Warning: Angle(step) {ang_num} is outside [{ANG_MIN}, {ANG_MAX}]. Continue? Y/n: "):
             print("Operation cancelled.")
             return
-    if abs(num) < 300:
-        if not ask_yes_no("Warning: The angle is less than 15 deg. This may be too small. Continue? Y/n: "):
+    for warning in rot_ax.warnings(ang_num):
+        if not confirm(f"Warning: {warning} Continue? Y/n: "):
             print("Operation cancelled.")
             return
 
-    if num > 0:
-        command = "d1 +{}\r\n".format(num)
-    else:
-        command = "d1 {}\r\n".format(num)
-
-    ser.write(command.encode())
-    ReadLine(ser)
-    ser.write(b'abs1\r\n')
-    ReadLine(ser)
-    _ = ReadAngle(ser)
-
-def ResetPos(ser):
-    command = "rtncr2\r\n"
-    ser.write(command.encode())
-    ReadLine(ser)
-    _ = ReadPosition(ser)
-
-def ResetAng(ser):
-    command = "rtncr1\r\n"
-    ser.write(command.encode())
-    ReadLine(ser)
-    _ = ReadAngle(ser)
+    moving = [False]
+    def on_poll(ax, status, position):
+        if status == 1 and not moving[0]:
+            print("Moving", end=', ', flush=True)
+            moving[0] = True
+
+    try:
+        result = pulsemotor.move_many([(pos_ax, pos_num), (rot_ax, ang_num)], force=True, on_poll=on_poll)
+    except TimeoutError as e:
+        raise TimeoutError(f"GoBoth failed: {e}")
+    print("Position = {} step, {:.1f} mm".format(result[pos_ax], pos_ax.to_unit(result[pos_ax])))
+    print("Angle = {} step, {:.1f} deg".format(result[rot_ax], rot_ax.to_unit(result[rot_ax])))
+
+def ResetPos(ax):
+    ax.home(wait=False)
+    _ = ReadPosition(ax)
+
+def ResetAng(ax):
+    ax.home(wait=False)
+    _ = ReadAngle(ax)
+
+def parse_command(command, rot):
+    """
+    1行を (op, 引数のタプル) にする。goXxx のターゲットは goPos に、角度は step に直す。
+    書式の誤りは ValueError。
+    """
+    parts = command.split()
+    if not parts:
+        raise ValueError("empty command")
+    op = parts[0]
+    if op in PRESETS and len(parts) == 1:
+        return "goPos", (PRESETS[op],)
+    if op in ("exit", "pos", "ang", "resetPos", "resetAng", "help") and len(parts) == 1:
+        return op, ()
+    if op == "goPos":
+        if len(parts) != 2:
+            raise ValueError("Invalid command format. Use 'goPos <number>'.")
+        try:
+            return op, (int(parts[1]),)
+        except ValueError:
+            raise ValueError("arg[1] must be an integer value.")
+    if op == "goAng":
+        if len(parts) != 2:
+            raise ValueError("Invalid command format. Use 'goAng <number>'.")
+        try:
+            # 入力はdeg → step(0.05deg=1step)換算
+            return op, (rot.to_steps(parts[1]),)
+        except ValueError:
+            raise ValueError("arg[1] must be a numeric value.")
+    if op == "goBoth":
+        if len(parts) != 3:
+            raise ValueError("Invalid command format. Use 'goBoth <step> <deg>'.")
+        try:
+            return op, (int(parts[1]), rot.to_steps(parts[2]))
+        except ValueError:
+            raise ValueError("arg[1] must be an integer value, arg[2] a numeric value.")
+    raise ValueError("unknown command, see help")
+
+def run_command(op, values, pos, rot, confirm=ask_yes_no):
+    """1コマンドを実行する。exit なら False"""
+    if op == 'exit':
+        return False
+    elif op == 'pos':
+        ReadPosition(pos)
+    elif op == 'ang':
+        ReadAngle(rot)
+    elif op == 'goPos':
+        GoPosition(pos, values[0], confirm)
+    elif op == 'goAng':
+        GoAngle(rot, values[0], confirm)
+    elif op == 'goBoth':
+        GoBoth(pos, rot, values[0], values[1], confirm)
+    elif op == 'resetPos':
+        ResetPos(pos)
+    elif op == 'resetAng':
+        ResetAng(rot)
+    elif op == 'help':
+        print("pos        :  Read current position")
+        print("ang        :  Read current angle")
+        print("goEmpty    :  Go to an empty target")
+        print("goScreen   :  Go to the BaS screen target")
+        print("goAu1      :  Go to the Upper Au target")
+        print("goAu2      :  Go to the Lower Au target")
+        print("goPos step :  Go to a certain position (1 step = 0.1 mm)")
+        print("goAng deg  :  Go to certain angles, 0.05 deg unit in minimum")
+        print("goBoth step deg :  Move position and angle at the same time")
+        print("resetPos  :  Reset position to 0")
+        print("resetAng  :  Reset angle to 0")
+        print("help      :  This help")
+        print("exit      :  Exit this script")
+        print(f"[Soft limits] Position: {POS_MIN}..{POS_MAX} step, Angle: {ANG_MIN}..{ANG_MAX} step")
+    return True
+
+def read_macro(path, rot):
+    """マクロを読む。空行と # 以降は無視。戻り値は (行番号, 元の行, op, 引数) のリスト"""
+    f = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        lines = f.read().splitlines()
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    commands = []
+    for lineno, line in enumerate(lines, 1):
+        command = line.split("#", 1)[0].strip()
+        if not command:
+            continue
+        try:
+            op, values = parse_command(command, rot)
+        except ValueError as e:
+            op, values = None, str(e)
+        commands.append((lineno, command, op, values))
+    return commands
+
+def check_macro(commands, position, angle):
+    """
+    実行前に全体を確認する。位置と角度を順に追いかけて、
+    ソフトリミット・符号の変わる回転・15 deg 未満を調べ、問題の一覧を返す（なければ空）。
+    """
+    errors = []
+    for lineno, command, op, values in commands:
+        where = f"line {lineno}: {command}:"
+        if op is None:
+            errors.append(f"{where} {values}")
+            continue
+        if op == "exit":
+            break
+        if op in ("goPos", "goBoth"):
+            if not POS_MIN <= values[0] <= POS_MAX:
+                errors.append(f"{where} position {values[0]} is outside [{POS_MIN}, {POS_MAX}]")
+            position = values[0]
+        if op in ("goAng", "goBoth"):
+            target = values[-1]
+            if not ANG_MIN <= target <= ANG_MAX:
+                errors.append(f"{where} angle(step) {target} is outside [{ANG_MIN}, {ANG_MAX}]")
+            for warning in pulsemotor.angle_warnings(angle, target):
+                errors.append(f"{where} {warning}")
+            angle = target
+        if op == "resetPos":
+            position = 0
+        if op == "resetAng":
+            angle = 0
+    return errors
 
 # ---------------- main ----------------
 ser = None
+ctrl = None
 try:
     # 多重起動禁止
     ensure_single_instance()
 
     # デバイス占有チェック（OSの排他で掴む）
-    DEV = "/dev/ttyUSB0"
-    try:
-        # pyserial 3.5+ の場合
-        ser = serial.Serial(DEV, 9600, timeout=0.02, exclusive=True)
-    except TypeError:
-        # 古いpyserial向けフォールバック
-        ser = serial.Serial(DEV, 9600, timeout=0.02)
-        try:
-            fcntl.ioctl(ser.fileno(), termios.TIOCEXCL)
-        except OSError as e:
-            ser.close()
-            ser = None
-            print(f"WARNING: {DEV} is already in use by another process. Exit. ({e})")
-            sys.exit(1)
+    DEV = os.environ.get("PM_DEV_SI", "/dev/ttyUSB0")  # pmsim.py のシミュレータなどに差し替え
+    ser = pulsemotor.open_serial(DEV, 9600, timeout=0.02, exclusive=True)
 
-    # 5) flushInput() -> reset_input_buffer()
-    ser.reset_input_buffer()
+    # 5) flushInput() -> reset_input_buffer()（Controller 内で行う）
+    ctrl = pulsemotor.Controller(ser, name="Si")
+    rot  = ctrl.axis("1", 0.05, "deg", limits=(ANG_MIN, ANG_MAX), signed=True, name="Si-rot",
+                     interlock=pulsemotor.angle_warnings)
+    pos  = ctrl.axis("2", 0.1,  "mm",  limits=(POS_MIN, POS_MAX), name="Si-pos")
 
     print("************************************")
     print("* Welcome to target controller for *")
     print("* ---------  Si  Si  Si  --------- *")
     print("************************************")
 
-    ser.write(b'v1 100\r\n')
-    ReadLine(ser)
-    ser.write(b'vs1 100\r\n')
-    ReadLine(ser)
-    ser.write(b'v2 100\r\n')
-    ReadLine(ser)
-    ser.write(b'vs2 100\r\n')
-    ReadLine(ser)
+    rot.configure(speed=SPEED, start_speed=100)
+    pos.configure(speed=SPEED, start_speed=100)
 
-    position = ReadPosition(ser)
-    angle    = ReadAngle(ser)
+    position = ReadPosition(pos)
+    angle    = ReadAngle(rot)
 
-    while True:
-        command = input("Command (or type help): ")
-        log_command(command)
-
-        if command == 'exit':
-            break
-        elif command == 'pos':
-            position = ReadPosition(ser)
-        elif command == 'ang':
-            angle = ReadAngle(ser)
-        elif command == 'goEmpty':
-            GoPosition(ser, 0)
-        elif command == 'goScreen':
-            GoPosition(ser, 520)
-        elif command == 'goAu1':
-            GoPosition(ser, 850)
-        elif command == 'goAu2':
-            GoPosition(ser, 1170)
-        elif command.startswith('goPos'):
-            parts = command.split()
-            if len(parts) == 2:
-                try:
-                    position = int(parts[1])
-                    GoPosition(ser, position)
-                except ValueError:
-                    print("Error: arg[1] must be an integer value.")
-            else:
-                print("Error: Invalid command format. Use 'goPos <number>'.")
-        elif command.startswith('goAng'):
-            parts = command.split()
-            if len(parts) == 2:
-                try:
-                    # 入力はdeg → step(0.05deg=1step)換算
-                    angle_step = int(float(parts[1]) * 20)
-                    GoAngle(ser, angle_step)
-                except ValueError:
-                    print("Error: arg[1] must be a numeric value.")
-            else:
-                print("Error: Invalid command format. Use 'goAng <number>'.")
-        elif command == 'resetPos':
-            ResetPos(ser)
-        elif command == 'resetAng':
-            ResetAng(ser)
-        elif command == 'help':
-            print("pos        :  Read current position")
-            print("ang        :  Read current angle")
-            print("goEmpty    :  Go to an empty target")
-            print("goScreen   :  Go to the BaS screen target")
-            print("goAu1      :  Go to the Upper Au target")
-            print("goAu2      :  Go to the Lower Au target")
-            print("goPos step :  Go to a certain position (1 step = 0.1 mm)")
-            print("goAng deg  :  Go to certain angles, 0.05 deg unit in minimum")
-            print("resetPos  :  Reset position to 0")
-            print("resetAng  :  Reset angle to 0")
-            print("help      :  This help")
-            print("exit      :  Exit this script")
-            print(f"[Soft limits] Position: {POS_MIN}..{POS_MAX} step, Angle: {ANG_MIN}..{ANG_MAX} step")
-        else:
-            print("unknown command, see help")
+    if args.macro:
+        commands = read_macro(args.macro, rot)
+        errors = check_macro(commands, position, angle)
+        if errors:
+            print("Macro rejected, nothing was moved:")
+            for err in errors:
+                print("  " + err)
+            sys.exit(1)
+        print(f"Macro OK: {len(commands)} commands.")
+        if not args.check:
+            for lineno, command, op, values in commands:
+                print(f"> {command}")
+                log_command(command, flush=False)
+                # 確認はすべて事前に済ませているので、ここでは聞かない
+                if not run_command(op, values, pos, rot, confirm=lambda prompt: True):
+                    break
+    else:
+        while True:
+            command = input("Command (or type help): ")
+            log_command(command)
+            try:
+                op, values = parse_command(command, rot)
+            except ValueError as e:
+                print(f"Error: {e}")
+                continue
+            # コントローラのエラー・応答なしはそのコマンドだけの失敗として、プロンプトに戻る
+            try:
+                if not run_command(op, values, pos, rot):
+                    break
+            except pulsemotor.CommandError as e:
+                print(f"Syntax Error: {e}")
+            except TimeoutError as e:
+                print(f"WARNING: {e}")
+            except pulsemotor.PulseMotorError as e:
+                print(f"ERROR: {e}")
 
 except serial.SerialException as e:
     print(f"WARNING: Connection Error (device busy / cannot open): {e}")
@@ -390,7 +418,7 @@ except KeyboardInterrupt:
     print("\nKeyboard Interrupt detected. Exiting program.")
     sys.exit(0)
 
-except TimeoutError as e:
+except (TimeoutError, pulsemotor.PulseMotorError) as e:
     print(f"ERROR: {e}")
     sys.exit(1)
 
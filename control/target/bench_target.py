@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# coding: utf-8
+#
+# ターゲット制御のベンチマーク（pmsim.py のシミュレータ上で実際のドライバを動かす）
+#   - コマンド往復時間: Controller.command (Si_tcon.py / Ge_tcon.py の経路) と
+#                       devserver の read ジョブ (target.py の経路)
+#   - 移動完了の遅れ: 実際の所要時間 − 予測時間 (距離 / 速度)
+#       baseline : 以前の Si_tcon.py と同じ固定 sleep + 1 s ごとのポーリング
+#       cli      : Axis.move_to（適応ポーリング）
+#       web      : DeviceServer.submit("move") → job.wait()
+#       multi    : move_many で Si の2軸と Ge を同時に（所要時間は一番遅い軸の分になるはず）
+#   - 故障注入 (--faults): 応答の欠落・分割送信のもとでの成功率
+#
+#   python3 bench_target.py
+#   python3 bench_target.py --json out.json --faults
+
+import argparse
+import json
+import re
+import sys
+import time
+
+import serial
+
+import devserver
+import pmsim
+import pulsemotor
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def open_controller(sim, name, timeout=pulsemotor.FRAME_TIMEOUT):
+    return pulsemotor.Controller(serial.Serial(sim.path, 9600, timeout=0.02), name=name, timeout=timeout)
+
+
+def baseline_move(ser, num, steps):
+    """以前の Si_tcon.py の GoPosition + ReadPosition と同じ待ち方"""
+    def read_lines():
+        lines = []
+        while True:
+            s = ser.readline().decode(errors="replace").rstrip("\r\n")
+            if s == "":
+                return lines
+            lines.append(s)
+    ser.write(f"d{num} {steps}\r\n".encode())
+    time.sleep(0.02)
+    read_lines()
+    time.sleep(0.01)
+    ser.write(f"abs{num}\r\n".encode())
+    time.sleep(0.02)
+    read_lines()
+    time.sleep(0.01)
+    while True:
+        ser.write(f"r{num}\r\n".encode())
+        time.sleep(0.02)
+        status = 1
+        for line in read_lines():
+            m = re.search(r'Move = (\d)', line)
+            if m:
+                status = int(m.group(1))
+        if status == 0:
+            return
+        time.sleep(1)
+
+
+def bench_rtt(n):
+    sim = pmsim.Simulator()
+    ctrl = open_controller(sim, "Si")
+    ax = ctrl.axis("1", name="Si-rot")
+    cli = []
+    for _ in range(n):
+        t = time.perf_counter()
+        ax.query()
+        cli.append(time.perf_counter() - t)
+
+    server = devserver.DeviceServer(refresh=0)
+    server.add(ctrl)
+    time.sleep(0.1)
+    web = []
+    for _ in range(n):
+        t = time.perf_counter()
+        server.submit("read", "Si-rot").wait(5)
+        web.append(time.perf_counter() - t)
+    server.close()
+    ctrl.close()
+    sim.close()
+    return {
+        "cli": {"p50": percentile(cli, 0.5), "p99": percentile(cli, 0.99)},
+        "web": {"p50": percentile(web, 0.5), "p99": percentile(web, 0.99)},
+    }
+
+
+def bench_moves(distance, repeat):
+    speed = pulsemotor.SPEED
+    predicted = distance / float(speed)
+    results = {}
+
+    # baseline（生のシリアル）
+    sim = pmsim.Simulator()
+    ser = serial.Serial(sim.path, 9600, timeout=0.02)
+    late = []
+    for i in range(repeat):
+        target = distance * (i % 2 == 0)
+        t = time.perf_counter()
+        baseline_move(ser, "2", target)
+        late.append(time.perf_counter() - t - predicted)
+    ser.close()
+    sim.close()
+    results["baseline"] = late
+
+    # cli
+    sim = pmsim.Simulator()
+    ctrl = open_controller(sim, "Si")
+    ax = ctrl.axis("2", name="Si-pos")
+    late = []
+    for i in range(repeat):
+        target = distance * (i % 2 == 0)
+        t = time.perf_counter()
+        ax.move_to(target)
+        late.append(time.perf_counter() - t - predicted)
+    results["cli"] = late
+
+    # web (devserver)
+    server = devserver.DeviceServer(refresh=0)
+    server.add(ctrl)
+    time.sleep(0.1)
+    late = []
+    for i in range(repeat):
+        target = distance * (i % 2 == 1)
+        t = time.perf_counter()
+        job = server.submit("move", "Si-pos", target).wait(predicted * 2 + 10)
+        if job.state != "done":
+            print(f"WARNING: web move {job.state}: {job.error}", file=sys.stderr)
+        late.append(time.perf_counter() - t - predicted)
+    server.close()
+    ctrl.close()
+    sim.close()
+    results["web"] = late
+
+    # multi: Si 2軸 + Ge を同時に
+    sim_si = pmsim.Simulator()
+    sim_ge = pmsim.Simulator(single=True)
+    si = open_controller(sim_si, "Si")
+    ge = open_controller(sim_ge, "Ge")
+    axes = [si.axis("1", name="Si-rot"), si.axis("2", name="Si-pos"), ge.axis("1", pc="", name="Ge")]
+    late = []
+    for i in range(repeat):
+        target = distance * (i % 2 == 0)
+        t = time.perf_counter()
+        pulsemotor.move_many([(ax, target) for ax in axes])
+        late.append(time.perf_counter() - t - predicted)
+    si.close()
+    ge.close()
+    sim_si.close()
+    sim_ge.close()
+    results["multi"] = late
+
+    return {name: {"predicted": predicted, "late_p50": percentile(v, 0.5), "late_max": max(v)}
+            for name, v in results.items()}
+
+
+def bench_faults(n, drop, split):
+    sim = pmsim.Simulator(drop=drop, split=split, seed=1)
+    ctrl = open_controller(sim, "Si", timeout=0.3)
+    ax = ctrl.axis("1", name="Si-rot")
+    ok = timeouts = 0
+    times = []
+    for _ in range(n):
+        t = time.perf_counter()
+        try:
+            ax.query()
+            ok += 1
+            times.append(time.perf_counter() - t)
+        except TimeoutError:
+            timeouts += 1
+    ctrl.close()
+    sim.close()
+    return {"drop": drop, "split": split, "ok": ok, "timeouts": timeouts, "p50": percentile(times, 0.5)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="target controller benchmark on the pty simulator")
+    parser.add_argument("--rtt", type=int, default=200, help="number of round trips")
+    parser.add_argument("--distance", type=int, default=100, help="move distance [step]")
+    parser.add_argument("--repeat", type=int, default=3, help="moves per front end")
+    parser.add_argument("--faults", action="store_true", help="also run with dropped/split responses")
+    parser.add_argument("--json", default=None, help="write results to this file")
+    args = parser.parse_args()
+
+    results = {}
+
+    print("== command round trip (r1) ==")
+    rtt = bench_rtt(args.rtt)
+    results["rtt"] = rtt
+    for name, r in rtt.items():
+        print(f"{name:>8s}: p50 {r['p50'] * 1e3:6.2f} ms, p99 {r['p99'] * 1e3:6.2f} ms")
+
+    print(f"\n== move completion, {args.distance} step at {pulsemotor.SPEED} step/s ==")
+    moves = bench_moves(args.distance, args.repeat)
+    results["moves"] = moves
+    for name, r in moves.items():
+        print(f"{name:>8s}: predicted {r['predicted']:.2f} s, late p50 {r['late_p50'] * 1e3:7.1f} ms, "
+              f"max {r['late_max'] * 1e3:7.1f} ms")
+
+    if args.faults:
+        print("\n== faults (r1 with frame timeout 0.3 s) ==")
+        results["faults"] = []
+        for drop, split in [(0.0, True), (0.05, False), (0.05, True)]:
+            r = bench_faults(100, drop, split)
+            results["faults"].append(r)
+            print(f"drop {drop:.2f}, split {str(split):5s}: ok {r['ok']}, timeouts {r['timeouts']}, "
+                  f"p50 {r['p50'] * 1e3:.2f} ms")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+# coding: utf-8
+#
+# パルスモーターコントローラのデバイスサーバ層
+# シリアルポート（Controller）ごとに専用のワーカースレッドとコマンドキューを持つ。
+#   - HTTP などの呼び出し側は submit() でジョブを積み、すぐにジョブIDを受け取る
+#   - ポートに触るのはワーカーだけなので、コマンドと応答の組が混ざることはない
+#   - 移動はコマンドを送ったら次のジョブへ進み、移動中の軸はワーカーが合間にポーリングする
+#     （移動中でも読み出しや停止を受け付ける）
+#   - 位置・移動中フラグはワーカーが更新する state から返す
+#     （止まっている軸も refresh 秒ごとに1回だけ読み直す。閲覧者が何人いても
+#       コントローラへの問い合わせは増えない。state には読んだ時刻と古さ (age / stale) が付く）
+#   - シリアルの異常 (SerialException / OSError) はそのジョブのエラーにして続ける。
+#     想定外の例外でワーカーが止まったら、待っているジョブを全部エラーにして以後の submit を断る
+#
+#   server = devserver.DeviceServer()
+#   server.add(ctrl0)                      # ctrl0.axes の全軸を登録
+#   job = server.submit("move", "Si-pos", 850)
+#   server.job(job.id)                     # {"state": "running", ...}
+#   jobs = server.submit_moves({"Si-pos": 520, "Si-rot": 600, "Ge": 1010})   # 全軸同時
+#   server.status()                        # 軸ごとの position / moving
+
+import collections
+import itertools
+import queue
+import threading
+import time
+
+import pulsemotor
+
+JOB_HISTORY = 200   # 覚えておく終了済みジョブの数
+REFRESH_INTERVAL = 2.0   # 止まっている軸を読み直す間隔 [s]（0 なら読み直さない）
+STALE_AFTER = 5.0        # これより古い位置は stale とする [s]
+
+KINDS = ("move", "home", "read", "stop")
+
+# ジョブ1つを失敗にして続ける例外（serial.SerialException は OSError の派生。
+# ケーブルが抜けた・USB がつなぎ直された、など）
+PORT_ERRORS = (pulsemotor.PulseMotorError, TimeoutError, OSError)
+
+_ids = itertools.count(1)
+
+
+class Job:
+    """キューに積まれた1操作。state: queued → running → done / error / cancelled"""
+    def __init__(self, kind, axis=None, target=None):
+        self.id = str(next(_ids))
+        self.kind = kind
+        self.axis = axis
+        self.target = target
+        self.state = "queued"
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.done = threading.Event()
+
+    def finish(self, state, result=None, error=None):
+        self.state = state
+        self.result = result
+        self.error = error
+        self.finished = time.time()
+        self.done.set()
+
+    def wait(self, timeout=None):
+        """終わるまで待って自分を返す（timeout を過ぎたらその時点の状態で返す）"""
+        self.done.wait(timeout)
+        return self
+
+    def to_dict(self):
+        return {"id": self.id, "kind": self.kind, "axis": self.axis, "target": self.target,
+                "state": self.state, "result": self.result, "error": self.error,
+                "created": self.created, "finished": self.finished}
+
+
+class DeviceWorker(threading.Thread):
+    """1本のシリアルポートを専有するワーカー"""
+    def __init__(self, ctrl, refresh=REFRESH_INTERVAL):
+        super().__init__(daemon=True, name=f"devserver-{ctrl.name}")
+        self.ctrl = ctrl
+        self.queue = queue.Queue()
+        self.state = {name: {"position": None, "moving": False, "job": None, "error": None, "updated": None}
+                      for name in ctrl.axes}
+        self._lock = threading.Lock()
+        self._moving = {}   # 軸名 -> [job, 次のポーリング時刻, 期限, 予測を過ぎた後の間隔]
+        self._running = True
+        self.dead = None    # ワーカーが止まった理由（止まったら submit は受け付けない）
+        self._current = None
+        self.refresh = refresh
+        self._next_refresh = time.monotonic() + (refresh or 0.0)
+
+    def submit(self, job):
+        with self._lock:
+            if self.dead is not None:
+                raise pulsemotor.PulseMotorError(f"{self.ctrl.name}: device worker stopped: {self.dead}")
+            self.queue.put(job)
+        return job
+
+    def snapshot(self):
+        """軸ごとの state のコピー。age は最後に位置を読んでからの秒数"""
+        now = time.time()
+        with self._lock:
+            snap = {name: dict(st) for name, st in self.state.items()}
+        for st in snap.values():
+            st["age"] = None if st["updated"] is None else now - st["updated"]
+            st["stale"] = st["age"] is None or st["age"] > STALE_AFTER
+        return snap
+
+    def close(self):
+        self._running = False
+        self.queue.put(None)
+
+    # ----- worker thread -----
+    def run(self):
+        try:
+            while self._running:
+                try:
+                    job = self.queue.get(timeout=self._next_wait())
+                except queue.Empty:
+                    job = None
+                if job is not None:
+                    self._current = job
+                    self._execute(job)
+                    self._current = None
+                self._poll_moving()
+                self._refresh_idle()
+        except Exception as e:
+            self._die(f"{type(e).__name__}: {e}")
+            raise
+
+    def _die(self, reason):
+        """想定外の例外で止まるとき: 以後の submit を断り、待っているジョブを全部失敗にする"""
+        print(f"devserver-{self.ctrl.name}: worker stopped: {reason}")
+        with self._lock:
+            self.dead = reason
+            pending = []
+            while True:
+                try:
+                    pending.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            for st in self.state.values():
+                st.update(moving=False, job=None, error=f"worker stopped: {reason}")
+        pending += [m[0] for m in self._moving.values()] + [self._current]
+        self._moving.clear()
+        for job in pending:
+            if job is not None and not job.done.is_set():
+                job.finish("error", error=f"worker stopped: {reason}")
+
+    def _next_wait(self):
+        wake = [m[1] for m in self._moving.values()]
+        if self.refresh:
+            wake.append(self._next_refresh)
+        if not wake:
+            return None
+        return max(0.0, min(wake) - time.monotonic())
+
+    def _update(self, name, **kw):
+        with self._lock:
+            if "position" in kw:
+                kw["updated"] = time.time()
+            self.state[name].update(kw)
+
+    def _execute(self, job):
+        job.state = "running"
+        try:
+            if job.kind == "stop":
+                self._stop(job)
+                return
+            ax = self.ctrl.axes[job.axis]
+            if job.kind == "read":
+                status, position = ax.query()
+                self._update(job.axis, position=position, moving=status == 1, error=None)
+                job.finish("done", position)
+                return
+            self._cancel(job.axis, "superseded")
+            if job.kind == "move":
+                ax.start_move(job.target)
+            else:
+                self.ctrl.command(f"rtncr{ax.num}")
+            self._update(job.axis, moving=True, job=job.id, error=None)
+            now = time.monotonic()
+            if job.target is not None and ax.last_position is not None:
+                timeout = 2 * pulsemotor.predict_time(job.target - ax.last_position, ax.speed) + pulsemotor.TIMEOUT_MARGIN
+            else:
+                timeout = pulsemotor.TIMEOUT_DEFAULT
+            self._moving[job.axis] = [job, now + pulsemotor.POLL_MIN, now + timeout, pulsemotor.POLL_MIN]
+        except PORT_ERRORS + (KeyError,) as e:
+            if job.axis in self.state:
+                self._update(job.axis, error=str(e))
+            job.finish("error", error=str(e))
+
+    def _stop(self, job):
+        """減速停止。まだ送っていない移動は取り消す"""
+        pending = []
+        while True:
+            try:
+                pending.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        for other in pending:
+            if other is None:
+                self._running = False
+            elif other.kind in ("move", "home"):
+                other.finish("cancelled", error="stopped")
+            else:
+                self.queue.put(other)
+        self.ctrl.stop()
+        job.finish("done")
+        # 移動中の軸はこのあと止まったことをポーリングで確認する
+        for m in self._moving.values():
+            m[1] = time.monotonic()
+
+    def _cancel(self, name, reason):
+        m = self._moving.pop(name, None)
+        if m is not None:
+            m[0].finish("cancelled", error=reason)
+
+    def _refresh_idle(self):
+        """止まっている軸を refresh 秒に1回読み直す（移動中の軸は _poll_moving が読む）"""
+        now = time.monotonic()
+        if not self.refresh or now < self._next_refresh:
+            return
+        self._next_refresh = now + self.refresh
+        for name, ax in self.ctrl.axes.items():
+            if name in self._moving:
+                continue
+            try:
+                status, position = ax.query()
+            except PORT_ERRORS as e:
+                self._update(name, error=str(e))
+                continue
+            self._update(name, position=position, moving=status == 1, error=None)
+
+    def _poll_moving(self):
+        now = time.monotonic()
+        for name, m in list(self._moving.items()):
+            job, next_poll, deadline, backoff = m
+            if now < next_poll:
+                continue
+            ax = self.ctrl.axes[name]
+            try:
+                status, position = ax.query()
+            except PORT_ERRORS as e:
+                del self._moving[name]
+                self._update(name, moving=False, job=None, error=str(e))
+                job.finish("error", error=str(e))
+                continue
+            if status == 0:
+                del self._moving[name]
+                self._update(name, position=position, moving=False, job=None)
+                job.finish("done", position)
+                continue
+            self._update(name, position=position, moving=True)
+            if time.monotonic() >= deadline:
+                del self._moving[name]
+                error = f"motion did not finish in time (position {position})"
+                self._update(name, error=error)
+                job.finish("error", error=error)
+                continue
+            # wait_motion と同じく、到着予定の少し手前まで間隔を空け、
+            # 予測を過ぎたら（原点復帰など予測できないときも）倍々に広げる
+            remaining = pulsemotor.predict_time(job.target - position, ax.speed) if job.target is not None else 0.0
+            if remaining > pulsemotor.POLL_MIN:
+                interval = min(pulsemotor.POLL_MAX, remaining / 2)
+            else:
+                interval = backoff
+                m[3] = min(pulsemotor.POLL_MAX, backoff * 2)
+            m[1] = time.monotonic() + interval
+
+
+class DeviceServer:
+    """複数のコントローラのワーカーをまとめ、軸名でジョブを振り分ける"""
+    def __init__(self, refresh=REFRESH_INTERVAL):
+        self.refresh = refresh
+        self.workers = {}   # 軸名 -> DeviceWorker
+        self.jobs = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, ctrl):
+        worker = DeviceWorker(ctrl, self.refresh)
+        for name in ctrl.axes:
+            self.workers[name] = worker
+            worker.submit(Job("read", name))   # 最初の位置
+        worker.start()
+        return worker
+
+    def submit(self, kind, axis, target=None, force=False):
+        """
+        ジョブを積んですぐ返す。軸名の間違い・ソフトリミット外・インターロックの警告は
+        ここで例外（KeyError / pulsemotor.LimitError / pulsemotor.InterlockError）。
+        force=True はインターロックの警告を承知のうえで動かす。
+        stop はその軸のコントローラ全体を止める。
+        """
+        if kind not in KINDS:
+            raise ValueError(f"unknown job kind: {kind}")
+        worker = self.workers[axis]
+        if kind == "move":
+            target = int(target)
+            warnings = self._check_move(axis, target, force)
+            if warnings:
+                raise pulsemotor.InterlockError(warnings)
+        job = worker.submit(Job(kind, axis, target))   # ワーカーが止まっていれば PulseMotorError
+        with self._lock:
+            self.jobs[job.id] = job
+            while len(self.jobs) > JOB_HISTORY:
+                self.jobs.popitem(last=False)
+        return job
+
+    def _check_move(self, name, steps, force):
+        """ソフトリミットを確認し、インターロックの警告のリストを返す（現在位置はワーカーの state）"""
+        ax = self.axis(name)
+        ax.check_limits(steps)
+        if force or ax.interlock is None:
+            return []
+        position = self.workers[name].snapshot()[name]["position"]
+        if position is None:
+            raise pulsemotor.PulseMotorError(f"{name}: position unknown, cannot check interlock")
+        return ax.warnings(steps, position)
+
+    def submit_moves(self, targets, force=False):
+        """
+        targets: {軸名: steps}。全軸のリミットとインターロックを先に確認し、
+        問題がなければ全部のジョブを積んでジョブのリストを返す（1つでも引っかかれば何も積まない）。
+        ワーカーは移動を送ったらすぐ次へ進むので、同じコントローラの2軸も、
+        別のコントローラの軸も同時に動く。
+        force=True はインターロックの警告を承知のうえで動かす（ソフトリミットは常に確認する）。
+        """
+        targets = {name: int(steps) for name, steps in targets.items()}
+        warnings = []
+        for name, steps in targets.items():
+            warnings += self._check_move(name, steps, force)
+        if warnings:
+            raise pulsemotor.InterlockError(warnings)
+        # 確認は済んでいるので、ここでは force で積む
+        return [self.submit("move", name, steps, force=True) for name, steps in targets.items()]
+
+    def job(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+        return None if job is None else job.to_dict()
+
+    def axis(self, name):
+        return self.workers[name].ctrl.axes[name]
+
+    def status(self):
+        status = {}
+        for worker in set(self.workers.values()):
+            status.update(worker.snapshot())
+        return status
+
+    def close(self):
+        for worker in set(self.workers.values()):
+            worker.close()
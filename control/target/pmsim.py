@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# coding: utf-8
+#
+# パルスモーターコントローラのシミュレータ（pty）
+# 実機がなくても Si_tcon.py / Ge_tcon.py / target.py を動かすためのもの。
+#   - 対応コマンド: v<n> / vs<n> / d<n> / abs<n> / r<n> / rtncr<n> / s
+#     （1軸機 --single では軸番号なしの v / vs / d / abs / r / rtncr も受け付け、位置は "PC  =" で返す）
+#   - 応答は「コマンドのエコー + 結果の行 + 空行」。知らないコマンドには "Syntax error"
+#   - 移動は設定速度 (v<n>) の等速で進み、r<n> の Move = / PC<n> = はその時刻の値を返す
+#   - 送受信は baudrate 相当の時間をかけて流す
+#   - 故障の注入: 応答の欠落 (--drop)、応答の遅れ (--delay)、行の途中で分割して送る (--split)、
+#                 Syntax error (--garble)、止まらない軸 (--stall)
+#
+#   python3 pmsim.py --link /tmp/ttySi                 # 2軸機 (Si)
+#   python3 pmsim.py --link /tmp/ttyGe --single        # 1軸機 (Ge)
+#   PM_DEV_SI=/tmp/ttySi python3 Si_tcon.py
+#
+# bench_target.py からは Simulator を直接使う。
+
+import argparse
+import os
+import random
+import re
+import select
+import threading
+import time
+import tty
+
+RE_CMD = re.compile(r'^(v|vs|d|abs|r|rtncr)([12]?)(?:\s+([+-]?\d+))?$')
+
+
+class SimAxis:
+    """等速で動く1軸。位置は時刻から計算する"""
+    def __init__(self, position=0, speed=100):
+        self.speed = speed
+        self.start_speed = speed
+        self.pending = position   # d<n> で設定した移動先
+        self.stalled = False      # 故障注入: Move = 1 のまま止まらない
+        self._from = position
+        self._to = position
+        self._t0 = time.monotonic()
+
+    def position(self, now=None):
+        now = time.monotonic() if now is None else now
+        d = self._to - self._from
+        moved = min(abs(d), int((now - self._t0) * self.speed))
+        return self._from + (moved if d >= 0 else -moved)
+
+    def moving(self, now=None):
+        return self.stalled or self.position(now) != self._to
+
+    def move(self, target):
+        now = time.monotonic()
+        self._from = self.position(now)
+        self._to = target
+        self._t0 = now
+
+    def stop(self):
+        now = time.monotonic()
+        self._from = self._to = self.position(now)
+        self._t0 = now
+        self.stalled = False
+
+
+class Simulator:
+    """
+    pty の片側でコントローラを演じる。path（slave 側）をシリアルポートとして開けばよい。
+      axes     : 軸番号のリスト（2軸機なら "1", "2"）
+      single   : 1軸機（Ge）。位置は "PC  =" で返す
+      baudrate : 送受信のバイトあたりの時間 (10 bit / baudrate) を入れる。0 なら入れない
+      latency  : コマンドを受け取ってから応答を出し始めるまでの時間 [s]
+    """
+    def __init__(self, axes=("1", "2"), single=False, speed=100, baudrate=9600, latency=0.002,
+                 drop=0.0, delay=0.0, split=False, garble=0.0, stall=(), seed=None):
+        self.single = single
+        self.axes = {n: SimAxis(speed=speed) for n in (("1",) if single else axes)}
+        for n in stall:
+            self.axes[n].stalled = True
+        self.byte_time = 10.0 / baudrate if baudrate else 0.0
+        self.latency = latency
+        self.drop = drop
+        self.delay = delay
+        self.split = split
+        self.garble = garble
+        self.rng = random.Random(seed)
+        self.commands = 0
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.path = os.ttyname(self._slave)
+        self._link = None
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, daemon=True, name="pmsim")
+        self._thread.start()
+
+    def link(self, path):
+        """path にシンボリックリンクを張る（固定のデバイス名で開けるように）"""
+        if os.path.islink(path):
+            os.remove(path)
+        os.symlink(self.path, path)
+        self._link = path
+
+    def close(self):
+        self._running = False
+        self._thread.join(1.0)
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        if self._link and os.path.islink(self._link):
+            os.remove(self._link)
+
+    # ----- controller side -----
+    def _serve(self):
+        buf = b""
+        while self._running:
+            ready, _, _ = select.select([self._master], [], [], 0.1)
+            if not ready:
+                continue
+            try:
+                data = os.read(self._master, 1024)
+            except OSError:
+                return
+            buf += data
+            while b"\n" in buf or b"\r" in buf:
+                cut = min(i for i in (buf.find(b"\r"), buf.find(b"\n")) if i >= 0)
+                line, buf = buf[:cut], buf[cut + 1:]
+                line = line.decode(errors="replace").strip()
+                if line:
+                    time.sleep(self.byte_time * (len(line) + 2))   # 受信にかかる時間
+                    self._respond(line)
+
+    def _respond(self, line):
+        self.commands += 1
+        lines = [line] + self.execute(line)
+        if self.drop and self.rng.random() < self.drop:
+            return
+        time.sleep(self.latency + (self.delay if self.delay else 0.0))
+        data = "".join(s + "\r\n" for s in lines) + "\r\n"
+        data = data.encode()
+        if self.split and len(data) > 4:
+            cut = self.rng.randrange(1, len(data) - 1)
+            self._send(data[:cut])
+            time.sleep(0.01)
+            data = data[cut:]
+        self._send(data)
+
+    def _send(self, data):
+        if self.byte_time:
+            time.sleep(self.byte_time * len(data))
+        os.write(self._master, data)
+
+    def execute(self, line):
+        """1コマンドを実行して結果の行（エコーと空行は含まない）を返す"""
+        if self.garble and self.rng.random() < self.garble:
+            return ["Syntax error"]
+        m = RE_CMD.match(line)
+        if line == "s":
+            for ax in self.axes.values():
+                ax.stop()
+            return []
+        if m is None:
+            return ["Syntax error"]
+        cmd, num, value = m.groups()
+        if num == "" and not self.single and cmd != "v" and cmd != "vs":
+            return ["Syntax error"]
+        ax = self.axes.get(num or "1")
+        if ax is None:
+            return ["Syntax error"]
+        if cmd in ("v", "vs", "d") and value is None:
+            return ["Syntax error"]
+        if cmd == "v":
+            ax.speed = max(1, int(value))
+        elif cmd == "vs":
+            ax.start_speed = max(1, int(value))
+        elif cmd == "d":
+            ax.pending = int(value)
+        elif cmd == "abs":
+            ax.move(ax.pending)
+        elif cmd == "rtncr":
+            ax.move(0)
+        elif cmd == "r":
+            now = time.monotonic()
+            label = " " if self.single else (num or "1")
+            return [f"Move = {int(ax.moving(now))}", f"PC{label} = {ax.position(now)}"]
+        return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pulse-motor controller simulator on a pty")
+    parser.add_argument("--link", default=None, help="make a symlink to the pty at this path")
+    parser.add_argument("--single", action="store_true", help="single-axis controller (Ge)")
+    parser.add_argument("--speed", type=int, default=100, help="initial speed [step/s]")
+    parser.add_argument("--baudrate", type=int, default=9600, help="emulated line speed (0: none)")
+    parser.add_argument("--latency", type=float, default=0.002, help="response latency [s]")
+    parser.add_argument("--drop", type=float, default=0.0, help="probability of dropping a response")
+    parser.add_argument("--delay", type=float, default=0.0, help="extra response delay [s]")
+    parser.add_argument("--split", action="store_true", help="send each response in two fragments")
+    parser.add_argument("--garble", type=float, default=0.0, help="probability of a Syntax error reply")
+    parser.add_argument("--stall", default="", help="comma separated axes that never report stopped")
+    args = parser.parse_args()
+
+    sim = Simulator(single=args.single, speed=args.speed, baudrate=args.baudrate, latency=args.latency,
+                    drop=args.drop, delay=args.delay, split=args.split, garble=args.garble,
+                    stall=[s for s in args.stall.split(",") if s])
+    if args.link:
+        sim.link(args.link)
+    print(f"Simulating {'1-axis' if args.single else '2-axis'} controller on {args.link or sim.path}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sim.close()
+        print(f"\n{sim.commands} commands served.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,584 @@
+#!/usr/bin/env python3
+# coding: utf-8
+#
+# パルスモーターコントローラ用の共通処理
+#   FramedSerial : 応答を空行区切りのフレームとして読むシリアルラッパ
+#   Timing       : コマンドごとの往復時間のヒストグラム（FramedSerial が記録する）
+#   parse_status : r<n> の応答 (Move = / PC1 = / PC2 = / PC  =) の解析
+#   wait_motion  : 移動完了待ち（到着予測つきの適応ポーリング）
+#   Controller / Axis : コントローラ1台と軸ごとのドライバ
+#                       （単位換算・ソフトリミット・インターロック）
+#   move_many    : 複数の軸（別コントローラでも可）を同時に動かし、まとめて待つ
+#
+# Si_tcon.py / Ge_tcon.py / target.py はすべてこのドライバを使う。
+#
+#   ctrl = pulsemotor.Controller(pulsemotor.open_serial("/dev/ttyUSB0"))
+#   rot  = ctrl.axis("1", 0.05, "deg", limits=(-2000, 2000), signed=True)
+#   pos  = ctrl.axis("2", 0.1,  "mm",  limits=(0, 1300))
+#   pos.move_to(850)            # step で指定、停止まで待つ
+#   rot.move_to_unit(-30.0)     # 単位 (deg) で指定
+#   pulsemotor.move_many([(pos, 520), (rot, 600)])   # 2軸を同時に、遅い方の時間で終わる
+
+import collections
+import json
+import re
+import select
+import threading
+import time
+
+SPEED = 100  # v1 / v2 で設定する速度 [step/s]
+
+POLL_MIN = 0.02     # 到着予定付近のポーリング間隔 [s]
+POLL_MAX = 0.5      # 長い移動中のポーリング間隔の上限 [s]
+TIMEOUT_MARGIN = 5.0  # 予測時間に足すタイムアウトの余裕 [s]
+TIMEOUT_DEFAULT = 120.0  # 距離が分からないとき（原点復帰など）のタイムアウト [s]
+FRAME_TIMEOUT = 2.0  # 1応答（空行まで）の待ち時間の上限 [s]
+RETRIES = 1          # 応答が来なかったときの再送回数（プロトコルのコマンドはどれも送り直してよい）
+
+HIST_EDGES = [0.25 * 2 ** i for i in range(16)]   # ヒストグラムのビンの上端 [ms] (0.25 .. 8192)
+
+RE_MOVE = re.compile(r'Move = (\d)')
+RE_PC   = re.compile(r'PC([12 ]) = (-?\d+)')   # "PC1 =", "PC2 =", "PC  ="（1軸機）
+SYNTAX_ERROR = "Syntax error"
+
+SMALL_ANGLE = 300  # これより小さい角度 [step] (= 15 deg) は警告
+
+
+class PulseMotorError(Exception):
+    pass
+
+class CommandError(PulseMotorError):
+    """コントローラが Syntax error を返した"""
+    pass
+
+class LimitError(PulseMotorError):
+    """ソフトリミットの外への移動"""
+    pass
+
+class InterlockError(PulseMotorError):
+    """インターロックの警告がある移動（force なしで要求された）"""
+    def __init__(self, warnings):
+        super().__init__(" ".join(warnings))
+        self.warnings = warnings
+
+
+class Timing:
+    """
+    コマンドの種類 (r / d / abs / v / vs / rtncr / s) ごとの記録:
+      書き込み → 最初のバイト (first)、書き込み → フレーム完了 (frame) のヒストグラム [ms]、
+      送受信バイト数、再送回数、タイムアウト回数
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {}
+
+    @staticmethod
+    def kind(cmd):
+        m = re.match(r'[a-z]+', cmd)
+        return m.group(0) if m else cmd
+
+    @staticmethod
+    def _new_hist():
+        return {"n": 0, "sum": 0.0, "max": 0.0, "bins": [0] * (len(HIST_EDGES) + 1)}
+
+    @staticmethod
+    def _add(hist, ms):
+        hist["n"] += 1
+        hist["sum"] += ms
+        hist["max"] = max(hist["max"], ms)
+        i = 0
+        while i < len(HIST_EDGES) and ms > HIST_EDGES[i]:
+            i += 1
+        hist["bins"][i] += 1
+
+    @staticmethod
+    def percentile(hist, q):
+        """ヒストグラムからの近似値（そのビンの上端。max を超えない）[ms]"""
+        if hist["n"] == 0:
+            return None
+        need = q * hist["n"]
+        total = 0
+        for i, c in enumerate(hist["bins"]):
+            total += c
+            if total >= need and c:
+                return min(HIST_EDGES[i], hist["max"]) if i < len(HIST_EDGES) else hist["max"]
+        return hist["max"]
+
+    def record(self, cmd, bytes_out, bytes_in, t_write, t_first, t_done, retries):
+        """t_* は time.perf_counter()。t_done が None ならタイムアウト"""
+        with self._lock:
+            st = self.stats.get(self.kind(cmd))
+            if st is None:
+                st = self.stats[self.kind(cmd)] = {
+                    "count": 0, "timeouts": 0, "retries": 0, "bytes_out": 0, "bytes_in": 0,
+                    "first": self._new_hist(), "frame": self._new_hist()}
+            st["count"] += 1
+            st["retries"] += retries
+            st["bytes_out"] += bytes_out * (retries + 1)
+            st["bytes_in"] += bytes_in
+            if t_first is not None:
+                self._add(st["first"], (t_first - t_write) * 1e3)
+            if t_done is None:
+                st["timeouts"] += 1
+            else:
+                self._add(st["frame"], (t_done - t_write) * 1e3)
+
+    def to_dict(self):
+        with self._lock:
+            stats = json.loads(json.dumps(self.stats))
+        for st in stats.values():
+            for key in ("first", "frame"):
+                h = st[key]
+                h["mean"] = h["sum"] / h["n"] if h["n"] else None
+                h["p50"] = self.percentile(h, 0.50)
+                h["p90"] = self.percentile(h, 0.90)
+        return {"edges_ms": HIST_EDGES, "commands": stats}
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def reset(self):
+        with self._lock:
+            self.stats.clear()
+
+    def summary(self):
+        """1コマンド種類1行の表（CLI の終了時に表示する）"""
+        d = self.to_dict()["commands"]
+        if not d:
+            return "no serial commands recorded"
+        lines = [f"{'cmd':>6s} {'n':>6s} {'first p50':>10s} {'frame p50':>10s} {'frame p90':>10s} "
+                 f"{'frame max':>10s} {'bytes/cmd':>10s} {'retry':>6s} {'timeout':>8s}"]
+        fmt = lambda v: "-" if v is None else f"{v:.1f}ms"
+        for kind, st in sorted(d.items()):
+            lines.append(f"{kind:>6s} {st['count']:6d} {fmt(st['first']['p50']):>10s} {fmt(st['frame']['p50']):>10s} "
+                         f"{fmt(st['frame']['p90']):>10s} {fmt(st['frame']['max'] if st['frame']['n'] else None):>10s} "
+                         f"{(st['bytes_out'] + st['bytes_in']) / st['count']:10.1f} {st['retries']:6d} {st['timeouts']:8d}")
+        return "\n".join(lines)
+
+
+# プロセス全体で共有する記録（Controller の既定）
+timing = Timing()
+
+
+class FramedSerial:
+    """
+    コントローラの応答は「数行 + 空行」で1フレーム。
+    受信済みのバイト (in_waiting) をまとめてバッファに吸い出して行に分け、
+    空行が来た時点でそのフレームを返す（固定の sleep や readline のタイムアウト待ちをしない）。
+    """
+    def __init__(self, ser, timeout=FRAME_TIMEOUT, timing=None):
+        self.ser = ser
+        self.timeout = timeout
+        self.timing = timing     # Timing（None なら記録しない）
+        self._t_first = None     # 書き込み後に最初のバイトを受け取った時刻
+        self._nin = 0            # 書き込み後に受け取ったバイト数
+        self._buf = b""
+        self._lines = []
+        self._frames = collections.deque()
+        try:
+            self._fd = ser.fileno()
+        except (AttributeError, OSError, ValueError):
+            self._fd = None
+
+    def write(self, data):
+        self.discard()
+        self._t_first = None
+        self._nin = 0
+        return self.ser.write(data)
+
+    def close(self):
+        self.ser.close()
+
+    def _feed(self, data):
+        *lines, self._buf = (self._buf + data).split(b"\n")
+        for raw in lines:
+            s = raw.rstrip(b"\r").decode(errors="replace")
+            if s == "":
+                self._frames.append(self._lines)
+                self._lines = []
+            else:
+                self._lines.append(s)
+
+    def _fill(self, wait):
+        """受信済みのバイトを全部読む。何もなければ最大 wait 秒待つ"""
+        n = self.ser.in_waiting
+        if n == 0 and self._fd is not None:
+            ready, _, _ = select.select([self._fd], [], [], wait)
+            if not ready:
+                return
+            n = self.ser.in_waiting
+        data = self.ser.read(max(1, n))  # fd が無いときはポートの timeout で待つ
+        if data:
+            if self._t_first is None:
+                self._t_first = time.perf_counter()
+            self._nin += len(data)
+            self._feed(data)
+
+    def read_frame(self, timeout=None):
+        """次のフレーム（空行までの行のリスト）を返す。timeout 秒で TimeoutError"""
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        while not self._frames:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("Serial read timed out (no response termination).")
+            self._fill(remaining)
+        return self._frames.popleft()
+
+    def discard(self):
+        """前のコマンドの読み残し（遅れて届いた応答など）を捨てる"""
+        if self.ser.in_waiting:
+            self.ser.read(self.ser.in_waiting)
+        self._buf = b""
+        self._lines = []
+        self._frames.clear()
+
+    def command(self, cmd, timeout=None, retries=0):
+        """cmd を送って応答フレームを返す。応答が来なければ retries 回まで送り直す"""
+        data = (cmd + "\r\n").encode()
+        for attempt in range(retries + 1):
+            t_write = time.perf_counter()
+            self.write(data)
+            try:
+                frame = self.read_frame(timeout)
+            except TimeoutError:
+                if attempt < retries:
+                    continue
+                if self.timing is not None:
+                    self.timing.record(cmd, len(data), self._nin, t_write, self._t_first, None, attempt)
+                raise
+            if self.timing is not None:
+                self.timing.record(cmd, len(data), self._nin, t_write, self._t_first,
+                                   time.perf_counter(), attempt)
+            return frame
+
+
+def parse_status(lines):
+    """
+    r<n> の応答から {"moving": 0/1/None, "pc": {"1": .., "2": .., "": ..}, "error": bool} を作る。
+    """
+    status = {"moving": None, "pc": {}, "error": False}
+    for line in lines:
+        if SYNTAX_ERROR in line:
+            status["error"] = True
+            continue
+        m = RE_MOVE.search(line)
+        if m:
+            status["moving"] = int(m.group(1))
+        m = RE_PC.search(line)
+        if m:
+            status["pc"][m.group(1).strip()] = int(m.group(2))
+    return status
+
+
+def predict_time(distance, speed=SPEED):
+    """distance [step] の移動にかかる時間の見積もり [s]"""
+    return abs(distance) / float(speed)
+
+
+def wait_motion(query, target=None, speed=SPEED, timeout=None, on_poll=None,
+                poll_min=POLL_MIN, poll_max=POLL_MAX):
+    """
+    query() が (status, position) を返す関数（status: 1=移動中, 0=停止）。
+    停止するまで query を呼び、最後の (status, position) を返す。
+
+    - target が分かっていれば、現在位置からの残り距離と speed で到着時刻を予測し、
+      遠いうちは間隔を空け（最大 poll_max）、到着予定付近は poll_min で細かく見る。
+    - 予測を過ぎても止まらなければ poll_min から倍々に間隔を広げる。
+    - timeout（省略時は 2×予測 + TIMEOUT_MARGIN）を超えたら TimeoutError。
+    """
+    t0 = time.monotonic()
+    status, position = query()
+    if on_poll is not None:
+        on_poll(status, position)
+    if status == 0:
+        return status, position
+
+    if timeout is None:
+        if target is not None:
+            timeout = 2 * predict_time(target - position, speed) + TIMEOUT_MARGIN
+        else:
+            timeout = TIMEOUT_DEFAULT
+    deadline = t0 + timeout
+    backoff = poll_min
+
+    while True:
+        now = time.monotonic()
+        if target is not None:
+            remaining = predict_time(target - position, speed)
+        else:
+            remaining = 0.0
+        if remaining > poll_min:
+            # 到着予定の少し手前まで待つ
+            interval = min(poll_max, remaining / 2)
+            backoff = poll_min
+        else:
+            interval = backoff
+            backoff = min(poll_max, backoff * 2)
+        if now + interval > deadline:
+            interval = max(0.0, deadline - now)
+        time.sleep(interval)
+
+        status, position = query()
+        if on_poll is not None:
+            on_poll(status, position)
+        if status == 0:
+            return status, position
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"motion did not finish within {timeout:.1f} s (position {position})")
+
+
+def open_serial(dev, baudrate=9600, timeout=0.02, exclusive=False):
+    """
+    シリアルポートを開く。exclusive=True なら他プロセスと共有しない
+    （使用中なら serial.SerialException）。
+    """
+    import serial
+    if not exclusive:
+        return serial.Serial(dev, baudrate, timeout=timeout)
+    try:
+        # pyserial 3.5+ の場合
+        return serial.Serial(dev, baudrate, timeout=timeout, exclusive=True)
+    except TypeError:
+        # 古いpyserial向けフォールバック
+        import fcntl
+        import termios
+        ser = serial.Serial(dev, baudrate, timeout=timeout)
+        try:
+            fcntl.ioctl(ser.fileno(), termios.TIOCEXCL)
+        except OSError as e:
+            ser.close()
+            raise serial.SerialException(f"{dev} is already in use by another process ({e})")
+        return ser
+
+
+class Controller:
+    """
+    コントローラ1台（シリアルポート1本）。
+    コマンドと応答の組はロックで1つずつ行う。
+    """
+    def __init__(self, ser, name="", timeout=FRAME_TIMEOUT, retries=RETRIES, timing=timing):
+        if not isinstance(ser, FramedSerial):
+            if hasattr(ser, "reset_input_buffer"):
+                ser.reset_input_buffer()
+            ser = FramedSerial(ser, timeout=timeout, timing=timing)
+        self.io = ser
+        self.name = name
+        self.retries = retries
+        self.lock = threading.RLock()
+        self.axes = {}
+
+    def command(self, cmd, timeout=None):
+        """cmd を送り応答フレーム（行のリスト）を返す。Syntax error なら CommandError"""
+        with self.lock:
+            lines = self.io.command(cmd, timeout, self.retries)
+        if any(SYNTAX_ERROR in line for line in lines):
+            raise CommandError(f"{self.name} {cmd}: Syntax error")
+        return lines
+
+    def axis(self, num, unit_per_step=1.0, unit="step", limits=None, pc=None,
+             speed=SPEED, signed=False, name=None, interlock=None):
+        ax = Axis(self, num, unit_per_step, unit, limits, pc, speed, signed, name, interlock)
+        self.axes[ax.name] = ax
+        return ax
+
+    def stop(self):
+        """全軸の減速停止 (s)"""
+        return self.command("s")
+
+    def close(self):
+        self.io.close()
+
+
+class Axis:
+    """
+    コントローラの1軸。位置は step（整数）で扱い、unit_per_step で単位に換算する。
+      num    : コマンドの軸番号 ("1", "2")
+      pc     : 応答の位置ラベル（"PC1 =" なら "1"、1軸機の "PC  =" なら ""）。省略時は num
+      limits : ソフトリミット (min, max) [step]
+      signed : d<n> で正の値にも "+" を付ける
+      interlock : interlock(current, target) が警告文のリストを返す関数（angle_warnings など）
+    """
+    def __init__(self, ctrl, num, unit_per_step=1.0, unit="step", limits=None, pc=None,
+                 speed=SPEED, signed=False, name=None, interlock=None):
+        self.ctrl = ctrl
+        self.num = str(num)
+        self.pc = self.num if pc is None else pc
+        self.unit_per_step = unit_per_step
+        self.unit = unit
+        self.limits = limits
+        self.speed = speed
+        self.signed = signed
+        self.name = name or (ctrl.name + self.num)
+        self.interlock = interlock
+        self.last_position = None
+
+    # ----- 単位換算 -----
+    def to_unit(self, steps):
+        return steps * self.unit_per_step
+
+    def to_steps(self, value):
+        return int(round(float(value) / self.unit_per_step))
+
+    def within_limits(self, steps):
+        return self.limits is None or self.limits[0] <= steps <= self.limits[1]
+
+    def check_limits(self, steps):
+        if not self.within_limits(steps):
+            raise LimitError(f"{self.name}: {steps} step is outside [{self.limits[0]}, {self.limits[1]}]")
+
+    def warnings(self, steps, current=None):
+        """steps への移動に対するインターロックの警告（current 省略時は位置を読む）"""
+        if self.interlock is None:
+            return []
+        if current is None:
+            current = self.position()
+        return [f"{self.name}: {w}" for w in self.interlock(current, steps)]
+
+    # ----- コマンド -----
+    def configure(self, speed=None, start_speed=None):
+        """速度 v<n> と起動速度 vs<n> の設定"""
+        if speed is not None:
+            self.ctrl.command(f"v{self.num} {speed}")
+            self.speed = speed
+        if start_speed is not None:
+            self.ctrl.command(f"vs{self.num} {start_speed}")
+
+    def query(self):
+        """r<n> を1回送り (status, position) を返す（status: 1=移動中, 0=停止）"""
+        st = parse_status(self.ctrl.command(f"r{self.num}"))
+        if self.pc not in st["pc"]:
+            raise PulseMotorError(f"{self.name}: no position in response")
+        self.last_position = st["pc"][self.pc]
+        return (1 if st["moving"] is None else st["moving"]), self.last_position
+
+    def position(self):
+        return self.query()[1]
+
+    def wait(self, target=None, timeout=None, on_poll=None):
+        """停止するまで待ち、停止位置 [step] を返す"""
+        _, position = wait_motion(self.query, target=target, speed=self.speed,
+                                  timeout=timeout, on_poll=on_poll)
+        return position
+
+    def start_move(self, steps, force=False):
+        """絶対位置 steps への移動を開始する（完了は待たない）"""
+        steps = int(steps)
+        if not force:
+            self.check_limits(steps)
+        value = f"{steps:+d}" if self.signed else f"{steps:d}"
+        with self.ctrl.lock:
+            self.ctrl.command(f"d{self.num} {value}")
+            self.ctrl.command(f"abs{self.num}")
+
+    def move_to(self, steps, force=False, wait=True, on_poll=None):
+        self.start_move(steps, force)
+        if wait:
+            return self.wait(target=steps, on_poll=on_poll)
+        return None
+
+    def move_to_unit(self, value, force=False, wait=True, on_poll=None):
+        return self.move_to(self.to_steps(value), force, wait, on_poll)
+
+    def home(self, wait=True, on_poll=None):
+        """原点復帰 (rtncr<n>)"""
+        self.ctrl.command(f"rtncr{self.num}")
+        if wait:
+            return self.wait(on_poll=on_poll)
+        return None
+
+
+def angle_warnings(current, target, small=SMALL_ANGLE):
+    """
+    回転ステージのインターロック。問題があれば警告文のリストを返す（なければ空）。
+      - 現在の角度と符号が変わる移動
+      - |角度| < 15 deg
+    """
+    warnings = []
+    if (current < 0 and target > 0) or (current > 0 and target < 0):
+        warnings.append("You are attempting to move to an angle with a different sign.")
+    if abs(target) < small:
+        warnings.append("The angle is less than 15 deg. This may be too small.")
+    return warnings
+
+
+def wait_many(targets, timeout=None, on_poll=None, poll_min=POLL_MIN, poll_max=POLL_MAX):
+    """
+    targets: {axis: 移動先 steps (不明なら None)}。全軸が止まるまで待ち {axis: 停止位置} を返す。
+    軸ごとに wait_motion と同じ考え方で次のポーリング時刻を決め、近いものから問い合わせる。
+    on_poll(axis, status, position) は問い合わせのたびに呼ぶ。
+    """
+    t0 = time.monotonic()
+    result = {}
+    pending = {}   # axis -> [次のポーリング時刻, 予測を過ぎた後の間隔]
+    longest = 0.0
+    for ax, target in targets.items():
+        status, position = ax.query()
+        if on_poll is not None:
+            on_poll(ax, status, position)
+        if status == 0:
+            result[ax] = position
+            continue
+        pending[ax] = [t0, poll_min]
+        if target is None:
+            longest = max(longest, TIMEOUT_DEFAULT)
+        else:
+            longest = max(longest, 2 * predict_time(target - position, ax.speed) + TIMEOUT_MARGIN)
+    deadline = t0 + (longest if timeout is None else timeout)
+
+    def schedule(ax, position):
+        target = targets[ax]
+        remaining = predict_time(target - position, ax.speed) if target is not None else 0.0
+        if remaining > poll_min:
+            interval = min(poll_max, remaining / 2)
+        else:
+            interval = pending[ax][1]
+            pending[ax][1] = min(poll_max, interval * 2)
+        pending[ax][0] = time.monotonic() + interval
+
+    for ax in pending:
+        schedule(ax, ax.last_position)
+
+    while pending:
+        ax = min(pending, key=lambda a: pending[a][0])
+        now = time.monotonic()
+        wake = min(pending[ax][0], deadline)
+        if wake > now:
+            time.sleep(wake - now)
+        status, position = ax.query()
+        if on_poll is not None:
+            on_poll(ax, status, position)
+        if status == 0:
+            result[ax] = position
+            del pending[ax]
+            continue
+        if time.monotonic() >= deadline:
+            names = ", ".join(a.name for a in pending)
+            raise TimeoutError(f"motion did not finish within {deadline - t0:.1f} s ({names})")
+        schedule(ax, position)
+    return result
+
+
+def move_many(moves, force=False, wait=True, timeout=None, on_poll=None):
+    """
+    moves: [(axis, steps), ...]（軸は重複しないこと）。
+    先に全軸のソフトリミットとインターロックを確認し、問題がなければ全軸の移動を一斉に開始する。
+    どれか1つでも引っかかれば何も動かさずに LimitError / InterlockError。
+    force=True ならリミットとインターロックを確認しない（確認済みのとき）。
+    wait=True なら全軸の停止を待って {axis: 停止位置} を返す（かかる時間は一番遅い軸の分）。
+    """
+    moves = [(ax, int(steps)) for ax, steps in moves]
+    if len({ax for ax, _ in moves}) != len(moves):
+        raise ValueError("the same axis appears twice in one move")
+    if not force:
+        warnings = []
+        for ax, steps in moves:
+            ax.check_limits(steps)
+            warnings += ax.warnings(steps)
+        if warnings:
+            raise InterlockError(warnings)
+    for ax, steps in moves:
+        ax.start_move(steps, force=True)
+    if not wait:
+        return None
+    return wait_many(dict(moves), timeout=timeout, on_poll=on_poll)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# coding: utf-8
+#
+# 角度・位置スキャン
+# 各点で「ターゲットを動かす → スケーラーをプリセット（電荷 or 時間）で計数 → 記録」を繰り返す。
+#   - ターゲットは target.py（デバイスサーバ）の API で動かす
+#   - 計数は scalerd.py の API で行う（start / stop で gStart / gStop のゲートパルスも出る）
+#   - 1点の計数が止まったらすぐ次の点への移動を送り、その移動中に記録の書き出しと
+#     スケーラーの reset / preset を済ませる（点と点の間に人の待ち時間が入らない）
+#
+#   python3 scan.py --axis Si-rot --range 30:90:5 --charge 1000 --out rot_scan.csv
+#   python3 scan.py --axis Si-pos --values 520,850,1170 --steps --time 60
+#
+# 出力 (CSV) は1点1行: 点番号, 軸, 目標値, 停止位置, カウント, 電荷, 計数時間, 各チャンネルのカウント など
+
+import argparse
+import csv
+import datetime
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scaler"))
+import scalerclient
+
+TARGET_URL = os.environ.get("TARGET_URL", "http://localhost:8008")
+
+JOB_POLL = 0.05   # 移動ジョブの状態を見る間隔 [s]（target.py 内の状態を読むだけで、シリアルには触らない）
+
+
+class ScanError(Exception):
+    pass
+
+
+# ============ target.py API ==============
+def target_request(path, body=None, url=TARGET_URL, timeout=5.0):
+    req = urllib.request.Request(
+        url + path,
+        data=None if body is None else json.dumps(body).encode(),
+        headers={"Content-Type": "application/json"},
+        method="GET" if body is None else "POST",
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as f:
+            return json.load(f)
+    except urllib.error.HTTPError as e:
+        return json.load(e)
+
+
+def start_move(axis, value, steps=False, force=False, url=TARGET_URL):
+    """移動を送ってジョブIDを返す（インターロックは target.py 側で確認する）"""
+    res = target_request("/api/moves", {"moves": {axis: value}, "units": not steps, "force": force}, url)
+    if not res.get("ok"):
+        raise ScanError(f"move {axis} to {value} rejected: {res.get('error')}")
+    return res["jobs"][axis]
+
+
+def wait_job(job_id, url=TARGET_URL):
+    while True:
+        job = target_request(f"/api/job/{job_id}", url=url)
+        if job.get("state") == "done":
+            return job
+        if job.get("state") in ("error", "cancelled") or "ok" in job:
+            raise ScanError(f"move job {job_id} failed: {job.get('error')}")
+        time.sleep(JOB_POLL)
+
+
+# ============ scalerd API ==============
+def scaler_command(action, url, **body):
+    res = scalerclient.command(action, url=url, **body)
+    if not res.get("ok"):
+        raise ScanError(f"scaler {action} failed: {res.get('error')}")
+    return res
+
+
+def count_until_stop(url):
+    """start してプリセットで止まるまでストリームを読み、止まった時点のスナップショットを返す"""
+    scaler_command("start", url)   # reset / start で stop_reason は None に戻っている
+    for snap in scalerclient.stream(url):
+        if not snap["running"] and snap["stop_reason"] is not None:
+            return snap
+    raise ScanError("scaler stream closed")
+
+
+# ============ scan ==============
+def parse_points(values=None, span=None):
+    """'30,45,60' または 'start:stop:step'（stop を含む）"""
+    if values:
+        return [float(v) for v in values.split(",") if v.strip()]
+    start, stop, step = (float(v) for v in span.split(":"))
+    if step == 0 or (stop - start) * step < 0:
+        raise ValueError(f"bad range: {span}")
+    n = int(round((stop - start) / step))
+    return [start + i * step for i in range(n + 1)]
+
+
+def run_scan(axis, points, counts=None, seconds=None, steps=False, force=False,
+             writer=None, target_url=TARGET_URL, scaler_url=scalerclient.SCALERD_URL):
+    """
+    points の各点で計数し、1点ごとの記録 (dict) のリストを返す。
+    writer があれば点ごとに writer(row) を呼ぶ（次の点への移動中に呼ばれる）。
+    """
+    rows = []
+    t_move = time.time()
+    job_id = start_move(axis, points[0], steps, force, target_url)
+    scaler_command("reset", scaler_url)
+    scaler_command("preset", scaler_url, counts=counts, seconds=seconds)
+    for i, value in enumerate(points):
+        job = wait_job(job_id, target_url)
+        move_time = time.time() - t_move
+
+        t_start = time.time()
+        snap = count_until_stop(scaler_url)
+
+        # 計数が終わったらすぐ次の点へ動かし、移動中に記録と次の計数の準備をする
+        if i + 1 < len(points):
+            t_move = time.time()
+            job_id = start_move(axis, points[i + 1], steps, force, target_url)
+
+        row = {
+            "point": i,
+            "axis": axis,
+            "target": value,
+            "position": job["result"],
+            "count": snap["count"],
+            "charge_nQ": snap["current"] * snap["time"],
+            "time_s": snap["time"],
+            "current_nQ_s": snap["current"],
+            "stop_reason": snap["stop_reason"],
+            "move_s": move_time,
+            "start": datetime.datetime.fromtimestamp(t_start).isoformat(timespec="seconds"),
+        }
+        for name, ch in snap.get("channels", {}).items():
+            row["ch_" + name] = ch["count"]
+        for name, ratio in snap.get("ratios", {}).items():
+            row["ratio_" + name] = ratio
+        rows.append(row)
+        if writer is not None:
+            writer(row)
+
+        if i + 1 < len(points):
+            scaler_command("reset", scaler_url)
+            scaler_command("preset", scaler_url, counts=counts, seconds=seconds)
+    return rows
+
+
+class CsvWriter:
+    """1点ごとに追記してflushする（途中で止まってもそれまでの点は残る）"""
+    def __init__(self, path):
+        self.file = open(path, "w", newline="") if path else None
+        self.writer = None
+
+    def __call__(self, row):
+        print("{point:3d}  {axis} {target:>8}  pos {position:6d}  count {count:8d}  "
+              "time {time_s:8.2f} s  move {move_s:5.1f} s".format(**row))
+        if self.file is None:
+            return
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.file, fieldnames=list(row))
+            self.writer.writeheader()
+        self.writer.writerow(row)
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="angle / position scan with scaler counting")
+    parser.add_argument("--axis", required=True, help="Si-rot / Si-pos / Ge")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--values", help="comma separated points, e.g. 30,45,60")
+    group.add_argument("--range", dest="span", help="start:stop:step (stop included)")
+    parser.add_argument("--steps", action="store_true", help="points are in steps (default: deg / mm)")
+    parser.add_argument("--charge", type=int, default=None, help="preset charge per point: N counts (x0.1 nQ)")
+    parser.add_argument("--time", type=float, default=None, help="preset time per point [s]")
+    parser.add_argument("--force", action="store_true", help="ignore interlock warnings (sign change, small angle)")
+    parser.add_argument("--out", default=None, help="CSV output file")
+    parser.add_argument("--target-url", default=TARGET_URL)
+    parser.add_argument("--scaler-url", default=scalerclient.SCALERD_URL)
+    args = parser.parse_args()
+
+    if args.charge is None and args.time is None:
+        parser.error("give --charge and/or --time")
+    points = parse_points(args.values, args.span)
+    if args.steps:
+        points = [int(p) for p in points]
+
+    writer = CsvWriter(args.out)
+    t0 = time.time()
+    try:
+        rows = run_scan(args.axis, points, args.charge, args.time, args.steps, args.force, writer,
+                        args.target_url, args.scaler_url)
+        print(f"{len(rows)} points in {time.time() - t0:.1f} s")
+    except (ScanError, OSError) as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        scalerclient.command("stop", url=args.scaler_url)
+        target_request("/api/stop/" + args.axis, {}, args.target_url)
+        print("\nScan aborted.")
+        sys.exit(1)
+    finally:
+        writer.close()
+
+if __name__ == "__main__":
+    main()
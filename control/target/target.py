@@ -4,41 +4,73 @@
 
 # ============ HEADERS ==============
 # basic
+import atexit
 import datetime
 import json
-import time
+import os
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer
 
 # for bottle
 from bottle import route, run
-from bottle import get, post, request
+from bottle import get, post, request, response
 from bottle import template
 from bottle import static_file
 
+# リクエストごとにスレッドを立てるサーバ
+# （移動中でも他のブラウザを待たせない。シリアルはワーカーが1本ずつ扱う）
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
 # Static file
 @get("/static/<filepath:re:.*\.css>")
 def css(filepath):
     return static_file(filepath, root="static/")
 
 # ============ FUNCTIONS ==============
-def set_value(ser,com,val):
-    command = "d" + com + " " + val + "\r\n"
-    ser.write(command.encode())
-    c = ser.readline()
-    print(c)
-    c = ser.readline()
-    print(c)
-    ser.write(("abs"+com+"\r\n").encode())
-    c = ser.readline()
-    print(c)
-
-def read_value(ser,com):
-    ser.write(("r"+com+"\r\n").encode())
-    while True :
-        c = ser.readline().decode().rstrip("\r\n")
-        print(c)
-        if c.find("PC"+com) > 0 :
-            line = c.find('=')+1
-            return int(c[line:])
+def submit(kind, axis, target=None, force=False):
+    # ジョブを積むだけ（移動の完了は待たない）。ソフトリミット外・インターロックの警告は画面に出す
+    try:
+        job = server.submit(kind, axis, target, force)
+        cc["msg"] = ""
+        return job
+    except (pulsemotor.PulseMotorError, ValueError) as e:
+        cc["msg"] = str(e)
+        print(e)
+        return None
+
+def state_note(st):
+    # 移動中・古い値の注記
+    text = ""
+    if st["moving"]:
+        text += " (moving)"
+    if st["stale"] and st["age"] is not None:
+        text += " (%.0f s ago)" % st["age"]
+    if st["error"]:
+        text += " [" + st["error"] + "]"
+    return text
+
+def pos_text(st):
+    if st["position"] is None:
+        return "?" + state_note(st)
+    return str(st["position"]) + state_note(st)
+
+def rot_text(st):
+    if st["position"] is None:
+        return "?" + state_note(st)
+    sang = ""
+    if st["position"] > 0:
+        sang = "+"
+    return sang + str(si_rot.to_unit(st["position"])) + state_note(st)
+
+def page():
+    # 表示する位置はワーカーが更新した状態から作る（ここではシリアルに触らない）
+    st = server.status()
+    cc["pos_rot"] = rot_text(st["Si-rot"])
+    cc["pos_si"]  = pos_text(st["Si-pos"])
+    cc["pos_ge"]  = pos_text(st["Ge"])
+    cc["now"] = str(datetime.datetime.today())[:19]
+    return template('index.html',**cc)
 
 def save_data():
     file = open("tgt_position.json","w")
@@ -53,57 +85,40 @@ def read_data():
 
 # ============ SERIAL SETUP ==============
 import serial
+import pulsemotor
+
+# ソフトリミット [step]（Si_tcon.py と同じ）
+ANG_LIMITS = (-2000, 2000)
+POS_LIMITS = (0, 1300)
+
+# PM_DEV_SI / PM_DEV_GE でポートを差し替えられる（pmsim.py のシミュレータなど）
+DEV_SI = os.environ.get("PM_DEV_SI", "/dev/ttyUSB0")
+DEV_GE = os.environ.get("PM_DEV_GE", "/dev/ttyUSB1")
+TIMING_FILE = "target_timing.json"
+atexit.register(pulsemotor.timing.dump, TIMING_FILE)   # 終了時にも書き出す
+
+ctrl0 = pulsemotor.Controller(serial.Serial(DEV_SI,timeout=3), name="Si", timeout=3)
+si_rot = ctrl0.axis("1", 0.05, "deg", limits=ANG_LIMITS, signed=True, name="Si-rot",
+                    interlock=pulsemotor.angle_warnings)
+si_pos = ctrl0.axis("2", 0.1, "mm", limits=POS_LIMITS, name="Si-pos")
+for ax in (si_rot, si_pos):
+    ax.configure(speed=100, start_speed=100)
+
+ctrl1 = pulsemotor.Controller(serial.Serial(DEV_GE,timeout=3), name="Ge", timeout=3)
+ge_pos = ctrl1.axis("1", 0.1, "mm", pc="", name="Ge")
+ge_pos.configure(speed=100, start_speed=100)
+
+cc = {"msg": ""}
+cc["set_rot"] = str(si_rot.to_unit(si_rot.position()))
+
+# ポートごとのワーカー（以後シリアルに触るのはワーカーだけ）
+# 止まっている軸も REFRESH_INTERVAL ごとにワーカーが読み直し、ページと API はその値を返す
+import devserver
+
+server = devserver.DeviceServer()
+server.add(ctrl0)
+server.add(ctrl1)
 
-ser0 = serial.Serial("/dev/ttyUSB0",timeout=3)
-ser0.flushInput()
-ser0.write("v 100\r\n".encode())
-time.sleep(0.02)
-print(ser0.readline().decode().rstrip("\r\n"))
-print(ser0.readline().decode().rstrip("\r\n"))
-time.sleep(0.02)
-ser0.write("vs 100\r\n".encode())
-time.sleep(0.02)
-print(ser0.readline().decode().rstrip("\r\n"))
-print(ser0.readline().decode().rstrip("\r\n"))
-time.sleep(0.02)
-ser0.write("v2 100\r\n".encode())
-time.sleep(0.02)
-print(ser0.readline().decode().rstrip("\r\n"))
-print(ser0.readline().decode().rstrip("\r\n"))
-time.sleep(0.02)
-ser0.write("vs2 100\r\n".encode())
-time.sleep(0.02)
-print(ser0.readline().decode().rstrip("\r\n"))
-print(ser0.readline().decode().rstrip("\r\n"))
-time.sleep(0.02)
-
-ser1 = serial.Serial("/dev/ttyUSB1",timeout=3)
-ser0.flushInput()
-ser1.write("v 100\r\n".encode())
-time.sleep(0.02)
-print(ser1.readline().decode().rstrip("\r\n"))
-print(ser1.readline().decode().rstrip("\r\n"))
-time.sleep(0.02)
-ser1.write("vs 100\r\n".encode())
-time.sleep(0.02)
-print(ser1.readline().decode().rstrip("\r\n"))
-print(ser1.readline().decode().rstrip("\r\n"))
-time.sleep(0.02)
-
-cc = {}
-
-cc["pos_ge"] = read_value(ser1,"")
-cc["pos_si"] = read_value(ser0,"2")
-
-cc["set_ge"]  = cc["pos_ge"] 
-cc["set_si"]  = cc["pos_si"]
-
-ang = read_value(ser0,"1")
-sang = ""
-if float(ang) > 0:
-    sang ="+"
-cc["pos_rot"] = sang + str(float(ang)/20.)
-cc["set_rot"] = str(float(ang)/20.)
 
 # ============ BOTTLE.py ==============
 tgt_pos = read_data()
@@ -114,9 +129,7 @@ cc.update(tgt_pos)
 # --- main page
 @route('/')
 def index():
-
-    cc["now"] = str(datetime.datetime.today())[:19]
-    return template('index.html',**cc)
+    return page()
 
 # --- post
 @post('/')
@@ -128,67 +141,123 @@ def post_index():
     # ===== Si Rotation =====
     # --- move
     if a == "move_rot" :
-        angle = request.forms.get("rot")
+        angle = request.forms.get("rot") or ""
         cc["set_rot"] = angle
-        
-        sign = ""
-        if angle[0:1] == "-":
-            sign = "-"
-            angle = angle[1:]
-        elif angle[0:1] == "+":
-            sign = "+"
-            angle = angle[1:]
-
-        angle = sign + str(int(float(angle)*20.))
-        set_value(ser0,"1",angle)
+        try:
+            steps = si_rot.to_steps(angle)
+        except (ValueError, TypeError):
+            cc["msg"] = "invalid angle: " + angle
+        else:
+            # 符号の反転・小角度は「ignore interlock」にチェックしたときだけ動かす
+            submit("move", "Si-rot", steps, force=bool(request.forms.get("force")))
         
     # --- read
     if a == "read_rot":
-        ang = read_value(ser0,"1")
-        sang = ""
-        if float(ang) > 0:
-            sang = "+"
-        cc["pos_rot"] = sang + str(float(ang)/20.)
+        job = submit("read", "Si-rot")
+        if job is not None:
+            job.wait(pulsemotor.FRAME_TIMEOUT)
 
     # --- stop
     if a == "stop_rot":
-        ser0.write("s\r\n".encode())
-        print(ser0.readline().decode().rstrip("\r\n"))
+        submit("stop", "Si-rot")
         
     # ===== Target =====
     # --- Si Target
     if a == "tSir" :
-        cc["pos_si"] = read_value(ser0,"2")
-    if a == "tSi0" :
-        set_value(ser0,"2",cc["tSi0"])
-    if a == "tSi1" :
-        set_value(ser0,"2",cc["tSi1"])
-    if a == "tSi2" :
-        set_value(ser0,"2",cc["tSi2"])
-    if a == "tSi3" :
-        set_value(ser0,"2",cc["tSi3"])
+        job = submit("read", "Si-pos")
+        if job is not None:
+            job.wait(pulsemotor.FRAME_TIMEOUT)
+    if a in ("tSi0", "tSi1", "tSi2", "tSi3"):
+        submit("move", "Si-pos", cc[a])
         
     # --- Ge Target
     if a == "tGer" :
-        cc["pos_ge"] = read_value(ser1,"")
-    if a == "tGe0" :
-        set_value(ser1,"",cc["tGe0"])
-    if a == "tGe1" :
-        set_value(ser1,"",cc["tGe1"])
-    if a == "tGe2" :
-        set_value(ser1,"",cc["tGe2"])
-    if a == "tGe3" :
-        set_value(ser1,"",cc["tGe3"])
-    if a == "tGe4" :
-        set_value(ser1,"",cc["tGe4"])
-        
-    
+        job = submit("read", "Ge")
+        if job is not None:
+            job.wait(pulsemotor.FRAME_TIMEOUT)
+    if a in ("tGe0", "tGe1", "tGe2", "tGe3", "tGe4"):
+        submit("move", "Ge", cc[a])
         
     # ===== return =====
-    cc["now"] = str(datetime.datetime.today())[:19]
-    return template('index.html',**cc)
+    return page()
+
+# ============ JSON API ==============
+# curl -X POST -d '{"steps": 850}' http://<host>:8008/api/move/Si-pos   -> {"job": "12", ...}
+# curl -X POST -d '{"value": -30}' http://<host>:8008/api/move/Si-rot   (単位: deg / mm)
+#   インターロックの警告があれば 409。"force": true で警告を無視する
+# curl -X POST http://<host>:8008/api/stop/Si-rot
+# curl http://<host>:8008/api/job/12
+# curl http://<host>:8008/api/status
+@post('/api/<kind:re:move|home|read|stop>/<axis>')
+def api_submit(kind, axis):
+    body = request.json or {}
+    try:
+        target = body.get("steps")
+        if kind == "move" and target is None:
+            target = server.axis(axis).to_steps(body["value"])
+        job = server.submit(kind, axis, target, force=bool(body.get("force")))
+    except pulsemotor.InterlockError as e:
+        response.status = 409
+        return {"ok": False, "error": str(e), "warnings": e.warnings}
+    except KeyError as e:
+        response.status = 404 if str(e).strip("'") == axis else 400
+        return {"ok": False, "error": f"unknown axis or missing argument: {e}"}
+    except (pulsemotor.PulseMotorError, ValueError, TypeError) as e:
+        response.status = 400
+        return {"ok": False, "error": str(e)}
+    return {"ok": True, "job": job.id}
+
+# 複数の軸を同時に動かす（全軸のリミット・インターロックを確認してから一斉に開始）
+# curl -X POST -d '{"moves": {"Si-pos": 520, "Si-rot": 600, "Ge": 1010}}' http://<host>:8008/api/moves
+#   "units": true なら値は deg / mm、"force": true ならインターロックの警告を無視する
+@post('/api/moves')
+def api_moves():
+    body = request.json or {}
+    try:
+        moves = body["moves"]
+        if body.get("units"):
+            moves = {name: server.axis(name).to_steps(value) for name, value in moves.items()}
+        jobs = server.submit_moves(moves, force=bool(body.get("force")))
+    except pulsemotor.InterlockError as e:
+        response.status = 409
+        return {"ok": False, "error": str(e), "warnings": e.warnings}
+    except KeyError as e:
+        response.status = 400
+        return {"ok": False, "error": f"unknown axis or missing argument: {e}"}
+    except (pulsemotor.PulseMotorError, ValueError, TypeError, AttributeError) as e:
+        response.status = 400
+        return {"ok": False, "error": str(e)}
+    return {"ok": True, "jobs": {job.axis: job.id for job in jobs}}
+
+@get('/api/job/<job_id>')
+def api_job(job_id):
+    job = server.job(job_id)
+    if job is None:
+        response.status = 404
+        return {"ok": False, "error": "unknown job"}
+    return job
+
+# シリアルの往復時間（コマンド種類ごとのヒストグラム）
+# curl http://<host>:8008/api/timing
+# curl -X POST http://<host>:8008/api/timing/dump      -> TIMING_FILE に書き出す
+# curl -X POST http://<host>:8008/api/timing/reset
+@get('/api/timing')
+def api_timing():
+    return pulsemotor.timing.to_dict()
 
+@post('/api/timing/<action:re:dump|reset>')
+def api_timing_action(action):
+    if action == "dump":
+        pulsemotor.timing.dump(TIMING_FILE)
+        return {"ok": True, "file": TIMING_FILE}
+    pulsemotor.timing.reset()
+    return {"ok": True}
 
+# 軸ごとの position / moving / updated / age / stale とターゲット位置の表
+@get('/api/status')
+def api_status():
+    return {"axes": server.status(), "presets": tgt_pos,
+            "now": str(datetime.datetime.today())[:19]}
 
-run(host='0.0.0.0', port=8008, debug=True)
 
+run(host='0.0.0.0', port=8008, server='wsgiref', server_class=ThreadingWSGIServer)